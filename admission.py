@@ -0,0 +1,129 @@
+# admission.py
+
+import os
+import math
+import shutil
+import threading
+from collections import deque
+
+# --- Admission control configuration ---
+ADMISSION_CONTROL = os.environ.get('ADMISSION_CONTROL', '1') == '1'
+# New jobs are turned away while their estimated queue wait exceeds this SLO
+ADMISSION_MAX_WAIT_SECONDS = float(os.environ.get('ADMISSION_MAX_WAIT_SECONDS', 300))
+ADMISSION_MIN_FREE_DISK_BYTES = int(os.environ.get('ADMISSION_MIN_FREE_DISK_BYTES', 1024 ** 3))
+ADMISSION_MIN_FREE_MEMORY_BYTES = int(os.environ.get('ADMISSION_MIN_FREE_MEMORY_BYTES', 256 * 1024 ** 2))
+# Assumed worker time per job until enough jobs have finished to measure it
+ADMISSION_DEFAULT_JOB_SECONDS = float(os.environ.get('ADMISSION_DEFAULT_JOB_SECONDS', 120))
+# Number of recent jobs the service time estimate is averaged over
+ADMISSION_HISTORY_SIZE = int(os.environ.get('ADMISSION_HISTORY_SIZE', 50))
+# cgroup v2 directory the memory limit and usage are read from
+CGROUP_DIR = '/sys/fs/cgroup'
+
+_service_times = deque(maxlen=ADMISSION_HISTORY_SIZE)
+_lock = threading.Lock()
+
+
+def record_service_time(seconds):
+    """Feeds the worker time of a finished job (last attempt start to finish) into the estimate."""
+    with _lock:
+        _service_times.append(seconds)
+
+
+def mean_service_time():
+    with _lock:
+        if not _service_times:
+            return ADMISSION_DEFAULT_JOB_SECONDS
+        return sum(_service_times) / len(_service_times)
+
+
+def estimated_wait(queued, running, workers):
+    """
+    Seconds a job submitted now would wait for a worker, assuming the
+    `workers` slots each get through one job per mean service time.
+    """
+    jobs_ahead = queued + running + 1 - workers
+    if jobs_ahead <= 0:
+        return 0.0
+    return jobs_ahead * mean_service_time() / workers
+
+
+def _inactive_file_bytes():
+    """Page cache in memory.stat's inactive_file, or 0 if it can't be read."""
+    try:
+        with open(os.path.join(CGROUP_DIR, 'memory.stat')) as f:
+            for line in f:
+                key, _, value = line.partition(' ')
+                if key == 'inactive_file':
+                    return int(value)
+    except (OSError, ValueError):
+        pass
+    return 0
+
+
+def free_memory_bytes():
+    """
+    Memory still available to this instance: the cgroup limit minus its
+    working set when running under one (Cloud Run, Docker), else
+    MemAvailable. None if neither can be read.
+
+    The working set is memory.current less inactive file cache, as the
+    kubelet counts it: memory.current includes the page cache the service's
+    own downloads and merges fill, which the kernel reclaims on demand.
+    """
+    try:
+        with open(os.path.join(CGROUP_DIR, 'memory.max')) as f:
+            limit = f.read().strip()
+        if limit != 'max':
+            with open(os.path.join(CGROUP_DIR, 'memory.current')) as f:
+                usage = int(f.read().strip())
+            return int(limit) - max(0, usage - _inactive_file_bytes())
+    except (OSError, ValueError):
+        pass
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def check(queued, running, workers, disk_path, frees_disk=True):
+    """
+    Decides whether a new job can be admitted.
+
+    Args:
+        queued (int): Jobs waiting for a worker, including pending retries.
+        running (int): Jobs currently running.
+        workers (int): Concurrent job capacity.
+        disk_path (str): A path on the filesystem downloads are written to.
+        frees_disk (bool): Whether finished jobs delete their files; if not,
+            a disk rejection carries no retry_after.
+
+    Returns:
+        dict: {'admit': bool, 'reason': str or None, 'estimated_wait': float,
+               'retry_after': int or None}
+    """
+    wait = estimated_wait(queued, running, workers)
+    decision = {'admit': True, 'reason': None, 'estimated_wait': round(wait, 1), 'retry_after': None}
+    if not ADMISSION_CONTROL:
+        return decision
+
+    free_memory = free_memory_bytes()
+    if shutil.disk_usage(disk_path).free < ADMISSION_MIN_FREE_DISK_BYTES:
+        # Space comes back as running jobs upload and delete their files; the first of
+        # them is due in about a service time divided among them. Nothing else frees it
+        retry_after = _retry_after(mean_service_time() / running) if frees_disk and running else None
+        decision.update(admit=False, reason='disk', retry_after=retry_after)
+    elif free_memory is not None and free_memory < ADMISSION_MIN_FREE_MEMORY_BYTES:
+        decision.update(admit=False, reason='memory', retry_after=_retry_after(mean_service_time() / 2))
+    elif wait > ADMISSION_MAX_WAIT_SECONDS:
+        # The queue drains at `workers` jobs per mean service time, so the wait
+        # falls back under the SLO after roughly the excess has passed
+        decision.update(admit=False, reason='queue', retry_after=_retry_after(wait - ADMISSION_MAX_WAIT_SECONDS))
+    return decision
+
+
+def _retry_after(seconds):
+    return max(1, math.ceil(seconds))
@@ -0,0 +1,207 @@
+# aiorunner.py
+
+import os
+import asyncio
+import contextvars
+import threading
+import logging
+from concurrent.futures import Future, ThreadPoolExecutor
+from jobqueue import JobQueue
+
+logger = logging.getLogger(__name__)
+
+# GCS uploads still go through the blocking storage client; they run on this
+# many threads while the event loop decides when each one starts
+ASYNC_UPLOAD_WORKERS = int(os.environ.get('ASYNC_UPLOAD_WORKERS', 4))
+
+
+class AsyncJobRunner:
+    """
+    Job runner built on one asyncio event loop thread (JOB_RUNNER=asyncio).
+
+    It is a drop-in for scheduler.JobScheduler: the same submit/cancel/pause/
+    drain interface, callable from any thread. But jobs are coroutines on the
+    loop rather than blocking calls on worker threads, so the downloader
+    subprocesses, their pipes, retry timers and watchdog checks all live on
+    the loop, and `worker_count` only caps concurrency instead of costing
+    a thread per slot.
+
+    Calls from other threads are marshalled onto the loop and wait on a
+    concurrent.futures.Future for the result; calls made on the loop itself
+    (e.g. a job scheduling its own retry) run directly.
+    """
+
+    def __init__(self, worker_count):
+        self.worker_count = worker_count
+        self.running = 0
+        self.paused = False
+        self._queue = JobQueue(worker_count)
+        self._timers = {}
+        self._limit_timer = None
+        self._runner = None
+        self._loop = None
+        self._loop_thread = None
+        self._start_lock = threading.Lock()
+        self.upload_executor = ThreadPoolExecutor(max_workers=ASYNC_UPLOAD_WORKERS,
+                                                  thread_name_prefix='async-upload')
+
+    # --- Loop management ---
+
+    def _ensure_loop(self):
+        with self._start_lock:
+            if self._loop is not None:
+                return
+            ready = threading.Event()
+
+            def run_loop():
+                self._loop = asyncio.new_event_loop()
+                asyncio.set_event_loop(self._loop)
+                ready.set()
+                self._loop.run_forever()
+
+            self._loop_thread = threading.Thread(target=run_loop, name='job-event-loop', daemon=True)
+            self._loop_thread.start()
+            ready.wait()
+
+    def _call(self, fn, *args):
+        """Runs fn(*args) on the loop thread and returns its result."""
+        self._ensure_loop()
+        if threading.current_thread() is self._loop_thread:
+            return fn(*args)
+        future = Future()
+
+        def run():
+            try:
+                future.set_result(fn(*args))
+            except Exception as e:
+                future.set_exception(e)
+
+        self._loop.call_soon_threadsafe(run)
+        return future.result()
+
+    def call_later_threadsafe(self, delay, fn, *args):
+        """Schedules fn(*args) on the loop after `delay` seconds, from any thread."""
+        self._ensure_loop()
+        self._loop.call_soon_threadsafe(self._loop.call_later, delay, fn, *args)
+
+    def call_every(self, interval, fn):
+        """Runs fn() on the loop every `interval` seconds."""
+        def tick():
+            try:
+                fn()
+            finally:
+                self._loop.call_later(interval, tick)
+
+        self.call_later_threadsafe(interval, tick)
+
+    async def run_blocking(self, fn, *args):
+        """
+        Awaits fn(*args) on the upload thread pool, in a copy of the caller's
+        contextvars (run_in_executor() doesn't carry them), so spans fn
+        starts nest under the caller's trace.
+        """
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(self.upload_executor, context.run, fn, *args)
+
+    # --- Scheduler interface ---
+
+    def start(self, runner, describe=None):
+        """`runner` is a coroutine function taking a job id; `describe` as for JobScheduler."""
+        def set_runner():
+            if self._runner is None:
+                self._runner = runner
+                if describe is not None:
+                    self._queue.describe = describe
+                logger.info(f"Async job runner started (max {self.worker_count} concurrent jobs)")
+                self._dispatch()
+        self._call(set_runner)
+
+    def submit(self, job_id):
+        def enqueue():
+            self._cancel_timer(job_id)
+            self._queue.push(job_id)
+            self._dispatch()
+        self._call(enqueue)
+
+    def submit_later(self, job_id, delay):
+        """Re-queues `job_id` after `delay` seconds; waiting costs a timer handle, nothing more."""
+        def arm():
+            self._cancel_timer(job_id)
+            self._timers[job_id] = self._loop.call_later(delay, self.submit, job_id)
+        self._call(arm)
+
+    def cancel(self, job_id):
+        """
+        Drops `job_id` from the queue or its pending retry timer.
+
+        Returns:
+            bool: True if the job was waiting and has been removed.
+        """
+        def remove():
+            if self._cancel_timer(job_id):
+                return True
+            return self._queue.remove(job_id)
+        return self._call(remove)
+
+    def pause(self):
+        """Stops new jobs from starting; running jobs are unaffected."""
+        def set_paused():
+            self.paused = True
+        self._call(set_paused)
+
+    def drain_queue(self):
+        """
+        Removes every queued job and pending retry.
+
+        Returns:
+            list: The job ids that were waiting, in queue order.
+        """
+        def drain():
+            waiting = self._queue.drain()
+            for job_id, handle in self._timers.items():
+                handle.cancel()
+                waiting.append(job_id)
+            self._timers.clear()
+            return waiting
+        return self._call(drain)
+
+    def queue_depth(self):
+        return len(self._queue)
+
+    def pending_retries(self):
+        return len(self._timers)
+
+    def lane_counts(self):
+        return self._call(self._queue.lane_counts)
+
+    # --- Internals (loop thread only) ---
+
+    def _cancel_timer(self, job_id):
+        handle = self._timers.pop(job_id, None)
+        if handle is None:
+            return False
+        handle.cancel()
+        return True
+
+    def _dispatch(self):
+        while self._runner and not self.paused and self.running < self.worker_count:
+            job_id = self._queue.pop()
+            if job_id is None:
+                if self._queue.retry_in is not None:
+                    # Held back by an origin's rate limit: look again once it has a token
+                    if self._limit_timer is not None:
+                        self._limit_timer.cancel()
+                    self._limit_timer = self._loop.call_later(self._queue.retry_in, self._dispatch)
+                break
+            self.running += 1
+            self._loop.create_task(self._run(job_id))
+
+    async def _run(self, job_id):
+        try:
+            await self._runner(job_id)
+        except Exception as e:
+            logger.error(f"Unhandled error while running job {job_id}: {e}", exc_info=True)
+        finally:
+            self.running -= 1
+            self._queue.task_done(job_id)
+            self._dispatch()
@@ -1,13 +1,19 @@
 # app.py
 
 import os
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, g
 # Keep existing imports for download/status functionality
-from download import handle_download, get_job_status
+from download import handle_download, get_job_status, cancel_job, get_job_log, admission_decision
 # Import the new function from folderUpload.py
 from folderUpload import upload_folder_to_gcs
 from flask_cors import CORS
 import logging
+import threading
+import shutdown
+import metrics
+import tracing
+import capture
+import retry
 from dotenv import load_dotenv # Import load_dotenv
 
 load_dotenv() # Load variables from .env file into environment
@@ -29,6 +35,42 @@ if not GCS_BUCKET_NAME:
 
     # The application might not function correctly.
 
+# --- Tracing (opt-in via ENABLE_TRACING=1) ---
+if tracing.setup_tracing():
+    @app.before_request
+    def start_request_span():
+        g.request_span = tracing.span(f"HTTP {request.method} {request.url_rule or request.path}",
+                                      {'http.method': request.method, 'http.target': request.path},
+                                      parent_headers=dict(request.headers))
+        g.request_span_handle = g.request_span.__enter__()
+
+    @app.after_request
+    def tag_request_span(response):
+        handle = g.get('request_span_handle')
+        if handle is not None:
+            handle.set_attribute('http.status_code', response.status_code)
+        return response
+
+    @app.teardown_request
+    def end_request_span(exc):
+        request_span = g.pop('request_span', None)
+        if request_span is not None:
+            request_span.__exit__(type(exc) if exc else None, exc, exc.__traceback__ if exc else None)
+
+# --- Request capture for load-test replay (opt-in via CAPTURE_REQUESTS=1) ---
+capture.install(app)
+
+# --- Extractor lookup ---
+# Load yt-dlp's extractors now rather than on the first /download (see retry.extractor_key)
+threading.Thread(target=retry.warm_extractors, name="warm-extractors", daemon=True).start()
+
+# --- Graceful shutdown ---
+# Cloud Run sends SIGTERM before stopping an instance: drain and checkpoint in-flight jobs
+shutdown.install()
+# Pick up jobs that a previously drained instance checkpointed to the bucket
+if GCS_BUCKET_NAME and os.environ.get('RESUME_CHECKPOINTS', '1') == '1':
+    threading.Thread(target=shutdown.resume_checkpointed_jobs, name="resume-checkpoints", daemon=True).start()
+
 # --- Routes ---
 
 @app.route('/download', methods=['POST'])
@@ -37,12 +79,37 @@ def download_route():
     if not GCS_BUCKET_NAME:
          logger.error("Download request failed: Server GCS bucket not configured.")
          return jsonify({'error': 'Server configuration error: GCS bucket not set.'}), 500
+    if shutdown.is_draining():
+        return jsonify({'error': 'Server is shutting down, please retry.'}), 503
     return handle_download() # handle_download likely uses GCS_BUCKET_NAME now
 
 @app.route('/status/<job_id>', methods=['GET'])
 def status_route(job_id):
     return get_job_status(job_id)
 
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job_route(job_id):
+    return cancel_job(job_id)
+
+@app.route('/jobs/<job_id>/log', methods=['GET'])
+def job_log_route(job_id):
+    return get_job_log(job_id)
+
+@app.route('/ready', methods=['GET'])
+def ready_route():
+    # Readiness probe: load balancers stop routing downloads here while it fails
+    if shutdown.is_draining():
+        return jsonify({'ready': False, 'reason': 'draining'}), 503
+    decision = admission_decision()
+    if not decision['admit']:
+        return jsonify({'ready': False, 'reason': decision['reason'], 'estimatedWait': decision['estimated_wait']}), 503
+    return jsonify({'ready': True, 'estimatedWait': decision['estimated_wait']})
+
+@app.route('/metrics', methods=['GET'])
+def metrics_route():
+    # Prometheus text exposition format
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
 # --- NEW ROUTE for uploading a folder ---
 @app.route('/upload-folder', methods=['POST'])
 def upload_folder_route():
@@ -72,6 +139,8 @@ def upload_folder_route():
     if not GCS_BUCKET_NAME:
         logger.error("Upload folder request failed: Server GCS bucket not configured.")
         return jsonify({'error': 'Server configuration error: GCS bucket not set.'}), 500
+    if shutdown.is_draining():
+        return jsonify({'error': 'Server is shutting down, please retry.'}), 503
 
     data = request.get_json()
     if not data:
@@ -94,12 +163,13 @@ def upload_folder_route():
     logger.warning("Reminder: Ensure the source folder exists and contains the intended files within the container's ephemeral filesystem at the time of execution.")
 
     try:
-        # Call the imported function
-        upload_summary = upload_folder_to_gcs(
-            bucket_name=GCS_BUCKET_NAME,
-            source_folder=source_folder_path,
-            destination_prefix=destination_prefix
-        )
+        # Call the imported function; the shutdown drain waits for it to finish
+        with shutdown.in_flight():
+            upload_summary = upload_folder_to_gcs(
+                bucket_name=GCS_BUCKET_NAME,
+                source_folder=source_folder_path,
+                destination_prefix=destination_prefix
+            )
         # Return the summary report from the upload function
         return jsonify(upload_summary), 200
     except FileNotFoundError as e:
@@ -0,0 +1,291 @@
+# bench/gcs_stub.py
+
+"""
+In-process stand-in for the parts of the GCS JSON API that the service uses
+(multipart and resumable uploads, list, media download, conditional delete).
+
+Point google-cloud-storage at it with STORAGE_EMULATOR_HOST=http://host:port
+(plus GOOGLE_CLOUD_PROJECT); the client then uses anonymous credentials. The
+stub checksums what it receives, so the client's upload verification runs
+exactly as against GCS, but it only keeps the bytes of small objects
+(checkpoints, job state) so long benchmarks don't fill memory.
+"""
+
+import base64
+import hashlib
+import itertools
+import json
+import re
+import threading
+import time
+import uuid
+import logging
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs, quote, unquote
+
+import google_crc32c
+
+from media_server import QuietThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# Objects up to this size keep their content so they can be downloaded again
+KEEP_CONTENT_BYTES = 1024 * 1024
+
+
+class GCSState:
+    """Object metadata (and small object contents) shared by all handler threads."""
+
+    def __init__(self, upload_bytes_per_second=None):
+        self.objects = {}  # (bucket, name) -> resource dict, content under '_content'
+        self.sessions = {}  # upload_id -> in-progress resumable upload
+        self.lock = threading.Lock()
+        self.generations = itertools.count(int(time.time() * 1e6))
+        self.upload_bytes_per_second = upload_bytes_per_second
+        self.stats = {'uploads': 0, 'uploaded_bytes': 0}
+
+    def store(self, bucket, name, size, md5, crc, content_type, content=None):
+        resource = {
+            'kind': 'storage#object',
+            'id': f"{bucket}/{name}",
+            'bucket': bucket,
+            'name': name,
+            'size': str(size),
+            'generation': str(next(self.generations)),
+            'metageneration': '1',
+            'contentType': content_type or 'application/octet-stream',
+            'md5Hash': base64.b64encode(md5.digest()).decode('ascii'),
+            'crc32c': base64.b64encode(crc.digest()).decode('ascii'),
+            'updated': time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime()),
+        }
+        with self.lock:
+            self.objects[(bucket, name)] = dict(resource, _content=content)
+            self.stats['uploads'] += 1
+            self.stats['uploaded_bytes'] += size
+        return resource
+
+
+class GCSRequestHandler(BaseHTTPRequestHandler):
+    state = None
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    # --- Routing ---
+
+    def do_POST(self):
+        path, query = self._split()
+        match = re.match(r'^/upload/storage/v1/b/([^/]+)/o$', path)
+        if not match:
+            return self._send_json(404, {'error': {'code': 404, 'message': 'Not Found'}})
+        upload_type = query.get('uploadType', [''])[0]
+        if upload_type == 'multipart':
+            return self._multipart_upload(match.group(1), query)
+        if upload_type == 'resumable':
+            return self._start_resumable(match.group(1), query)
+        self._send_json(400, {'error': {'code': 400, 'message': f'Unsupported uploadType {upload_type}'}})
+
+    def do_PUT(self):
+        path, query = self._split()
+        upload_id = query.get('upload_id', [None])[0]
+        if not path.startswith('/upload/storage/v1/b/') or upload_id is None:
+            return self._send_json(404, {'error': {'code': 404, 'message': 'Not Found'}})
+        self._resumable_chunk(upload_id)
+
+    def do_GET(self):
+        path, query = self._split()
+        match = re.match(r'^/storage/v1/b/([^/]+)/o$', path)
+        if match:
+            return self._list(match.group(1), query)
+        match = re.match(r'^/(download/)?storage/v1/b/([^/]+)/o/(.+)$', path)
+        if not match:
+            return self._send_json(404, {'error': {'code': 404, 'message': 'Not Found'}})
+        resource = self.state.objects.get((match.group(2), unquote(match.group(3))))
+        if resource is None:
+            return self._send_json(404, {'error': {'code': 404, 'message': 'No such object'}})
+        if match.group(1) or query.get('alt') == ['media']:
+            return self._send_media(resource)
+        self._send_json(200, _public(resource))
+
+    def do_DELETE(self):
+        path, query = self._split()
+        match = re.match(r'^/storage/v1/b/([^/]+)/o/(.+)$', path)
+        if not match:
+            return self._send_json(404, {'error': {'code': 404, 'message': 'Not Found'}})
+        key = (match.group(1), unquote(match.group(2)))
+        expected = query.get('ifGenerationMatch', [None])[0]
+        with self.state.lock:
+            resource = self.state.objects.get(key)
+            if resource is None:
+                return self._send_json(404, {'error': {'code': 404, 'message': 'No such object'}})
+            if expected is not None and expected != resource['generation']:
+                return self._send_json(412, {'error': {'code': 412, 'message': 'Precondition Failed'}})
+            del self.state.objects[key]
+        self._send_empty(204)
+
+    # --- Uploads ---
+
+    def _multipart_upload(self, bucket, query):
+        body = self._read_body()
+        boundary = re.search(r'boundary="?([^";]+)"?', self.headers.get('Content-Type', ''))
+        if not boundary:
+            return self._send_json(400, {'error': {'code': 400, 'message': 'Missing multipart boundary'}})
+        delimiter = b'--' + boundary.group(1).encode('ascii')
+        parts = [part for part in body.split(delimiter)[1:] if not part.startswith(b'--')]
+        if len(parts) != 2:
+            return self._send_json(400, {'error': {'code': 400, 'message': 'Expected metadata and media parts'}})
+        metadata = json.loads(_part_payload(parts[0]))
+        content = _part_payload(parts[1])
+        content_type = re.search(rb'content-type:\s*([^\r\n]+)', parts[1].split(b'\r\n\r\n', 1)[0], re.I)
+        self._throttle(len(content))
+        md5, crc = hashlib.md5(content), google_crc32c.Checksum(content)
+        resource = self.state.store(
+            bucket, metadata.get('name') or query.get('name', [''])[0], len(content), md5, crc,
+            content_type.group(1).decode('ascii') if content_type else None,
+            content if len(content) <= KEEP_CONTENT_BYTES else None)
+        self._send_json(200, resource)
+
+    def _start_resumable(self, bucket, query):
+        body = self._read_body()
+        metadata = json.loads(body) if body else {}
+        upload_id = uuid.uuid4().hex
+        self.state.sessions[upload_id] = {
+            'bucket': bucket,
+            'name': metadata.get('name') or query.get('name', [''])[0],
+            'content_type': self.headers.get('X-Upload-Content-Type') or metadata.get('contentType'),
+            'received': 0,
+            'md5': hashlib.md5(),
+            'crc': google_crc32c.Checksum(),
+            'content': bytearray(),
+        }
+        host = self.headers.get('Host', f"{self.server.server_address[0]}:{self.server.server_address[1]}")
+        location = f"http://{host}/upload/storage/v1/b/{quote(bucket)}/o?uploadType=resumable&upload_id={upload_id}"
+        self.send_response(200)
+        self.send_header('Location', location)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def _resumable_chunk(self, upload_id):
+        session = self.state.sessions.get(upload_id)
+        if session is None:
+            return self._send_json(404, {'error': {'code': 404, 'message': 'No such upload'}})
+        chunk = self._read_body()
+        # "bytes 0-99/200", "bytes 0-99/*" or "bytes */200" (status query / empty final chunk)
+        match = re.match(r'bytes (?:(\d+)-(\d+)|\*)/(\d+|\*)', self.headers.get('Content-Range', ''))
+        total = match.group(3) if match else '*'
+        if chunk:
+            if match is None or int(match.group(1)) != session['received']:
+                return self._send_json(400, {'error': {'code': 400, 'message': 'Unexpected Content-Range'}})
+            self._throttle(len(chunk))
+            session['received'] += len(chunk)
+            session['md5'].update(chunk)
+            session['crc'].update(chunk)
+            if session['content'] is not None:
+                if session['received'] <= KEEP_CONTENT_BYTES:
+                    session['content'] += chunk
+                else:
+                    session['content'] = None
+
+        if total != '*' and int(total) == session['received']:
+            del self.state.sessions[upload_id]
+            content = bytes(session['content']) if session['content'] is not None else None
+            resource = self.state.store(session['bucket'], session['name'], session['received'],
+                                        session['md5'], session['crc'], session['content_type'], content)
+            return self._send_json(200, resource)
+
+        self.send_response(308)
+        if session['received']:
+            self.send_header('Range', f"bytes=0-{session['received'] - 1}")
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    # --- Reads ---
+
+    def _list(self, bucket, query):
+        prefix = query.get('prefix', [''])[0]
+        with self.state.lock:
+            items = [_public(resource) for (b, name), resource in sorted(self.state.objects.items())
+                     if b == bucket and name.startswith(prefix)]
+        self._send_json(200, {'kind': 'storage#objects', 'items': items})
+
+    def _send_media(self, resource):
+        content = resource.get('_content')
+        if content is None:
+            return self._send_json(404, {'error': {'code': 404, 'message': 'Content not retained by the stub'}})
+        self.send_response(200)
+        self.send_header('Content-Type', resource['contentType'])
+        self.send_header('Content-Length', str(len(content)))
+        self.send_header('X-Goog-Hash', f"crc32c={resource['crc32c']},md5={resource['md5Hash']}")
+        self.send_header('X-Goog-Generation', resource['generation'])
+        self.end_headers()
+        self.wfile.write(content)
+
+    # --- Helpers ---
+
+    def _split(self):
+        parts = urlsplit(self.path)
+        return parts.path, parse_qs(parts.query)
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def _throttle(self, size):
+        if self.state.upload_bytes_per_second:
+            time.sleep(size / self.state.upload_bytes_per_second)
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=UTF-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_empty(self, status):
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+
+def _part_payload(part):
+    """Body of one multipart/related part, without its headers and trailing CRLF."""
+    payload = part.split(b'\r\n\r\n', 1)[1]
+    return payload[:-2] if payload.endswith(b'\r\n') else payload
+
+
+def _public(resource):
+    return {key: value for key, value in resource.items() if not key.startswith('_')}
+
+
+def start_gcs_stub(host='127.0.0.1', port=0, upload_bytes_per_second=None):
+    """
+    Serves the stub from a background thread.
+
+    Returns:
+        tuple: (server, base URL for STORAGE_EMULATOR_HOST, GCSState)
+    """
+    state = GCSState(upload_bytes_per_second)
+    handler = type('BoundGCSRequestHandler', (GCSRequestHandler,), {'state': state})
+    server = QuietThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, name='bench-gcs-stub', daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}", state
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Run a minimal GCS JSON API stand-in.')
+    parser.add_argument('--port', type=int, default=9023)
+    parser.add_argument('--rate', type=float, help='upload limit in bytes/s per request')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    server, base_url, state = start_gcs_stub(port=args.port, upload_bytes_per_second=args.rate)
+    logger.info(f"GCS stand-in listening; export STORAGE_EMULATOR_HOST={base_url} GOOGLE_CLOUD_PROJECT=bench")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,265 @@
+# bench/media_server.py
+
+"""
+Local origin serving test media that yt-dlp's generic extractor can handle:
+
+    /progressive/<id>.mp4   single progressive file (HTTP Range supported unless
+                            started with ranges=False)
+    /hls/<id>.m3u8          HLS VOD playlist plus its segments
+    /dash/<id>.mpd          DASH manifest plus its segments
+
+<id> is arbitrary and only changes the title yt-dlp derives from the URL, so
+concurrent benchmark jobs don't collide on output names. With ffmpeg on PATH
+the media is real (testsrc + sine, so merges and fixups behave as they do in
+production); otherwise it is synthetic payload of the same shape.
+"""
+
+import os
+import re
+import shutil
+import sys
+import subprocess
+import tempfile
+import threading
+import time
+import logging
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPES = {
+    '.mp4': 'video/mp4',
+    '.m3u8': 'application/vnd.apple.mpegurl',
+    '.ts': 'video/mp2t',
+    '.mpd': 'application/dash+xml',
+    '.m4s': 'video/iso.segment',
+}
+
+
+def generate_media(media_dir, duration=10, segment_seconds=2, bitrate=4_000_000, use_ffmpeg=None):
+    """
+    Writes progressive/, hls/ and dash/ test media into `media_dir`.
+
+    Returns:
+        dict: {'progressive': bytes, 'hls': bytes, 'dash': bytes} total payload sizes.
+    """
+    if use_ffmpeg is None:
+        use_ffmpeg = shutil.which('ffmpeg') is not None
+    for kind in ('progressive', 'hls', 'dash'):
+        os.makedirs(os.path.join(media_dir, kind), exist_ok=True)
+    if use_ffmpeg:
+        _generate_with_ffmpeg(media_dir, duration, segment_seconds, bitrate)
+    else:
+        _generate_synthetic(media_dir, duration, segment_seconds, bitrate)
+    return {kind: _dir_size(os.path.join(media_dir, kind)) for kind in ('progressive', 'hls', 'dash')}
+
+
+def _generate_with_ffmpeg(media_dir, duration, segment_seconds, bitrate):
+    source = ['-f', 'lavfi', '-i', f'testsrc=size=1280x720:rate=30:duration={duration}',
+              '-f', 'lavfi', '-i', f'sine=frequency=440:duration={duration}']
+    encode = ['-c:v', 'libx264', '-preset', 'ultrafast', '-b:v', str(bitrate), '-g', '60', '-c:a', 'aac']
+    outputs = [
+        ['-movflags', '+faststart', os.path.join(media_dir, 'progressive', 'media.mp4')],
+        ['-f', 'hls', '-hls_time', str(segment_seconds), '-hls_playlist_type', 'vod',
+         '-hls_segment_filename', os.path.join(media_dir, 'hls', 'seg%03d.ts'),
+         os.path.join(media_dir, 'hls', 'index.m3u8')],
+        ['-f', 'dash', '-seg_duration', str(segment_seconds), '-use_template', '1', '-use_timeline', '0',
+         os.path.join(media_dir, 'dash', 'manifest.mpd')],
+    ]
+    for output in outputs:
+        subprocess.run(['ffmpeg', '-y', '-loglevel', 'error'] + source + encode + output, check=True)
+
+
+def _generate_synthetic(media_dir, duration, segment_seconds, bitrate):
+    total_bytes = duration * bitrate // 8
+    segment_count = max(1, duration // segment_seconds)
+    segment_bytes = total_bytes // segment_count
+
+    with open(os.path.join(media_dir, 'progressive', 'media.mp4'), 'wb') as f:
+        f.write(os.urandom(total_bytes))
+
+    # TS segments are sequences of 188-byte packets starting with the 0x47 sync byte
+    packet_count = max(1, segment_bytes // 188)
+    playlist = ['#EXTM3U', '#EXT-X-VERSION:3', f'#EXT-X-TARGETDURATION:{segment_seconds}',
+                '#EXT-X-MEDIA-SEQUENCE:0', '#EXT-X-PLAYLIST-TYPE:VOD']
+    for i in range(segment_count):
+        with open(os.path.join(media_dir, 'hls', f'seg{i:03d}.ts'), 'wb') as f:
+            f.write(b''.join(b'\x47' + os.urandom(187) for _ in range(packet_count)))
+        playlist += [f'#EXTINF:{segment_seconds:.1f},', f'seg{i:03d}.ts']
+    playlist.append('#EXT-X-ENDLIST')
+    with open(os.path.join(media_dir, 'hls', 'index.m3u8'), 'w') as f:
+        f.write('\n'.join(playlist) + '\n')
+
+    # One muxed representation, so yt-dlp needs no merge when ffmpeg is absent
+    with open(os.path.join(media_dir, 'dash', 'init.mp4'), 'wb') as f:
+        f.write(os.urandom(1024))
+    for i in range(segment_count):
+        with open(os.path.join(media_dir, 'dash', f'seg{i:03d}.m4s'), 'wb') as f:
+            f.write(os.urandom(segment_bytes))
+    segments = '\n'.join(f'          <SegmentURL media="seg{i:03d}.m4s"/>' for i in range(segment_count))
+    mpd = f"""<?xml version="1.0" encoding="utf-8"?>
+<MPD xmlns="urn:mpeg:dash:schema:mpd:2011" type="static" mediaPresentationDuration="PT{duration}S"
+     minBufferTime="PT{segment_seconds}S" profiles="urn:mpeg:dash:profile:isoff-on-demand:2011">
+  <Period>
+    <AdaptationSet mimeType="video/mp4" segmentAlignment="true">
+      <Representation id="muxed" codecs="avc1.4d401f,mp4a.40.2" width="1280" height="720"
+                      bandwidth="{bitrate}" frameRate="30">
+        <SegmentList duration="{segment_seconds}" timescale="1">
+          <Initialization sourceURL="init.mp4"/>
+{segments}
+        </SegmentList>
+      </Representation>
+    </AdaptationSet>
+  </Period>
+</MPD>
+"""
+    with open(os.path.join(media_dir, 'dash', 'manifest.mpd'), 'w') as f:
+        f.write(mpd)
+
+
+def _dir_size(path):
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+
+class MediaRequestHandler(SimpleHTTPRequestHandler):
+    """Static handler with Range support and an optional per-connection rate limit."""
+
+    media_dir = None
+    bytes_per_second = None  # None = unthrottled
+    ranges = True  # False: an origin that ignores Range and sends no Accept-Ranges
+    protocol_version = 'HTTP/1.1'
+
+    # /<kind>/<id>.<manifest ext> maps to that kind's manifest; anything else is a segment
+    MANIFESTS = {'progressive': ('.mp4', 'media.mp4'), 'hls': ('.m3u8', 'index.m3u8'), 'dash': ('.mpd', 'manifest.mpd')}
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    def _resolve(self):
+        match = re.match(r'^/(progressive|hls|dash)/([^/?]+)', self.path)
+        if not match:
+            return None
+        kind, name = match.groups()
+        extension, manifest = self.MANIFESTS[kind]
+        filename = manifest if name.endswith(extension) and not name.startswith('seg') else name
+        path = os.path.join(self.media_dir, kind, os.path.basename(filename))
+        return path if os.path.isfile(path) else None
+
+    def do_HEAD(self):
+        self._serve(head_only=True)
+
+    def do_GET(self):
+        self._serve(head_only=False)
+
+    def _serve(self, head_only):
+        path = self._resolve()
+        if path is None:
+            self.send_error(404)
+            return
+        size = os.path.getsize(path)
+        start, end = 0, size - 1
+        range_header = self.headers.get('Range')
+        match = re.match(r'bytes=(\d*)-(\d*)', range_header or '')
+        if self.ranges and match and (match.group(1) or match.group(2)):
+            if match.group(1):
+                start = int(match.group(1))
+                end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+            else:
+                start = max(0, size - int(match.group(2)))
+            if start >= size:
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{size}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        else:
+            self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPES.get(os.path.splitext(path)[1], 'application/octet-stream'))
+        self.send_header('Content-Length', str(end - start + 1))
+        if self.ranges:
+            self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+        if head_only:
+            return
+        with open(path, 'rb') as f:
+            f.seek(start)
+            self._copy(f, end - start + 1)
+
+    def _copy(self, f, remaining):
+        chunk_size = 64 * 1024
+        started_at = time.monotonic()
+        sent = 0
+        while remaining > 0:
+            chunk = f.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            try:
+                self.wfile.write(chunk)
+            except (BrokenPipeError, ConnectionResetError):
+                return
+            sent += len(chunk)
+            remaining -= len(chunk)
+            if self.bytes_per_second:
+                ahead = sent / self.bytes_per_second - (time.monotonic() - started_at)
+                if ahead > 0:
+                    time.sleep(ahead)
+
+
+class QuietThreadingHTTPServer(ThreadingHTTPServer):
+    """Clients (yt-dlp probing, cancelled jobs) hang up mid-response all the time."""
+
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        if not isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            super().handle_error(request, client_address)
+
+
+def start_media_server(media_dir=None, host='127.0.0.1', port=0, bytes_per_second=None, ranges=True,
+                       **generate_options):
+    """
+    Generates media (unless `media_dir` already holds it) and serves it from a
+    background thread.
+
+    Returns:
+        tuple: (server, base URL, payload sizes dict)
+    """
+    if media_dir is None:
+        media_dir = tempfile.mkdtemp(prefix='bench-media-')
+    if not os.path.isfile(os.path.join(media_dir, 'progressive', 'media.mp4')):
+        sizes = generate_media(media_dir, **generate_options)
+    else:
+        sizes = {kind: _dir_size(os.path.join(media_dir, kind)) for kind in ('progressive', 'hls', 'dash')}
+
+    handler = type('BoundMediaRequestHandler', (MediaRequestHandler,),
+                   {'media_dir': media_dir, 'bytes_per_second': bytes_per_second, 'ranges': ranges})
+    server = QuietThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, name='bench-media-server', daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}", sizes
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Serve synthetic progressive/HLS/DASH media for benchmarks.')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--media-dir')
+    parser.add_argument('--duration', type=int, default=10, help='media duration in seconds')
+    parser.add_argument('--bitrate', type=int, default=4_000_000, help='bits per second')
+    parser.add_argument('--rate', type=float, help='per-connection limit in bytes/s')
+    parser.add_argument('--synthetic', action='store_true', help='do not use ffmpeg even if available')
+    parser.add_argument('--no-ranges', action='store_true', help='ignore Range headers, like some origins')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    server, base_url, sizes = start_media_server(
+        args.media_dir, port=args.port, bytes_per_second=args.rate, ranges=not args.no_ranges, duration=args.duration,
+        bitrate=args.bitrate, use_ffmpeg=False if args.synthetic else None)
+    logger.info(f"Serving media at {base_url} (payload bytes: {sizes})")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,205 @@
+# bench/replay.py
+
+"""
+Replays a request capture (capture.py, CAPTURE_REQUESTS=1) against a test
+instance, keeping the captured inter-arrival times scaled by --speed:
+
+    python bench/replay.py captures.ndjson --target http://127.0.0.1:8080 --speed 10
+
+Job ids in /status polls are mapped to the ids the test instance hands out
+for the replayed /download requests; a poll is held back until the download
+it refers to has been answered. --fake-urls rewrites download URLs to
+fake:// URLs (one fake origin per captured host) so an instance running with
+DOWNLOAD_BACKEND=fake can reproduce an incident without touching the sites.
+Every request comes from this one host, so run the test instance with
+TRUST_CLIENT_ID_HEADER=1 for the captured clients (sent as X-Client-Id) to
+keep their own fair-queuing shares.
+"""
+
+import sys
+import json
+import math
+import hashlib
+import argparse
+import threading
+import time
+import logging
+import urllib.request
+import urllib.error
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of `values` (None when empty), as in run_bench.py."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(1, math.ceil(pct / 100 * len(ordered))) - 1]
+
+
+def load_capture(path):
+    records = []
+    with open(path) as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                logger.warning(f"Skipping malformed capture line {line_number}")
+    records.sort(key=lambda record: record['t'])
+    return records
+
+
+def fake_url(url):
+    """Maps a captured URL to a stable fake:// URL on a per-host fake origin."""
+    parsed = urlparse(url)
+    digest = hashlib.sha1(url.encode('utf-8')).hexdigest()[:12]
+    return f"fake://{parsed.netloc or 'unknown'}/{digest}"
+
+
+class Replayer:
+    def __init__(self, target, speed, max_in_flight, rewrite_fake, timeout):
+        self.target = target.rstrip('/')
+        self.speed = speed
+        self.rewrite_fake = rewrite_fake
+        self.timeout = timeout
+        self.pool = ThreadPoolExecutor(max_workers=max_in_flight)
+        self.job_ids = {}  # captured job id -> replayed job id
+        self.lock = threading.Lock()
+        self.results = []
+        self.unmapped_status = 0
+        # Set once the replayed /download for a captured job id has answered;
+        # its /status polls wait for that, however much the replay is sped up
+        self.job_ready = {}
+
+    def _request(self, record):
+        path = record['p']
+        body = record.get('b')
+        if path.startswith('/status/'):
+            captured_id = path.rsplit('/', 1)[1]
+            if captured_id in self.job_ready:
+                self.job_ready[captured_id].wait(self.timeout)
+            with self.lock:
+                replayed_id = self.job_ids.get(captured_id)
+                if replayed_id is None:
+                    self.unmapped_status += 1
+            path = f"/status/{replayed_id or captured_id}"
+        if body and self.rewrite_fake and body.get('url'):
+            body = dict(body, url=fake_url(body['url']))
+
+        data = json.dumps(body).encode('utf-8') if body is not None else None
+        headers = {'X-Client-Id': str(record.get('c', 'replay'))}
+        if data is not None:
+            headers['Content-Type'] = 'application/json'
+        request = urllib.request.Request(self.target + path, data=data, method=record['m'], headers=headers)
+        started = time.monotonic()
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                status, payload = response.status, response.read()
+        except urllib.error.HTTPError as e:
+            status, payload = e.code, e.read()
+        except (urllib.error.URLError, OSError):
+            status, payload = None, b''
+        latency = time.monotonic() - started
+
+        if record['p'] == '/download' and record.get('j') and status in (200, 202):
+            try:
+                new_id = json.loads(payload).get('jobId')
+            except ValueError:
+                new_id = None
+            if new_id:
+                with self.lock:
+                    self.job_ids[record['j']] = new_id
+        if record['p'] == '/download' and record.get('j') in self.job_ready:
+            self.job_ready[record['j']].set()
+        with self.lock:
+            self.results.append({'endpoint': _endpoint(record['p']), 'status': status,
+                                 'captured_status': record.get('s'), 'latency': latency})
+
+    def run(self, records):
+        """Dispatches every record at its scaled offset; returns the dispatch lag samples."""
+        if not records:
+            return []
+        self.job_ready = {record['j']: threading.Event() for record in records if record.get('j')}
+        first = records[0]['t']
+        started = time.monotonic()
+        lags = []
+        for record in records:
+            due = started + (record['t'] - first) / self.speed
+            delay = due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            lags.append(max(0.0, time.monotonic() - due))
+            self.pool.submit(self._request, record)
+        self.pool.shutdown(wait=True)
+        return lags
+
+
+def _endpoint(path):
+    return '/status' if path.startswith('/status/') else path
+
+
+def summarise(replayer, records, lags, wall_seconds):
+    by_endpoint = {}
+    for endpoint in sorted({r['endpoint'] for r in replayer.results}):
+        results = [r for r in replayer.results if r['endpoint'] == endpoint]
+        latencies = [r['latency'] for r in results if r['status'] is not None]
+        by_endpoint[endpoint] = {
+            'requests': len(results),
+            'status_codes': {str(code): sum(1 for r in results if r['status'] == code)
+                             for code in sorted({r['status'] for r in results}, key=str)},
+            'status_matches_capture': sum(1 for r in results if r['status'] == r['captured_status']),
+            'latency_seconds': {'p50': percentile(latencies, 50), 'p95': percentile(latencies, 95),
+                                'p99': percentile(latencies, 99)},
+        }
+    captured_span = records[-1]['t'] - records[0]['t'] if records else 0
+    return {
+        'speed': replayer.speed,
+        'requests': len(records),
+        'captured_seconds': round(captured_span, 3),
+        'wall_seconds': round(wall_seconds, 3),
+        'dispatch_lag_seconds': {'p50': percentile(lags, 50), 'p99': percentile(lags, 99),
+                                 'max': max(lags) if lags else None},
+        'unmapped_status_requests': replayer.unmapped_status,
+        'endpoints': by_endpoint,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Replay captured requests against a test instance.')
+    parser.add_argument('capture', help='NDJSON file written by CAPTURE_REQUESTS=1')
+    parser.add_argument('--target', default='http://127.0.0.1:8080')
+    parser.add_argument('--speed', type=float, default=1.0, help='time compression, e.g. 1, 10, 100')
+    parser.add_argument('--max-in-flight', type=int, default=512, help='concurrent outstanding requests')
+    parser.add_argument('--fake-urls', action='store_true', help='rewrite download URLs to fake:// URLs')
+    parser.add_argument('--timeout', type=float, default=3600, help='per-request timeout in seconds')
+    parser.add_argument('--output', help='write the JSON results here (default: stdout)')
+    args = parser.parse_args(argv)
+    if args.speed <= 0:
+        parser.error('--speed must be positive')
+
+    records = load_capture(args.capture)
+    logger.info(f"Replaying {len(records)} requests at {args.speed:g}x against {args.target}")
+    replayer = Replayer(args.target, args.speed, args.max_in_flight, args.fake_urls, args.timeout)
+    started = time.monotonic()
+    lags = replayer.run(records)
+    results = summarise(replayer, records, lags, time.monotonic() - started)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+        logger.info(f"Results written to {args.output}")
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
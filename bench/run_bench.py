@@ -0,0 +1,380 @@
+# bench/run_bench.py
+
+"""
+End-to-end throughput benchmark.
+
+Starts the local media origin and the GCS stand-in, launches the service
+against them as a subprocess (from a scratch copy of the code, so downloads
+don't land in the checkout), then drives /download and /upload-folder at the
+requested concurrency. Results are written as JSON:
+
+    python bench/run_bench.py --jobs 200 --concurrency 16 --output results.json
+
+The service needs yt-dlp on PATH (and ffmpeg for merges) exactly as in
+production. CPU and memory figures cover the service process and all of
+its descendants (yt-dlp, ffmpeg) and are read from /proc, so Linux only.
+"""
+
+import os
+import sys
+import json
+import glob
+import math
+import shutil
+import socket
+import argparse
+import platform
+import subprocess
+import tempfile
+import threading
+import time
+import logging
+import urllib.request
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from media_server import start_media_server  # noqa: E402
+from gcs_stub import start_gcs_stub  # noqa: E402
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MANIFEST_EXTENSIONS = {'progressive': 'mp4', 'hls': 'm3u8', 'dash': 'mpd'}
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+# --- Process tree sampling ---
+
+def _children(pid):
+    """Direct children of `pid`, from /proc/<pid>/task/*/children."""
+    children = []
+    for path in glob.glob(f'/proc/{pid}/task/*/children'):
+        try:
+            with open(path) as f:
+                children.extend(int(child) for child in f.read().split())
+        except OSError:
+            continue
+    return children
+
+
+def _process_tree(pid):
+    tree, pending = [], [pid]
+    while pending:
+        current = pending.pop()
+        tree.append(current)
+        pending.extend(_children(current))
+    return tree
+
+
+def _read_stat(pid):
+    """Returns (cpu seconds including reaped children, rss bytes) or None if gone."""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            # The command name may contain spaces; fields resume after the last ')'
+            fields = f.read().rsplit(')', 1)[1].split()
+    except (OSError, IndexError):
+        return None
+    utime, stime, cutime, cstime = (int(value) for value in fields[11:15])
+    return (utime + stime + cutime + cstime) / CLOCK_TICKS, int(fields[21]) * PAGE_SIZE
+
+
+class ResourceSampler:
+    """
+    Polls the service's process tree for CPU time and resident memory.
+
+    CPU is the root's own plus reaped-children time (yt-dlp runs are waited
+    on by the service, so they land in cutime/cstime) plus whatever live
+    descendants have used so far; RSS is summed across the tree.
+    """
+
+    def __init__(self, pid, interval=0.2):
+        self.pid = pid
+        self.interval = interval
+        self.peak_rss_bytes = 0
+        self._live_cpu = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='bench-sampler', daemon=True)
+        self._baseline = self.cpu_seconds()
+
+    def cpu_seconds(self):
+        root = _read_stat(self.pid)
+        return root[0] if root else 0.0
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            rss = 0
+            live_cpu = {}
+            for pid in _process_tree(self.pid):
+                stat = _read_stat(pid)
+                if stat is None:
+                    continue
+                rss += stat[1]
+                if pid != self.pid:
+                    live_cpu[pid] = stat[0]
+            self._live_cpu = live_cpu
+            self.peak_rss_bytes = max(self.peak_rss_bytes, rss)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return {
+            'cpu_seconds': round(self.cpu_seconds() + sum(self._live_cpu.values()) - self._baseline, 3),
+            'peak_rss_bytes': self.peak_rss_bytes,
+        }
+
+
+# --- Service process ---
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _prepare_app_dir(app_dir):
+    if app_dir:
+        return app_dir, False
+    app_dir = tempfile.mkdtemp(prefix='bench-app-')
+    for path in glob.glob(os.path.join(REPO_ROOT, '*.py')) + [os.path.join(REPO_ROOT, 'cookies.txt')]:
+        if os.path.isfile(path):
+            shutil.copy(path, app_dir)
+    return app_dir, True
+
+
+def start_service(app_dir, port, gcs_url, workers, extra_env=None, server='flask', threads=64):
+    env = dict(os.environ,
+               PORT=str(port),
+               GCS_BUCKET_NAME='bench',
+               STORAGE_EMULATOR_HOST=gcs_url,
+               GOOGLE_CLOUD_PROJECT='bench',
+               RESUME_CHECKPOINTS='0',
+               MAX_WORKERS=str(workers))
+    env.update(extra_env or {})
+    if server == 'gunicorn':
+        command = [sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{port}',
+                   '--worker-class', 'gthread', '--threads', str(threads), 'app:app']
+    else:
+        command = [sys.executable, 'app.py']
+    log = open(os.path.join(app_dir, 'service.log'), 'w')
+    process = subprocess.Popen(command, cwd=app_dir, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Service exited with {process.returncode}; see {log.name}")
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/metrics', timeout=1).read()
+            return process
+        except (urllib.error.URLError, OSError):
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"Service did not become ready; see {log.name}")
+
+
+# --- Load generation ---
+
+def _post_json(url, payload, timeout):
+    request = urllib.request.Request(url, data=json.dumps(payload).encode('utf-8'), method='POST',
+                                     headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return response.status, json.loads(response.read() or b'{}')
+    except urllib.error.HTTPError as e:
+        try:
+            return e.code, json.loads(e.read() or b'{}')
+        except ValueError:
+            return e.code, {}
+
+
+def _parse_mix(text):
+    weights = {}
+    for item in text.split(','):
+        kind, _, weight = item.partition('=')
+        if kind not in MANIFEST_EXTENSIONS:
+            raise argparse.ArgumentTypeError(f"unknown media kind '{kind}'")
+        weights[kind] = int(weight or 1)
+    return weights
+
+
+def _job_kinds(count, weights):
+    """Deterministic interleaving of media kinds in proportion to their weights."""
+    cycle = [kind for kind, weight in weights.items() for _ in range(weight)]
+    return [cycle[i % len(cycle)] for i in range(count)]
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of `values` (None when empty)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def _summarise(name, results, wall_seconds, payload_bytes):
+    latencies = [r['latency'] for r in results if r['ok']]
+    return {
+        'scenario': name,
+        'jobs': len(results),
+        'succeeded': len(latencies),
+        'failed': len(results) - len(latencies),
+        'status_codes': {str(code): sum(1 for r in results if r['status'] == code)
+                         for code in sorted({r['status'] for r in results})},
+        'wall_seconds': round(wall_seconds, 3),
+        'jobs_per_second': round(len(latencies) / wall_seconds, 3) if wall_seconds else None,
+        'latency_seconds': {
+            'p50': percentile(latencies, 50),
+            'p95': percentile(latencies, 95),
+            'p99': percentile(latencies, 99),
+            'max': max(latencies) if latencies else None,
+        },
+        'bytes': payload_bytes,
+        'bytes_per_second': round(payload_bytes / wall_seconds) if wall_seconds else None,
+    }
+
+
+def run_download_scenario(base_url, media_url, sizes, jobs, concurrency, weights, timeout):
+    kinds = _job_kinds(jobs, weights)
+    run_id = int(time.time())
+
+    def one(index):
+        kind = kinds[index]
+        url = f"{media_url}/{kind}/bench{run_id}n{index}.{MANIFEST_EXTENSIONS[kind]}"
+        started = time.monotonic()
+        try:
+            status, body = _post_json(f'{base_url}/download', {'url': url}, timeout)
+        except (urllib.error.URLError, OSError) as e:
+            status, body = None, {'error': str(e)}
+        ok = status == 200 and bool(body.get('filename'))
+        return {'kind': kind, 'status': status, 'ok': ok, 'latency': time.monotonic() - started}
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, range(jobs)))
+    wall = time.monotonic() - started
+    payload = sum(sizes[r['kind']] for r in results if r['ok'])
+    summary = _summarise('download', results, wall, payload)
+    summary['by_kind'] = {kind: sum(1 for r in results if r['kind'] == kind and r['ok']) for kind in weights}
+    return summary
+
+
+def run_upload_folder_scenario(base_url, requests_count, concurrency, files_per_folder, file_bytes, timeout):
+    source_root = tempfile.mkdtemp(prefix='bench-folder-')
+    for i in range(files_per_folder):
+        with open(os.path.join(source_root, f'file{i:04d}.bin'), 'wb') as f:
+            f.write(os.urandom(file_bytes))
+
+    def one(index):
+        started = time.monotonic()
+        try:
+            status, body = _post_json(f'{base_url}/upload-folder',
+                                      {'source_folder': source_root, 'destination_prefix': f'bench/folder{index}'},
+                                      timeout)
+        except (urllib.error.URLError, OSError) as e:
+            status, body = None, {'error': str(e)}
+        ok = status == 200 and body.get('uploaded_files_count') == files_per_folder
+        return {'status': status, 'ok': ok, 'latency': time.monotonic() - started}
+
+    started = time.monotonic()
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(one, range(requests_count)))
+    finally:
+        shutil.rmtree(source_root, ignore_errors=True)
+    wall = time.monotonic() - started
+    payload = files_per_folder * file_bytes * sum(1 for r in results if r['ok'])
+    return _summarise('upload_folder', results, wall, payload)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark /download and /upload-folder end to end.')
+    parser.add_argument('--jobs', type=int, default=50, help='number of /download requests')
+    parser.add_argument('--concurrency', type=int, default=8, help='concurrent client requests')
+    parser.add_argument('--workers', type=int, default=4, help='MAX_WORKERS for the service')
+    parser.add_argument('--mix', type=_parse_mix, default=_parse_mix('progressive=1,hls=1,dash=1'),
+                        help='media kinds and weights, e.g. progressive=2,hls=1,dash=1')
+    parser.add_argument('--media-dir', help='reuse previously generated media')
+    parser.add_argument('--media-duration', type=int, default=10, help='seconds of media per job')
+    parser.add_argument('--media-bitrate', type=int, default=4_000_000, help='bits per second')
+    parser.add_argument('--synthetic', action='store_true', help='synthetic media even if ffmpeg is available')
+    parser.add_argument('--origin-rate', type=float, help='per-connection origin limit in bytes/s')
+    parser.add_argument('--gcs-rate', type=float, help='per-request GCS upload limit in bytes/s')
+    parser.add_argument('--upload-folder-requests', type=int, default=0, help='number of /upload-folder requests')
+    parser.add_argument('--folder-files', type=int, default=20)
+    parser.add_argument('--folder-file-bytes', type=int, default=256 * 1024)
+    parser.add_argument('--server', choices=('flask', 'gunicorn'), default='flask')
+    parser.add_argument('--app-dir', help='run the service from here instead of a scratch copy')
+    parser.add_argument('--env', action='append', default=[], metavar='KEY=VALUE', help='extra service env')
+    parser.add_argument('--timeout', type=float, default=600, help='per-request timeout in seconds')
+    parser.add_argument('--output', help='write the JSON results here (default: stdout)')
+    args = parser.parse_args(argv)
+
+    media_server, media_url, sizes = start_media_server(
+        args.media_dir, bytes_per_second=args.origin_rate, duration=args.media_duration,
+        bitrate=args.media_bitrate, use_ffmpeg=False if args.synthetic else None)
+    gcs_server, gcs_url, gcs_state = start_gcs_stub(upload_bytes_per_second=args.gcs_rate)
+    app_dir, scratch = _prepare_app_dir(args.app_dir)
+    port = _free_port()
+    extra_env = dict(item.split('=', 1) for item in args.env)
+    service = start_service(app_dir, port, gcs_url, args.workers, extra_env, args.server, args.concurrency * 2)
+    base_url = f'http://127.0.0.1:{port}'
+    logger.info(f"Service on {base_url}, media on {media_url}, GCS stand-in on {gcs_url}")
+
+    sampler = ResourceSampler(service.pid).start()
+    scenarios = []
+    try:
+        if args.jobs:
+            scenarios.append(run_download_scenario(base_url, media_url, sizes, args.jobs, args.concurrency,
+                                                   args.mix, args.timeout))
+        if args.upload_folder_requests:
+            scenarios.append(run_upload_folder_scenario(base_url, args.upload_folder_requests, args.concurrency,
+                                                        args.folder_files, args.folder_file_bytes, args.timeout))
+    finally:
+        resources = sampler.stop()
+        service.terminate()
+        try:
+            service.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            service.kill()
+        media_server.shutdown()
+        gcs_server.shutdown()
+        if scratch:
+            shutil.rmtree(app_dir, ignore_errors=True)
+
+    results = {
+        'started_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'config': {
+            'jobs': args.jobs,
+            'concurrency': args.concurrency,
+            'workers': args.workers,
+            'mix': args.mix,
+            'media_bytes': sizes,
+            'origin_rate': args.origin_rate,
+            'gcs_rate': args.gcs_rate,
+            'server': args.server,
+            'python': platform.python_version(),
+            'cpu_count': os.cpu_count(),
+        },
+        'scenarios': scenarios,
+        'gcs': dict(gcs_state.stats),
+        'resources': resources,
+    }
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+        logger.info(f"Results written to {args.output}")
+    else:
+        print(output)
+    return 0 if all(s['failed'] == 0 for s in scenarios) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
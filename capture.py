@@ -0,0 +1,101 @@
+# capture.py
+
+import os
+import json
+import zlib
+import threading
+import time
+import logging
+from flask import request, g
+
+logger = logging.getLogger(__name__)
+
+# Sampled request capture for load-test replay (bench/replay.py); off by default
+CAPTURE_REQUESTS = os.environ.get('CAPTURE_REQUESTS', '0') == '1'
+CAPTURE_SAMPLE_RATE = float(os.environ.get('CAPTURE_SAMPLE_RATE', 1.0))
+CAPTURE_FILE = os.environ.get('CAPTURE_FILE', 'captures.ndjson')
+# Endpoints worth replaying; matched against the URL rule, e.g. '/status/<job_id>'
+CAPTURE_ENDPOINTS = ('/download', '/status/<job_id>', '/upload-folder')
+# Proxies in front of the service that append the address they saw to X-Forwarded-For.
+# Cloud Run's front end is one, so the last entry is the caller's real address and
+# anything before it is whatever the caller sent; 0 when nothing sits in front
+TRUSTED_PROXY_HOPS = int(os.environ.get('TRUSTED_PROXY_HOPS', 1))
+# Only behind a gateway that authenticates callers and sets X-Client-Id itself
+# (or for bench/replay.py runs); otherwise any caller could pick a fresh id per request
+TRUST_CLIENT_ID_HEADER = os.environ.get('TRUST_CLIENT_ID_HEADER', '0') == '1'
+
+_capture_lock = threading.Lock()
+_capture_file = None
+
+
+def client_address():
+    """The caller's address as the outermost trusted proxy saw it; the remote address without one."""
+    hops = [hop.strip() for hop in request.headers.get('X-Forwarded-For', '').split(',') if hop.strip()]
+    if TRUSTED_PROXY_HOPS and len(hops) >= TRUSTED_PROXY_HOPS:
+        return hops[-TRUSTED_PROXY_HOPS]
+    return request.remote_addr or 'unknown'
+
+
+def client_id():
+    """
+    Who the caller is, for fair queuing and capture sampling: its address
+    (client_address()), or X-Client-Id when TRUST_CLIENT_ID_HEADER says a
+    gateway sets it.
+    """
+    if TRUST_CLIENT_ID_HEADER and request.headers.get('X-Client-Id'):
+        return request.headers['X-Client-Id']
+    return client_address()
+
+
+def client_label():
+    """X-Client-Id as the caller sent it: a label on its jobs, never what they're scheduled by."""
+    return request.headers.get('X-Client-Id')
+
+
+def _sampled(client):
+    # Sample whole clients rather than single requests, so a captured
+    # client's /download and its /status polls stay together
+    return zlib.crc32(client.encode('utf-8')) / 2 ** 32 < CAPTURE_SAMPLE_RATE
+
+
+def install(app):
+    """
+    Registers the capture hooks on `app` when CAPTURE_REQUESTS=1.
+
+    Each sampled request becomes one compact JSON line:
+        {"t": arrival (unix seconds), "m": method, "p": path, "c": client id,
+         "b": JSON body or null, "s": status, "d": duration (ms), "j": job id created}
+    """
+    global _capture_file
+    if not CAPTURE_REQUESTS:
+        return False
+    _capture_file = open(CAPTURE_FILE, 'a', buffering=1)
+
+    @app.before_request
+    def start_capture():
+        if str(request.url_rule) in CAPTURE_ENDPOINTS and _sampled(client_id()):
+            g.capture_started = (time.time(), time.monotonic())
+
+    @app.after_request
+    def write_capture(response):
+        started = g.pop('capture_started', None)
+        if started is None:
+            return response
+        record = {
+            't': round(started[0], 6),
+            'm': request.method,
+            'p': request.path,
+            'c': client_id(),
+            'b': request.get_json(silent=True),
+            's': response.status_code,
+            'd': round((time.monotonic() - started[1]) * 1000, 1),
+        }
+        if request.path == '/download' and response.is_json:
+            record['j'] = (response.get_json(silent=True) or {}).get('jobId')
+        line = json.dumps(record, separators=(',', ':'))
+        with _capture_lock:
+            _capture_file.write(line + '\n')
+        return response
+
+    logger.info(f"Capturing {CAPTURE_SAMPLE_RATE:.0%} of requests to {CAPTURE_FILE}")
+    return True
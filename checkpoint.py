@@ -0,0 +1,156 @@
+# checkpoint.py
+
+import os
+import json
+import socket
+import time
+import logging
+import threading
+from google.cloud import storage
+from google.api_core import exceptions as gcs_exceptions
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_PREFIX = os.environ.get('CHECKPOINT_PREFIX', 'checkpoints')
+JOB_STATE_PREFIX = os.environ.get('JOB_STATE_PREFIX', 'job-state')
+# Partial downloads larger than this are not worth uploading inside a SIGTERM grace period
+CHECKPOINT_MAX_PARTIAL_BYTES = int(os.environ.get('CHECKPOINT_MAX_PARTIAL_BYTES', 256 * 1024 * 1024))
+# Upload rate assumed for partial files before any upload on this instance has been measured
+CHECKPOINT_ASSUMED_UPLOAD_BYTES_PER_SECOND = float(os.environ.get('CHECKPOINT_ASSUMED_UPLOAD_BYTES_PER_SECOND',
+                                                                  10 * 1024 * 1024))
+
+# Cloud Run sets K_REVISION; the hostname tells instances of a revision apart
+INSTANCE_ID = f"{os.environ.get('K_REVISION', 'local')}-{socket.gethostname()}"
+
+
+def save_job_state(bucket_name, job_records):
+    """
+    Writes a snapshot of every job record this instance knows about.
+
+    Returns:
+        str: The gs:// URI of the snapshot.
+    """
+    storage_client = storage.Client()
+    blob_name = f"{JOB_STATE_PREFIX}/{INSTANCE_ID}.json"
+    blob = storage_client.bucket(bucket_name).blob(blob_name)
+    payload = {'instance': INSTANCE_ID, 'saved_at': time.time(), 'jobs': job_records}
+    blob.upload_from_string(json.dumps(payload), content_type='application/json')
+    return f"gs://{bucket_name}/{blob_name}"
+
+
+def _upload_fits(size, budget, upload_bytes_per_second):
+    """Whether `size` bytes are expected to upload within `budget` seconds."""
+    rate = upload_bytes_per_second or CHECKPOINT_ASSUMED_UPLOAD_BYTES_PER_SECOND
+    return budget > 0 and size / rate <= budget
+
+
+def _upload_within(blob, path, budget):
+    """
+    Uploads `path` to `blob`, waiting at most `budget` seconds. An upload
+    still running then is left to the dying instance and not referenced by
+    the checkpoint.
+
+    Returns:
+        bool: True if the upload finished in time.
+    """
+    result = {}
+
+    def upload():
+        try:
+            blob.upload_from_filename(path)
+            result['done'] = True
+        except Exception as e:
+            result['error'] = e
+
+    thread = threading.Thread(target=upload, daemon=True)
+    thread.start()
+    thread.join(budget)
+    if 'error' in result:
+        raise result['error']
+    return result.get('done', False)
+
+
+def save_checkpoint(bucket_name, checkpoint, partial_files, deadline, upload_bytes_per_second=None):
+    """
+    Stores a resumable job checkpoint, uploading those of its partial files
+    that are expected to finish before `deadline` (a time.monotonic() value).
+
+    Args:
+        bucket_name (str): The name of the target GCS bucket.
+        checkpoint (dict): JSON-serialisable job description (must contain 'job_id').
+        partial_files (list): Local paths of yt-dlp's partial/intermediate files.
+        deadline (float): Monotonic time by which the checkpoint must be written.
+        upload_bytes_per_second (float): Measured GCS upload rate; partial
+            files it says can't be uploaded in the time left are skipped.
+
+    Returns:
+        dict: The checkpoint as stored, with a 'partial_files' list of
+              {'name', 'bytes', 'blob'} entries ('blob' is None if not uploaded).
+    """
+    storage_client = storage.Client()
+    bucket = storage_client.bucket(bucket_name)
+    job_id = checkpoint['job_id']
+
+    stored_files = []
+    total_bytes = sum(os.path.getsize(path) for path in partial_files if os.path.isfile(path))
+    upload_partials = total_bytes <= CHECKPOINT_MAX_PARTIAL_BYTES
+    for path in partial_files:
+        if not os.path.isfile(path):
+            continue
+        entry = {'name': os.path.basename(path), 'bytes': os.path.getsize(path), 'blob': None}
+        # Keep a couple of seconds for writing the checkpoint itself
+        budget = deadline - 2 - time.monotonic()
+        if upload_partials and _upload_fits(entry['bytes'], budget, upload_bytes_per_second):
+            blob_name = f"{CHECKPOINT_PREFIX}/{job_id}/{entry['name']}"
+            try:
+                # The estimate can be wrong (unmeasured, or the rate dropped); the deadline can't be
+                if _upload_within(bucket.blob(blob_name), path, budget):
+                    entry['blob'] = blob_name
+                else:
+                    logger.warning(f"Gave up on uploading partial file {path} for job {job_id}: out of time")
+            except Exception as e:
+                logger.error(f"Error uploading partial file {path} for job {job_id}: {e}")
+        stored_files.append(entry)
+
+    checkpoint = dict(checkpoint, partial_files=stored_files, instance=INSTANCE_ID, saved_at=time.time())
+    bucket.blob(f"{CHECKPOINT_PREFIX}/{job_id}.json").upload_from_string(
+        json.dumps(checkpoint), content_type='application/json')
+    return checkpoint
+
+
+def claim_checkpoints(bucket_name, local_dir):
+    """
+    Claims every stored checkpoint for this instance, restoring uploaded
+    partial files into `local_dir`. A checkpoint is claimed by deleting its
+    JSON object with a generation precondition, so only one instance wins.
+
+    Returns:
+        list: The claimed checkpoint dicts.
+    """
+    storage_client = storage.Client()
+    bucket = storage_client.bucket(bucket_name)
+    claimed = []
+    for blob in storage_client.list_blobs(bucket_name, prefix=f"{CHECKPOINT_PREFIX}/"):
+        if not blob.name.endswith('.json') or blob.name.count('/') != CHECKPOINT_PREFIX.count('/') + 1:
+            continue
+        try:
+            checkpoint = json.loads(blob.download_as_text())
+            blob.delete(if_generation_match=blob.generation)
+        except (gcs_exceptions.PreconditionFailed, gcs_exceptions.NotFound):
+            continue  # Another instance got there first
+        except Exception as e:
+            logger.error(f"Error claiming checkpoint {blob.name}: {e}")
+            continue
+
+        os.makedirs(local_dir, exist_ok=True)
+        for entry in checkpoint.get('partial_files', []):
+            if not entry.get('blob'):
+                continue
+            partial_blob = bucket.blob(entry['blob'])
+            try:
+                partial_blob.download_to_filename(os.path.join(local_dir, entry['name']))
+                partial_blob.delete()
+            except Exception as e:
+                logger.error(f"Error restoring partial file {entry['blob']}: {e}")
+        claimed.append(checkpoint)
+    return claimed
@@ -0,0 +1,101 @@
+# clips.py
+
+import re
+import math
+
+
+def parse_timestamp(value):
+    """
+    Parses a clip boundary: seconds as a number or a string, or
+    '[[HH:]MM:]SS[.fff]'.
+
+    Raises:
+        ValueError: If the value isn't a non-negative time.
+    """
+    if isinstance(value, bool):
+        raise ValueError(value)
+    if isinstance(value, (int, float)):
+        seconds = float(value)
+    else:
+        parts = str(value).strip().split(':')
+        if len(parts) > 3:
+            raise ValueError(value)
+        seconds = 0.0
+        for part in parts:
+            # Each component on its own: '1:-5' is no way of writing 55 seconds
+            component = float(part)
+            if component < 0 or part.strip().startswith('-'):
+                raise ValueError(value)
+            seconds = seconds * 60 + component
+    if seconds < 0 or math.isnan(seconds) or math.isinf(seconds):
+        raise ValueError(value)
+    return seconds
+
+
+def _format_seconds(seconds):
+    return f"{seconds:.3f}".rstrip('0').rstrip('.')
+
+
+def parse_section(start=None, end=None, chapter=None):
+    """
+    Builds the yt-dlp --download-sections spec of a /download request.
+
+    A job fetches one section: yt-dlp writes each section it matches to a
+    file of its own, and a job has one output file.
+
+    Args:
+        start, end: Time range to keep; either may be left out.
+        chapter (str): Title of the chapter to keep, matched exactly
+            (case-insensitively) rather than as a regular expression.
+
+    Returns:
+        str or None: A spec such as '*90-120' or '(?i)^Intro$'; None for the whole video.
+
+    Raises:
+        ValueError: With a message for the client.
+    """
+    if chapter is not None:
+        if start is not None or end is not None:
+            raise ValueError("give either start/end or chapter, not both")
+        if not isinstance(chapter, str) or not chapter.strip():
+            raise ValueError("chapter must be a chapter title")
+        return f"(?i)^{re.escape(chapter.strip())}$"
+    if start is None and end is None:
+        return None
+    try:
+        start_seconds = parse_timestamp(start) if start is not None else 0.0
+        end_seconds = parse_timestamp(end) if end is not None else None
+    except ValueError:
+        raise ValueError("start and end must be seconds or [HH:]MM:SS timestamps")
+    if end_seconds is not None and end_seconds <= start_seconds:
+        raise ValueError("end must be after start")
+    end_spec = _format_seconds(end_seconds) if end_seconds is not None else 'inf'
+    return f"*{_format_seconds(start_seconds)}-{end_spec}"
+
+
+def section_args(section, accurate_cuts=False):
+    """
+    yt-dlp arguments fetching only `section` (all of the video if None).
+
+    Without accurate_cuts the clip is cut at the keyframes nearest the
+    requested times and stays a stream copy; with it, yt-dlp re-encodes
+    around the cuts (--force-keyframes-at-cuts), which costs CPU.
+    """
+    if section is None:
+        return []
+    args = ['--download-sections', section]
+    if accurate_cuts:
+        args.append('--force-keyframes-at-cuts')
+    return args
+
+
+def clip_fraction(section, duration):
+    """
+    Share of a `duration`-second video a time-range section covers, or None
+    when it can't be told before the download (chapters, unknown duration).
+    """
+    if section is None or not section.startswith('*') or not duration:
+        return None
+    start, _, end = section[1:].partition('-')
+    end = duration if end == 'inf' else min(float(end), duration)
+    return max(0.0, end - float(start)) / duration
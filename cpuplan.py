@@ -0,0 +1,108 @@
+# cpuplan.py
+
+import os
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+# --- ffmpeg CPU budget ---
+# 'auto' splits the instance's cores between the jobs that may be running
+# ffmpeg at once; a number pins every ffmpeg to that many threads; 0 leaves
+# ffmpeg to its own default (one thread per core, per process)
+FFMPEG_THREADS = os.environ.get('FFMPEG_THREADS', 'auto')
+# Also pin each job's ffmpeg (and, unstaged, its yt-dlp) to the cores it was given
+FFMPEG_CPU_AFFINITY = os.environ.get('FFMPEG_CPU_AFFINITY', '0') == '1'
+
+
+def available_cpus():
+    """The cores this process may run on (cgroup/cpuset aware where the OS supports it)."""
+    try:
+        return sorted(os.sched_getaffinity(0))
+    except AttributeError:
+        return list(range(os.cpu_count() or 1))
+
+
+class CpuPlanner:
+    """
+    Hands each postprocessing job an ffmpeg thread count and, optionally, a
+    set of cores, so N concurrent merges share the machine instead of each
+    starting one thread per core.
+
+    A job asking while k others hold a share gets cores // (k + 1) threads
+    (at least one); with affinity on, those are the cores the fewest other
+    jobs are pinned to. Shares are not rebalanced when jobs come and go.
+    """
+
+    def __init__(self, cpus=None):
+        self.cpus = cpus or available_cpus()
+        self._shares = {}  # job_id -> (threads, cpus or None)
+        self._lock = threading.Lock()
+
+    def acquire(self, job_id):
+        """
+        Returns:
+            tuple: (thread count or None for ffmpeg's default, list of cores or None)
+        """
+        with self._lock:
+            if job_id in self._shares:
+                return self._shares[job_id]
+            if FFMPEG_THREADS == 'auto':
+                threads = max(1, len(self.cpus) // (len(self._shares) + 1))
+            else:
+                threads = int(FFMPEG_THREADS) or None
+            cpus = None
+            if FFMPEG_CPU_AFFINITY:
+                load = {cpu: 0 for cpu in self.cpus}
+                for _, pinned in self._shares.values():
+                    for cpu in pinned or ():
+                        load[cpu] = load.get(cpu, 0) + 1
+                cpus = sorted(sorted(self.cpus, key=lambda cpu: load[cpu])[:threads or len(self.cpus)])
+            self._shares[job_id] = (threads, cpus)
+            return threads, cpus
+
+    def release(self, job_id):
+        with self._lock:
+            self._shares.pop(job_id, None)
+
+    def active(self):
+        with self._lock:
+            return len(self._shares)
+
+
+def pin(pid, cpus):
+    """Restricts `pid` (and the children it starts afterwards) to `cpus`; failures are logged, not raised."""
+    if not cpus:
+        return
+    try:
+        os.sched_setaffinity(pid, cpus)
+    except (AttributeError, OSError) as e:
+        logger.warning(f"Could not set CPU affinity of process {pid}: {e}")
+
+
+def wait_with_usage(process):
+    """
+    Waits for a subprocess.Popen and returns the CPU seconds (user + system)
+    it and the children it reaped used, via os.wait4(). Sets process.returncode.
+
+    The child is reaped under Popen's own lock, as Popen.wait() reaps it:
+    a cancel's Popen.wait(timeout) on another thread then waits for this
+    one instead of losing the child to it and taking it for an exit code 0.
+
+    Returns:
+        float or None: None if the process had already been reaped elsewhere.
+    """
+    with process._waitpid_lock:
+        if process.returncode is not None:
+            return None
+        try:
+            _, status, usage = os.wait4(process.pid, 0)
+        except ChildProcessError:
+            # Reaped outside Popen (SIGCHLD ignored); Popen makes the same call
+            process.returncode = 0
+            return None
+        process.returncode = os.waitstatus_to_exitcode(status)
+    return usage.ru_utime + usage.ru_stime
+
+
+cpu_planner = CpuPlanner()
@@ -1,16 +1,132 @@
+import asyncio
 import subprocess
 import json
 import os
+import sys
 import time
 import random
 from pathlib import Path
 import threading
-from flask import request, jsonify
+from flask import request, jsonify, send_file
 from datetime import datetime
 import re
+import math
+import signal
+import glob
+import shutil
+
+import retry
+import watchdog
+import metrics
+import tracing
+import joblog
+import admission
+import capture
+import jobqueue
+import jobhistory
+import pipeline
+import cpuplan
+import formats
+import clips
+import segmented
+import fragments
+from cpuplan import cpu_planner
+from fragments import fragment_tuner
+from scheduler import scheduler, JOB_RUNNER
+from pipemux import pipe_mux
+from folderUpload import upload_file_to_gcs
 
 # In-memory job tracker
 jobs = {}
+# Per-job runtime state that isn't part of the public status record
+# (request parameters, output paths, completion event)
+job_contexts = {}
+
+# Counts down the renditions of a job still being made (job_contexts[...]['renders_pending'])
+_render_lock = threading.Lock()
+
+# Exponentially weighted upload throughput, used to judge whether an upload
+# can finish within the shutdown grace period
+upload_stats = {'bytes_per_second': None}
+
+# Jobs deferred by an open circuit breaker give up after this long
+MAX_DEFER_SECONDS = float(os.environ.get('CIRCUIT_MAX_DEFER_SECONDS', 600))
+# How long a cancelled yt-dlp gets to exit on SIGTERM before the group is SIGKILLed
+CANCEL_GRACE_SECONDS = float(os.environ.get('CANCEL_GRACE_SECONDS', 2))
+
+TERMINAL_STATUSES = ('completed', 'failed', 'cancelled', 'checkpointed')
+# Lifecycle marks (time.monotonic() values in job['timings']) and the stages between them
+STAGE_SPANS = (
+    ('queue', 'queued', 'started'),
+    ('extract', 'started', 'extracted'),
+    ('download', 'extracted', 'downloaded'),
+    ('merge', 'downloaded', 'exited'),
+    ('rename', 'exited', 'renamed'),
+    ('upload', 'renamed', 'uploaded'),
+    # Staged pipeline: yt-dlp exits unmerged, and the merge and upload wait for
+    # their own pools; a later span for the same stage takes precedence
+    ('merge_queue', 'exited', 'merge_started'),
+    ('merge', 'merge_started', 'merged'),
+    ('rename', 'merged', 'renamed'),
+    ('upload_queue', 'renamed', 'upload_started'),
+    ('upload', 'upload_started', 'uploaded'),
+    # Multi-rendition jobs: the renditions are made on the render pool from the
+    # first render starting to the last one finishing
+    ('render_queue', 'exited', 'render_started'),
+    ('render', 'render_started', 'rendered'),
+    ('rename', 'rendered', 'renamed'),
+)
+# Marks that belong to a single attempt and are cleared when a new one starts
+ATTEMPT_MARKS = ('extracted', 'downloaded', 'exited', 'merge_started', 'merged', 'render_started', 'rendered',
+                 'renamed', 'upload_started', 'uploaded')
+# Finished files are uploaded under this prefix in GCS_BUCKET_NAME
+GCS_DOWNLOADS_PREFIX = os.environ.get('GCS_DOWNLOADS_PREFIX', 'downloads')
+# Outputs are deleted once uploaded (or once their upload failed), and a failed job's
+# files once it fails for good, so disk space comes back; set to keep them
+KEEP_LOCAL_FILES = os.environ.get('KEEP_LOCAL_FILES', '0') == '1'
+# 'yt-dlp' runs the real thing; 'fake' runs fake_downloader.py, which simulates
+# downloads offline for load-testing the scheduler, progress and upload paths
+DOWNLOAD_BACKEND = os.environ.get('DOWNLOAD_BACKEND', 'yt-dlp')
+FAKE_DOWNLOADER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_downloader.py')
+SEGMENTED_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'segmented.py')
+# yt-dlp's info JSON is a single line that can run to megabytes (every format
+# of every stream); asyncio's StreamReader default of 64KiB per line is too small
+ASYNC_LINE_LIMIT_BYTES = 16 * 1024 * 1024
+# stderr prefixes of yt-dlp postprocessors that run ffmpeg after the download
+POSTPROCESSOR_PREFIXES = ('[Merger]', '[VideoConvertor]', '[VideoRemuxer]', '[ExtractAudio]', '[Fixup')
+FFMPEG_PATH = os.environ.get('FFMPEG_PATH', 'ffmpeg')
+
+# 429 bodies for requests turned away by admission control, by reason
+ADMISSION_MESSAGES = {
+    'queue': 'The download queue is full, please retry later.',
+    'disk': 'The server is low on disk space, please retry later.',
+    'memory': 'The server is low on memory, please retry later.',
+}
+
+# --- Metrics that are read at scrape time ---
+metrics.CallbackMetric('flaskdownloader_queue_depth', 'Jobs waiting for a worker.', scheduler.queue_depth)
+metrics.CallbackMetric('flaskdownloader_running_jobs', 'Jobs currently running on a worker.', lambda: scheduler.running)
+metrics.CallbackMetric('flaskdownloader_lane_jobs', 'Queued and running jobs per priority lane.',
+                       scheduler.lane_counts, labelnames=['lane', 'state'])
+metrics.CallbackMetric('flaskdownloader_pipeline_stage_jobs', 'Queued and running jobs per staged pipeline stage.',
+                       lambda: {(stage.name, state): value for stage in (merge_stage, render_stage, upload_stage)
+                                for state, value in (('queued', stage.queue_depth()), ('running', stage.running))},
+                       labelnames=['stage', 'state'])
+metrics.CallbackMetric('flaskdownloader_ffmpeg_cpu_shares', 'Jobs currently holding a share of the cores for ffmpeg.',
+                       cpu_planner.active)
+metrics.CallbackMetric('flaskdownloader_fragment_concurrency', 'Fragments an HLS/DASH attempt at each origin is started with (-N).',
+                       fragment_tuner.levels, labelnames=['origin'])
+metrics.CallbackMetric('flaskdownloader_fragment_downloads_in_flight', 'Concurrent fragment fetches held by running attempts.',
+                       fragment_tuner.in_flight)
+metrics.CallbackMetric('flaskdownloader_pending_retries', 'Jobs waiting out a retry backoff or deferral.',
+                       scheduler.pending_retries)
+metrics.CallbackMetric('flaskdownloader_disk_bytes', 'Usage of the filesystem holding the downloads directory.',
+                       lambda: dict(zip(('used', 'free'), shutil.disk_usage(os.path.dirname(os.path.abspath(__file__)))[1:])),
+                       labelnames=['state'])
+metrics.CallbackMetric('flaskdownloader_estimated_wait_seconds', 'Estimated queue wait for a job submitted now.',
+                       lambda: admission_decision()['estimated_wait'])
+metrics.CallbackMetric('flaskdownloader_watchdog_events', 'Attempts stopped by the stall watchdog.',
+                       lambda: dict(watchdog.stall_events), labelnames=['reason'], kind='counter')
 
 def generate_job_id():
     return ''.join(random.choices('abcdefghijklmnopqrstuvwxyz0123456789', k=9))
@@ -22,120 +138,1170 @@ def handle_download():
     url = request.json.get('url')
     if not url:
         return jsonify({'error': 'URL is required'}), 400
+    # Clients that poll /status can ask for the job id straight away
+    wait_for_result = not request.json.get('async', False)
+    # Full gzip'd yt-dlp output for this job, served by GET /jobs/<job_id>/log
+    keep_log = bool(request.json.get('log', False)) or joblog.KEEP_JOB_LOGS
+    # Batch submitters should send "priority": "bulk" so single downloads aren't stuck behind them
+    lane = request.json.get('priority', jobqueue.DEFAULT_LANE)
+    if lane not in jobqueue.LANES:
+        return jsonify({'error': f"priority must be one of: {', '.join(jobqueue.LANES)}"}), 400
+    # Quality preset, see formats.FORMAT_PRESETS; 'fast' avoids merges for mobile clients.
+    # It is also the job class, so JOB_TIMEOUTS and expected durations can differ per preset
+    preset = request.json.get('preset', formats.DEFAULT_FORMAT_PRESET)
+    if preset not in formats.FORMAT_PRESETS:
+        return jsonify({'error': f"preset must be one of: {', '.join(formats.FORMAT_PRESETS)}"}), 400
+    # Clips: only the "start"/"end" range or the "chapter" is fetched. Cuts land on keyframes
+    # and stay a stream copy unless "accurate_cuts" asks for a re-encode around them
+    try:
+        section = clips.parse_section(request.json.get('start'), request.json.get('end'), request.json.get('chapter'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    accurate_cuts = bool(request.json.get('accurate_cuts', False))
+    # Several outputs from one fetch, e.g. ["1080p", "480p", "audio"], uploaded as a group with a manifest
+    renditions = request.json.get('renditions')
+    if renditions is not None:
+        if (not isinstance(renditions, list) or not renditions
+                or not all(isinstance(name, str) and name in formats.RENDITIONS for name in renditions)):
+            return jsonify({'error': f"renditions must be a list of: {', '.join(formats.RENDITIONS)}"}), 400
+        if 'preset' in request.json:
+            return jsonify({'error': 'give either preset or renditions, not both'}), 400
+        renditions = list(dict.fromkeys(renditions))
+
+    decision = admission_decision()
+    if not decision['admit']:
+        metrics.ADMISSION_REJECTIONS.labels(decision['reason']).inc()
+        response = jsonify({
+            'error': ADMISSION_MESSAGES[decision['reason']],
+            'retryAfter': decision['retry_after'],
+            'estimatedWait': decision['estimated_wait'],
+        })
+        if decision['retry_after'] is not None:
+            response.headers['Retry-After'] = str(decision['retry_after'])
+        return response, 429
+
+    extractor = retry.extractor_key(url)
+    breaker = retry.get_breaker(extractor)
+    deferred = False
+    if breaker.is_open():
+        retry_after = max(1, math.ceil(breaker.retry_after()))
+        if retry.CIRCUIT_OPEN_POLICY != 'defer':
+            response = jsonify({
+                'error': f"Downloads from '{extractor}' are temporarily suspended after repeated failures.",
+                'retryAfter': retry_after,
+            })
+            response.headers['Retry-After'] = str(retry_after)
+            return response, 503
+        deferred = True
 
     job_id = generate_job_id()
+    with tracing.span('job.enqueue', {'job.id': job_id, 'job.url': url, 'job.extractor': extractor}):
+        _register_job(job_id, url, extractor, keep_log=keep_log, lane=lane, client=capture.client_id(),
+                      client_label=capture.client_label(), preset=preset,
+                      job_class='renditions' if renditions else preset, section=section,
+                      accurate_cuts=accurate_cuts, renditions=renditions)
+        # Worker threads continue the trace from here
+        job_contexts[job_id]['trace_context'] = tracing.current_context()
+
+        _start_workers()
+        if deferred:
+            _defer_job(job_id, breaker)
+        else:
+            scheduler.submit(job_id)
+
+    if not wait_for_result:
+        return jsonify({'jobId': job_id}), 202
+
+    job_contexts[job_id]['done'].wait()
+    response_data = {'jobId': job_id}
+    if jobs[job_id]['status'] == 'completed':
+        response_data['filename'] = jobs[job_id]['filename']
+        if 'renditions' in jobs[job_id]:
+            response_data['renditions'] = {name: rendition['filename']
+                                           for name, rendition in jobs[job_id]['renditions'].items()}
+    response = jsonify(response_data)
+    response.headers['Server-Timing'] = server_timing(jobs[job_id])
+    return response
+
+def admission_decision():
+    """Whether a new download can be admitted right now; see admission.check()."""
+    return admission.check(scheduler.queue_depth() + scheduler.pending_retries(), scheduler.running,
+                           scheduler.worker_count, os.path.dirname(os.path.abspath(__file__)),
+                           frees_disk=not KEEP_LOCAL_FILES)
+
+def _register_job(job_id, url, extractor, timestamp=None, job_class='default', attempts=0, history=None,
+                  keep_log=False, lane=jobqueue.DEFAULT_LANE, client='unknown', client_label=None, preset=None,
+                  section=None, accurate_cuts=False, renditions=None):
+    preset = preset or formats.DEFAULT_FORMAT_PRESET
     jobs[job_id] = {
         'status': 'queued',
         'progress': 0,
         'title': 'Fetching...',
         'duration': 'Fetching...',
         'size': 'Fetching...',
+        'extractor': extractor,
+        'client_label': client_label,
+        'preset': preset,
+        'section': section,
+        'attempts': attempts,
+        'history': history or [],
+        'timings': {},
     }
 
     downloads_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), 'downloads'))
-    timestamp = datetime.now().strftime('%H_%M_%S_%d-%m-%Y')
-    initial_title = 'Untitled'
-    quality = 'best'
-    duration_minutes = '0'
-    final_filename_base = f"{timestamp}_{sanitize_filename(initial_title)}_{quality}.mp4"
-    final_path = Path(f"{downloads_dir}/{final_filename_base}")
-
-    command = [
-        'yt-dlp',
+    job_contexts[job_id] = {
+        'url': url,
+        'extractor': extractor,
+        'origin': retry.origin_key(url),
+        'origin_label': retry.origin_label(url),
+        'downloads_dir': downloads_dir,
+        'timestamp': timestamp or datetime.now().strftime('%H_%M_%S_%d-%m-%Y'),
+        'created_at': time.monotonic(),
+        'done': threading.Event(),
+        'process': None,
+        'cancelled': False,
+        'checkpointed': False,
+        'job_class': job_class,
+        'keep_log': keep_log,
+        'job_log': None,
+        'lane': lane,
+        'client': client,
+        'preset': preset,
+        'section': section,
+        'accurate_cuts': accurate_cuts,
+        'renditions': renditions or [],
+        'render_processes': {},
+    }
+    _mark(job_id, 'queued')
+
+def _start_workers():
+    if JOB_RUNNER == 'asyncio':
+        scheduler.start(run_download_job_async, describe=_describe_job)
+        stall_watchdog.start(call_every=scheduler.call_every)
+    else:
+        scheduler.start(run_download_job, describe=_describe_job)
+        stall_watchdog.start()
+
+def _describe_job(job_id):
+    """
+    Where `job_id` queues: its priority lane, the client fair queuing charges
+    it to, and the origin whose limits it counts against.
+    """
+    context = job_contexts.get(job_id)
+    if context is None:
+        return {}
+    info = {'lane': context['lane'], 'client': context['client'], 'origin': context['origin'],
+            'origin_label': context['origin_label']}
+    if jobqueue.QUEUE_ORDER == 'sjf':
+        info['expected_seconds'] = _expected_seconds(job_id)
+    return info
+
+def _expected_seconds(job_id):
+    """Expected worker time of `job_id`, from what's left to download when a previous attempt saw its size."""
+    context = job_contexts[job_id]
+    remaining = None
+    if context.get('expected_bytes'):
+        remaining = max(1, context['expected_bytes'] - jobs[job_id].get('downloaded_bytes', 0))
+    return jobhistory.expected_seconds(context['extractor'], context['job_class'], remaining)
+
+def run_download_job(job_id):
+    """
+    Scheduler entry point: runs one yt-dlp attempt for `job_id` and decides
+    whether the job is finished, failed for good, or due for a retry.
+    """
+    context = job_contexts[job_id]
+    with tracing.attached(context.get('trace_context')):
+        with tracing.span('job.attempt', {'job.id': job_id, 'job.attempt': jobs[job_id]['attempts'] + 1}) as attempt_span:
+            _run_download_job(job_id)
+            if attempt_span is not None:
+                attempt_span.set_attribute('job.status', jobs[job_id]['status'])
+
+async def run_download_job_async(job_id):
+    """Entry point for the asyncio runner (JOB_RUNNER=asyncio); same flow as run_download_job()."""
+    context = job_contexts[job_id]
+    with tracing.attached(context.get('trace_context')):
+        with tracing.span('job.attempt', {'job.id': job_id, 'job.attempt': jobs[job_id]['attempts'] + 1}) as attempt_span:
+            if _begin_attempt(job_id):
+                returncode, error_output = await _run_attempt_async(job_id)
+                if _settle_attempt(job_id, returncode, error_output):
+                    if _pipelined(job_id):
+                        _enter_pipeline(job_id)
+                    else:
+                        if _needs_upload(job_id):
+                            await scheduler.run_blocking(_upload_result, job_id)
+                        _finish_job(job_id)
+            if attempt_span is not None:
+                attempt_span.set_attribute('job.status', jobs[job_id]['status'])
+
+def _run_download_job(job_id):
+    if not _begin_attempt(job_id):
+        return
+    returncode, error_output = _run_attempt(job_id)
+    if _settle_attempt(job_id, returncode, error_output):
+        if _pipelined(job_id):
+            # The worker is free from here; merge and upload queue for their own pools
+            _enter_pipeline(job_id)
+            return
+        if _needs_upload(job_id):
+            _upload_result(job_id)
+        _finish_job(job_id)
+
+def _begin_attempt(job_id):
+    """
+    Decides whether `job_id` may run now and, if so, starts a new attempt.
+
+    Returns:
+        bool: False when the job was cancelled, deferred or failed instead.
+    """
+    job = jobs[job_id]
+    context = job_contexts[job_id]
+    breaker = retry.get_breaker(context['extractor'])
+
+    if context['cancelled'] or context['checkpointed']:
+        return False
+
+    if not breaker.allow_request():
+        # The site started failing while this job waited; don't spend a worker on it
+        if time.monotonic() - context['created_at'] > MAX_DEFER_SECONDS:
+            job['status'] = 'failed'
+            job['error'] = f"Downloads from '{context['extractor']}' stayed suspended for too long."
+            job['error_category'] = 'circuit_open'
+            _finish_job(job_id)
+        else:
+            _defer_job(job_id, breaker)
+        return False
+
+    job['attempts'] += 1
+    job['status'] = 'downloading'
+    job.pop('error', None)
+    for mark in ATTEMPT_MARKS:
+        job['timings'].pop(mark, None)
+    _mark(job_id, 'started')
+    if job['attempts'] == 1:
+        _update_durations(job, observe=('queue',))
+    return True
+
+def _settle_attempt(job_id, returncode, error_output):
+    """
+    Applies the outcome of a finished attempt: records it with the circuit
+    breaker, then schedules a retry or fails the job as the policy says.
+
+    Returns:
+        bool: True if the download succeeded; the caller then uploads the
+        result (if _needs_upload()) and finishes the job, or with
+        STAGED_PIPELINE or renditions hands it to _enter_pipeline().
+    """
+    job = jobs[job_id]
+    context = job_contexts[job_id]
+    breaker = retry.get_breaker(context['extractor'])
+    watchdog_reason = context.pop('watchdog_reason', None)
+
+    if context['cancelled'] or context['checkpointed']:
+        # Already marked by cancel_job()/checkpoint_job(); don't let a killed process count as an origin failure
+        breaker.record_failure('cancelled')
+        return False
+
+    if returncode == 0:
+        breaker.record_success()
+        if context['renditions']:
+            job['status'] = 'rendering'
+        elif pipeline.STAGED_PIPELINE and not _audio_only(job_id):
+            job['status'] = 'merging'
+        else:
+            _finalize_download(job_id)
+        return True
+
+    if watchdog_reason:
+        # Killed by the watchdog: the stderr tail says nothing useful about why
+        category = watchdog_reason
+        retryable = watchdog_reason == 'stalled' and watchdog.STALL_ACTION == 'restart'
+    else:
+        category = retry.classify_error(error_output)
+        retryable = retry.is_retryable(category)
+    breaker.record_failure(category)
+    metrics.ATTEMPT_FAILURES.labels(category).inc()
+    job['error_category'] = category
+    attempt_record = {'attempt': job['attempts'], 'returncode': returncode, 'error_category': category}
+    job['history'].append(attempt_record)
+
+    if retryable and job['attempts'] < retry.MAX_ATTEMPTS:
+        delay = retry.backoff_delay(job['attempts'], category)
+        attempt_record['retry_in'] = round(delay, 1)
+        job['status'] = 'retrying'
+        job['progress'] = 0
+        print(f"Job {job_id} attempt {job['attempts']} failed ({category}), retrying in {delay:.1f}s")
+        scheduler.submit_later(job_id, delay)
+        return False
+
+    job['status'] = 'failed'
+    if watchdog_reason == 'timeout':
+        job['error'] = f"Job exceeded its {watchdog.job_timeout(context['job_class']):.0f}s time limit."
+    elif watchdog_reason:
+        job['error'] = "Download stalled and was stopped."
+    job['error'] = job.get('error', f"Process exited with code {returncode}")
+    _finish_job(job_id)
+    return False
+
+def _pipelined(job_id):
+    """Whether `job_id` leaves its worker once downloaded, for the stage pools."""
+    return pipeline.STAGED_PIPELINE or bool(job_contexts[job_id]['renditions'])
+
+def _audio_only(job_id):
+    return formats.FORMAT_PRESETS[job_contexts[job_id]['preset']]['audio_only']
+
+def _needs_upload(job_id):
+    return jobs[job_id]['status'] == 'completed' and bool(os.environ.get('GCS_BUCKET_NAME'))
+
+def _defer_job(job_id, breaker):
+    jobs[job_id]['status'] = 'deferred'
+    scheduler.submit_later(job_id, max(1.0, breaker.retry_after()))
+
+def _finish_job(job_id):
+    if job_contexts[job_id]['done'].is_set():
+        # Already finished by checkpoint_job() or cancel_job() while its upload ran
+        return
+    _mark(job_id, 'finished')
+    if jobs[job_id]['status'] == 'failed' and not KEEP_LOCAL_FILES:
+        # Nothing will resume from these (a checkpointed job's are kept for its checkpoint)
+        _remove_partial_files(job_id)
+    cpu_planner.release(job_id)
+    fragment_tuner.release(job_id, job_contexts[job_id]['extractor'])
+    timings = jobs[job_id]['timings']
+    if 'started' in timings:
+        service_time = timings['finished'] - timings['started']
+        admission.record_service_time(service_time)
+        if jobs[job_id]['status'] == 'completed':
+            context = job_contexts[job_id]
+            jobhistory.record(context['extractor'], context['job_class'], service_time,
+                              jobs[job_id].get('downloaded_bytes'))
+    _update_durations(jobs[job_id])
+    metrics.JOBS_FINISHED.labels(jobs[job_id]['status']).inc()
+    job_contexts[job_id]['done'].set()
+
+def _mark(job_id, mark):
+    jobs[job_id]['timings'][mark] = round(time.monotonic(), 6)
+
+def _update_durations(job, observe=(), trace=True):
+    """
+    Derives per-stage durations (seconds) and the average download throughput
+    (bytes/s) from the job's lifecycle marks, feeding the `observe` stages
+    into the latency histograms and, with `trace`, the current trace.
+    """
+    timings = job['timings']
+    spans = {}
+    for stage, start, end in STAGE_SPANS:
+        if start in timings and end in timings:
+            spans[stage] = (start, end)
+    durations = {stage: round(max(0.0, timings[end] - timings[start]), 3) for stage, (start, end) in spans.items()}
+    if 'finished' in timings:
+        durations['total'] = round(timings['finished'] - timings['queued'], 3)
+    job['durations'] = durations
+    if durations.get('download') and job.get('downloaded_bytes'):
+        job['average_throughput'] = round(job['downloaded_bytes'] / durations['download'])
+    for stage, (start, end) in spans.items():
+        if stage in observe:
+            metrics.STAGE_DURATION.labels(stage).observe(durations[stage])
+            if trace:
+                tracing.record_span(f"job.{stage}", timings[start], timings[end])
+
+def server_timing(job):
+    """Formats the job's stage durations as a Server-Timing header value."""
+    return ', '.join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in job.get('durations', {}).items())
+
+def _run_attempt(job_id):
+    """
+    Runs yt-dlp once for `job_id`, streaming progress into the job record.
+
+    Returns:
+        tuple: (returncode, stderr output of this attempt)
+    """
+    context = job_contexts[job_id]
+    command = _prepare_attempt(job_id)
+
+    # Own process group, so cancelling also reaches the ffmpeg children yt-dlp spawns
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=0,
+                               start_new_session=True, env=_downloader_env(job_id))
+    context['attempt_started_at'] = time.monotonic()
+    context['process'] = process
+    cpuplan.pin(process.pid, context['cpus'])
+    if context['cancelled']:
+        # cancel_job() ran between the worker picking the job up and Popen returning
+        _kill_process_group(process)
+    stderr_ring = joblog.StderrRing()
+
+    # One multiplexer thread reads every running downloader's pipes; wait()
+    # returns once both are drained, so stderr is complete before classification
+    streams_closed = pipe_mux.register([
+        (process.stdout, lambda line: _handle_stdout_line(job_id, line)),
+        (process.stderr, lambda line: _handle_stderr_line(job_id, line, stderr_ring)),
+    ])
+
+    # wait4() rather than wait(): also yields the CPU time of yt-dlp and the ffmpeg it ran
+    _add_cpu_seconds(job_id, 'download', cpuplan.wait_with_usage(process))
+    streams_closed.wait()
+    return _end_attempt(job_id, process.returncode, stderr_ring)
+
+async def _run_attempt_async(job_id):
+    """_run_attempt() for the asyncio runner: the process and its pipes are owned by the event loop."""
+    context = job_contexts[job_id]
+    command = _prepare_attempt(job_id)
+
+    process = await asyncio.create_subprocess_exec(
+        *command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+        start_new_session=True, env=_downloader_env(job_id), limit=ASYNC_LINE_LIMIT_BYTES)
+    context['attempt_started_at'] = time.monotonic()
+    context['process'] = process
+    cpuplan.pin(process.pid, context['cpus'])
+    if context['cancelled']:
+        _kill_process_group(process)
+    stderr_ring = joblog.StderrRing()
+
+    async def pump(stream, handle_line):
+        async for raw_line in stream:
+            try:
+                handle_line(raw_line.decode('utf-8', errors='replace').rstrip('\r\n'))
+            except Exception as e:
+                print(f"Error handling yt-dlp output: {e}")
+
+    await asyncio.gather(
+        pump(process.stdout, lambda line: _handle_stdout_line(job_id, line)),
+        pump(process.stderr, lambda line: _handle_stderr_line(job_id, line, stderr_ring)),
+    )
+    await process.wait()
+    if context['cancelled'] or context.get('watchdog_reason'):
+        # Sweep ffmpeg children the SIGTERM left behind, now rather than after the grace timer
+        _signal_process_group(process.pid, signal.SIGKILL)
+        if context['cancelled']:
+            _remove_partial_files(job_id)
+    return _end_attempt(job_id, process.returncode, stderr_ring)
+
+def _prepare_attempt(job_id):
+    """Resets the per-attempt state of `job_id` and builds its downloader command line."""
+    context = job_contexts[job_id]
+    context['title'] = 'Untitled'
+    context['quality'] = 'best'
+    context['bytes_by_file'] = {}
+    context['format_ids'] = []
+    context['stream_has_video'] = {}
+    context['source_height'] = None
+    context['postprocessing'] = False
+    context['fragmented'] = False
+    context['fragment_retries'] = 0
+    context['fragment_throttled'] = False
+    jobs[job_id]['downloaded_bytes'] = 0
+    # yt-dlp writes under a job-specific name so partial files can be found on cancel;
+    # _finalize_download() renames it to the title-based name
+    context['final_path'] = _working_path(job_id)
+    context['cpus'] = None
+    if context['keep_log']:
+        context['job_log'] = joblog.open_job_log(job_id)
+        context['job_log'].write(f"--- attempt {jobs[job_id]['attempts']} ---\n")
+        jobs[job_id]['log_available'] = True
+
+    stem = str(context['final_path'].with_suffix('')).replace('%', '%%')
+    if context['renditions']:
+        # The source streams once, to separate files; _render_job() makes each rendition from them
+        format_args = [*formats.rendition_source_args(context['renditions']), '-o', f"{stem}.f%(format_id)s.%(ext)s"]
+    elif _audio_only(job_id):
+        # Nothing to merge, and audio extraction is a stream copy in the common case, so
+        # no share of the cores; the extension comes from the audio codec
+        format_args = [*formats.format_args(context['preset']), '-o', f"{stem}.%(ext)s"]
+    elif pipeline.STAGED_PIPELINE:
+        # Each stream to its own .f<format_id> file and no merge; _merge_job() does that
+        # (single-file presets fetch one file, which it only renames; see formats.format_args())
+        format_args = [*formats.format_args(context['preset'], separate_streams=True),
+                       '--merge-output-format', 'mp4', '-o', f"{stem}.f%(format_id)s.%(ext)s"]
+    else:
+        format_args = [*formats.format_args(context['preset']), '--merge-output-format', 'mp4',
+                       '-o', str(context['final_path'])]
+        # yt-dlp runs the merge itself, and any running attempt may get there, so
+        # each one takes a share of the cores for its ffmpeg up front
+        threads, context['cpus'] = cpu_planner.acquire(job_id)
+        if threads:
+            format_args += ['--postprocessor-args', f"ffmpeg:-threads {threads}"]
+    context['fragment_concurrency'] = fragment_tuner.acquire(job_id, context['extractor'])
+    jobs[job_id]['fragment_concurrency'] = context['fragment_concurrency']
+
+    return [
+        *_downloader_executable(job_id),
         '--cookies', 'cookies.txt',
         '--no-check-certificate',
         '--verbose',
+        # Only HLS/DASH downloads use it; see fragments.FragmentTuner
+        '--concurrent-fragments', str(context['fragment_concurrency']),
         '--user-agent', 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/100.0.4896.75 Safari/537.36',
-        '-f', 'bestvideo+bestaudio/best',
-        '--merge-output-format', 'mp4',
-        '-o', str(final_path),
-        '--print-json', url
+        *format_args,
+        *clips.section_args(context['section'], context['accurate_cuts']),
+        # One JSON progress object per line on stdout, so the watchdog can see byte progress
+        '--progress', '--newline', '--progress-template', 'download:%(progress)j',
+        '--print-json', context['url']
     ]
 
-    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+def _end_attempt(job_id, returncode, stderr_ring):
+    """
+    Bookkeeping once the downloader has exited and both of its pipes are drained.
 
-    def update_progress():
-        nonlocal initial_title, quality, duration_minutes, final_path, final_filename_base
-        for line in process.stdout:
-            try:
-                json_line = json.loads(line.strip())
-                if 'progress' in json_line:
-                    jobs[job_id]['progress'] = int(float(json_line['progress'].strip('%')))
-                elif 'total_bytes_estimate' in json_line and 'downloaded_bytes' in json_line:
-                    total_chunks = json_line['total_bytes_estimate']
-                    downloaded_chunks = json_line['downloaded_bytes']
-                    if total_chunks is not None and downloaded_chunks is not None and total_chunks > 0:
-                        jobs[job_id]['progress'] = int((downloaded_chunks / total_chunks) * 100)
-                if 'title' in json_line:
-                    initial_title = json_line['title'] or 'Untitled'
-                    jobs[job_id]['title'] = initial_title
-                    sanitized_title = sanitize_filename(initial_title)
-                    final_filename_base = f"{timestamp}_{sanitized_title}_{quality}.mp4"
-                    final_path = Path(f"{downloads_dir}/{final_filename_base}") # Update path
-                if 'format_note' in json_line:
-                    quality = json_line['format_note']
-                if 'duration' in json_line:
-                    duration_seconds = int(json_line['duration'])
-                    jobs[job_id]['duration'] = f"{int(duration_seconds // 60)}:{int(duration_seconds % 60):02d}"
-                if 'total_bytes_estimate' in json_line:
-                    jobs[job_id]['size'] = _format_bytes(json_line['total_bytes_estimate'])
-            except json.JSONDecodeError as e:
-                print(f"Error decoding JSON: {e}, Line: {line.strip()}")
-            except Exception as e:
-                print(f"Error parsing yt-dlp output: {e}")
-        process.stdout.close()
-
-    def handle_error():
-        error_output = ""
-        for line in process.stderr:
-            print(f"stderr: {line}")
-            error_output += line
+    Returns:
+        tuple: (returncode, the stderr tail kept in `stderr_ring`)
+    """
+    context = job_contexts[job_id]
+    stderr_tail = stderr_ring.text()
+    if 'error' not in jobs[job_id]:
+        jobs[job_id]['error'] = stderr_tail.strip()
+    if context['job_log'] is not None:
+        context['job_log'].close()
+        context['job_log'] = None
+    context['process'] = None
+    cpu_planner.release(job_id)
+    _mark(job_id, 'exited')
+    _observe_attempt_stages(job_id)
+    fragment_tuner.release(job_id, context['extractor'], _fragment_outcome(job_id, returncode, stderr_tail))
+    return returncode, stderr_tail
+
+def _fragment_outcome(job_id, returncode, stderr_tail):
+    """What the attempt that just ended tells fragment_tuner, or None if it was no HLS/DASH download that ran its course."""
+    context = job_contexts[job_id]
+    if not context['fragmented'] or context['cancelled'] or context['checkpointed'] or context.get('watchdog_reason'):
+        return None
+    category = retry.classify_error(stderr_tail) if returncode != 0 else None
+    outcome = {
+        'throttled': context['fragment_throttled'] or category == 'throttled',
+        'errors': context['fragment_retries'] > 0 or category is not None,
+    }
+    timings = jobs[job_id]['timings']
+    seconds = timings['downloaded'] - timings['extracted']
+    if returncode == 0 and seconds > 0:
+        outcome['bytes_per_second'] = jobs[job_id]['downloaded_bytes'] / seconds
+    return outcome
+
+def _add_cpu_seconds(job_id, stage, seconds):
+    """Adds CPU time (user + system) used by `job_id`'s processes in `stage` to the job and the metrics."""
+    if seconds is None:
+        return
+    cpu_seconds = jobs[job_id].setdefault('cpu_seconds', {})
+    cpu_seconds[stage] = round(cpu_seconds.get(stage, 0) + seconds, 3)
+    metrics.CPU_SECONDS.labels(stage).inc(seconds)
+
+def _handle_stdout_line(job_id, line):
+    """Applies one line of downloader stdout (info JSON or a progress object) to the job."""
+    context = job_contexts[job_id]
+    try:
+        json_line = json.loads(line.strip())
+        if 'progress' in json_line:
+            jobs[job_id]['progress'] = int(float(json_line['progress'].strip('%')))
+        elif 'downloaded_bytes' in json_line:
+            total_chunks = json_line.get('total_bytes') or json_line.get('total_bytes_estimate')
+            downloaded_chunks = json_line['downloaded_bytes']
+            if total_chunks is not None and downloaded_chunks is not None and total_chunks > 0:
+                jobs[job_id]['progress'] = int((downloaded_chunks / total_chunks) * 100)
+            if downloaded_chunks is not None:
+                # Video and audio streams report separately; sum them per file
+                filename = json_line.get('filename')
+                delta = downloaded_chunks - context['bytes_by_file'].get(filename, 0)
+                if delta > 0:
+                    metrics.DOWNLOADED_BYTES.inc(delta)
+                context['bytes_by_file'][filename] = downloaded_chunks
+                jobs[job_id]['downloaded_bytes'] = sum(context['bytes_by_file'].values())
+            if 'segments' in json_line:
+                # Parallel ranges of a segmented download (SEGMENTED_DOWNLOAD=1)
+                jobs[job_id]['segments'] = json_line['segments']
+        if 'title' in json_line:
+            # The info JSON is printed once extraction is done, before the download starts
+            if 'extracted' not in jobs[job_id]['timings']:
+                _mark(job_id, 'extracted')
+            context['title'] = json_line['title'] or 'Untitled'
+            jobs[job_id]['title'] = context['title']
+            if fragments.is_fragmented(json_line.get('protocol')):
+                context['fragmented'] = True
+            fragment_tuner.observe(job_id, context['extractor'], context['fragmented'], context['fragment_concurrency'])
+            if json_line.get('format_id'):
+                # One info JSON per stream when they're fetched separately
+                context['format_ids'].append(json_line['format_id'])
+                context['stream_has_video'][json_line['format_id']] = json_line.get('vcodec') != 'none'
+                jobs[job_id]['format_id'] = '+'.join(context['format_ids'])
+                jobs[job_id]['format_path'] = formats.download_path(context['format_ids'])
+        if json_line.get('filesize') or json_line.get('filesize_approx'):
+            # Size reported by extraction, per format when streams are fetched
+            # separately; a retry is scheduled by what's left of it
+            format_sizes = context.setdefault('format_sizes', {})
+            format_sizes[json_line.get('format_id')] = json_line.get('filesize') or json_line.get('filesize_approx')
+            context['expected_bytes'] = sum(format_sizes.values())
+            fraction = clips.clip_fraction(context['section'], json_line.get('duration'))
+            if fraction is not None:
+                # Only the clip is fetched
+                context['expected_bytes'] = int(context['expected_bytes'] * fraction)
+        if 'format_note' in json_line and json_line.get('vcodec') != 'none':
+            context['quality'] = json_line['format_note']
+            if json_line.get('height'):
+                context['source_height'] = json_line['height']
+        elif json_line.get('abr') and _audio_only(job_id):
+            context['quality'] = f"{int(json_line['abr'])}kbps"
+        if 'duration' in json_line:
+            duration_seconds = int(json_line['duration'])
+            jobs[job_id]['duration'] = f"{int(duration_seconds // 60)}:{int(duration_seconds % 60):02d}"
+        if 'total_bytes_estimate' in json_line:
+            jobs[job_id]['size'] = _format_bytes(json_line['total_bytes_estimate'])
+    except json.JSONDecodeError as e:
+        print(f"Error decoding JSON: {e}, Line: {line.strip()}")
+    except Exception as e:
+        print(f"Error parsing yt-dlp output: {e}")
+
+def _handle_stderr_line(job_id, line, stderr_ring):
+    """Collects one line of downloader stderr and spots the start of postprocessing."""
+    context = job_contexts[job_id]
+    stderr_ring.append(line)
+    if context['job_log'] is not None:
+        context['job_log'].write(line + '\n')
+    # --verbose output is mostly [debug] and per-fragment noise; only surface what matters
+    if line.startswith(('ERROR:', 'WARNING:')):
+        print(f"stderr: {line}")
+    if line.startswith('[download] Got error:') and 'Retrying fragment' in line:
+        # yt-dlp retried a fragment; fragment_tuner backs off after such an attempt
+        context['fragment_retries'] += 1
+        if retry.classify_error(line) == 'throttled':
+            context['fragment_throttled'] = True
+    if line.startswith(POSTPROCESSOR_PREFIXES) and not context['postprocessing']:
+        context['postprocessing'] = True
+        _mark(job_id, 'downloaded')
+
+def _downloader_executable(job_id):
+    executable = [sys.executable, FAKE_DOWNLOADER_PATH] if DOWNLOAD_BACKEND == 'fake' else ['yt-dlp']
+    if segmented.SEGMENTED_DOWNLOAD and _segmentable(job_id):
+        # segmented.py runs the extraction, then fetches a progressive format over parallel ranges
+        return [sys.executable, SEGMENTED_PATH, *executable]
+    return executable
+
+def _segmentable(job_id):
+    """Whether a job's download could be one plain file: not streams, sections or extracted audio."""
+    context = job_contexts[job_id]
+    return not (pipeline.STAGED_PIPELINE or context['renditions'] or context['section'] or _audio_only(job_id))
+
+def _downloader_env(job_id):
+    if DOWNLOAD_BACKEND != 'fake':
+        return None
+    # Lets the fake fail the first N attempts of a job and then succeed
+    return dict(os.environ, FAKE_DOWNLOADER_ATTEMPT=str(jobs[job_id]['attempts']))
+
+def _observe_attempt_stages(job_id):
+    """Records extract/download/merge durations of the attempt that just ended."""
+    job = jobs[job_id]
+    timings = job['timings']
+    if 'extracted' not in timings:
+        _update_durations(job)
+        return
+    # Without a postprocessor the download ran until yt-dlp exited
+    timings.setdefault('downloaded', timings['exited'])
+    stages = ('extract', 'download', 'merge') if job_contexts[job_id]['postprocessing'] else ('extract', 'download')
+    _update_durations(job, observe=stages)
+
+def _upload_result(job_id):
+    job = jobs[job_id]
+    context = job_contexts[job_id]
+    # A multi-rendition job uploads every rendition, then the manifest (its 'filename') last,
+    # so a manifest in the bucket means the whole group is there
+    filenames = [rendition['filename'] for rendition in job.get('renditions', {}).values()] + [job['filename']]
+    local_paths = [os.path.join(context['downloads_dir'], filename) for filename in filenames]
+    context['upload_bytes'] = sum(os.path.getsize(local_path) for local_path in local_paths)
+    context['upload_started_at'] = time.monotonic()
+    job['upload_bytes'] = context['upload_bytes']
+    job['status'] = 'uploading'
+    try:
+        # A live span rather than a recorded one, so the storage client's own spans nest under it
+        with tracing.span('job.upload', {'job.id': job_id, 'upload.bytes': context['upload_bytes']}):
+            for filename, local_path in zip(filenames, local_paths):
+                job['gcs_uri'] = upload_file_to_gcs(os.environ.get('GCS_BUCKET_NAME'), local_path,
+                                                    f"{GCS_DOWNLOADS_PREFIX}/{filename}")
+    except Exception as e:
+        if not context['checkpointed']:
+            job['error'] = f"Error uploading file to GCS: {e}"
+            job['status'] = 'failed'
+            _remove_outputs(local_paths)
+        return
+    if not context['checkpointed']:
+        _remove_outputs(local_paths)
+    elapsed = time.monotonic() - context['upload_started_at']
+    metrics.UPLOADED_BYTES.labels('download').inc(context['upload_bytes'])
+    if elapsed > 0:
+        rate = context['upload_bytes'] / elapsed
+        previous = upload_stats['bytes_per_second']
+        upload_stats['bytes_per_second'] = rate if previous is None else 0.8 * previous + 0.2 * rate
+    if context['checkpointed']:
+        # checkpoint_job() ran mid-upload; the job is another instance's to resume now
+        return
+    job['status'] = 'completed'
+    _mark(job_id, 'uploaded')
+    _update_durations(job, observe=('upload',), trace=False)
+
+# --- Staged pipeline (STAGED_PIPELINE=1) ---
+
+def _stream_files(job_id):
+    """
+    The finished .f<format_id> stream files yt-dlp left for `job_id`, video
+    first. Which stream has video comes from the info JSON of its format, not
+    the extension: a VP9 + Opus pair is .webm twice.
+    """
+    prefix = str(_working_path(job_id).with_suffix('')) + '.f'
+    has_video = job_contexts[job_id].get('stream_has_video', {})
+    paths = (path for path in glob.glob(glob.escape(prefix) + '*') if not path.endswith(('.part', '.ytdl', '.temp')))
+    # Formats without an info JSON count as video; the path keeps the order independent of glob's
+    return sorted(paths, key=lambda path: (not has_video.get(os.path.splitext(path[len(prefix):])[0], True), path))
+
+def _ffmpeg_executable():
+    if DOWNLOAD_BACKEND == 'fake':
+        return [sys.executable, FAKE_DOWNLOADER_PATH, '--ffmpeg']
+    return [FFMPEG_PATH]
+
+def _merge_command(streams, output_path, threads=None):
+    command = [*_ffmpeg_executable(), '-y', '-nostdin', '-loglevel', 'error']
+    for stream in streams:
+        command += ['-i', stream]
+    # Video from the first input, audio from the last: a lone progressive file maps both
+    command += ['-map', '0:v:0?', '-map', f"{len(streams) - 1}:a:0?", '-c', 'copy']
+    if threads:
+        command += ['-threads', str(threads)]
+    return command + [str(output_path)]
+
+def _merge_job(job_id):
+    """Merge stage: muxes the downloaded streams into the job's mp4, then hands it to the upload stage."""
+    with tracing.attached(job_contexts[job_id].get('trace_context')):
+        _merge_streams(job_id)
+
+def _merge_streams(job_id):
+    job = jobs[job_id]
+    context = job_contexts[job_id]
+    if context['cancelled'] or context['checkpointed']:
+        return
+    _mark(job_id, 'merge_started')
+    streams = _stream_files(job_id)
+    if not streams:
+        job['status'] = 'failed'
+        job['error'] = "Downloaded streams not found."
+        _finish_job(job_id)
+        return
+
+    if len(streams) == 1 and streams[0].endswith('.mp4'):
+        # A progressive mp4 (or one yt-dlp merged itself) needs no ffmpeg
+        os.replace(streams[0], context['final_path'])
+        streams = []
+        _mark(job_id, 'merged')
+    else:
+        threads, cpus = cpu_planner.acquire(job_id)
+        try:
+            process = subprocess.Popen(_merge_command(streams, context['final_path'], threads),
+                                       stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, start_new_session=True)
+            context['merge_process'] = process
+            cpuplan.pin(process.pid, cpus)
+            if context['cancelled'] or context['checkpointed']:
+                _kill_process_group(process)
+            # ffmpeg runs with -loglevel error, so its stderr is short
+            stderr = process.stderr.read()
+            process.stderr.close()
+            _add_cpu_seconds(job_id, 'merge', cpuplan.wait_with_usage(process))
+        finally:
+            cpu_planner.release(job_id)
+            context['merge_process'] = None
+        if context['cancelled'] or context['checkpointed']:
+            return
+        _mark(job_id, 'merged')
+        if process.returncode != 0:
+            job['status'] = 'failed'
+            job['error'] = f"Error merging streams: {stderr.decode('utf-8', errors='replace').strip()[-2000:]}"
+            job['error_category'] = 'merge'
+            _finish_job(job_id)
+            return
+
+    _update_durations(job, observe=('merge_queue', 'merge'))
+    for stream in streams:
+        try:
+            os.remove(stream)
+        except OSError as e:
+            print(f"Error removing stream file {stream}: {e}")
+    _finalize_download(job_id)
+    _upload_or_finish(job_id)
+
+def _render_command(streams, name, output_path, source_height, threads=None):
+    command = [*_ffmpeg_executable(), '-y', '-nostdin', '-loglevel', 'error']
+    for stream in streams:
+        command += ['-i', stream]
+    # As in _merge_command(): video from the first input, audio from the last
+    audio = ['-map', f"{len(streams) - 1}:a:0?"]
+    path = formats.render_path(name, source_height)
+    if path == 'audio':
+        command += [*audio, '-vn', '-c', 'copy']
+    elif path == 'remux':
+        command += ['-map', '0:v:0', *audio, '-c', 'copy']
+    else:
+        command += ['-map', '0:v:0', *audio, '-vf', f"scale=-2:{formats.RENDITIONS[name]}",
+                    '-c:v', 'libx264', '-preset', 'veryfast', '-c:a', 'copy']
+    if threads:
+        command += ['-threads', str(threads)]
+    return command + [str(output_path)]
+
+def _rendition_path(job_id, name, streams):
+    """
+    Working path of a rendition; audio keeps the container of the audio
+    stream, the last of `streams` as _stream_files() orders them.
+    """
+    stem = str(_working_path(job_id).with_suffix(''))
+    if formats.RENDITIONS[name] is None:
+        ext = os.path.splitext(streams[-1])[1]
+        return Path(f"{stem}.r{name}{'.m4a' if ext == '.mp4' else ext}")
+    return Path(f"{stem}.r{name}.mp4")
+
+def _render_job(item):
+    """Render stage: makes one rendition of a multi-rendition job; the last one to finish completes the job."""
+    job_id, name = item
+    context = job_contexts[job_id]
+    try:
+        if not (context['cancelled'] or context['checkpointed']):
+            with tracing.attached(context.get('trace_context')):
+                _render(job_id, name)
+    finally:
+        with _render_lock:
+            context['renders_pending'] -= 1
+            last = context['renders_pending'] == 0
+    if last:
+        _finish_renditions(job_id)
+
+def _render(job_id, name):
+    job = jobs[job_id]
+    context = job_contexts[job_id]
+    with _render_lock:
+        if 'render_started' not in job['timings']:
+            _mark(job_id, 'render_started')
+    streams = _stream_files(job_id)
+    if not streams:
+        job['renditions'][name] = {'error': "Downloaded streams not found."}
+        return
+    output_path = _rendition_path(job_id, name, streams)
+    path = formats.render_path(name, context['source_height'])
+    # Renditions of one job run side by side, so each takes its own share of the cores
+    share_key = f"{job_id}:{name}"
+    threads, cpus = cpu_planner.acquire(share_key)
+    try:
+        process = subprocess.Popen(_render_command(streams, name, output_path, context['source_height'], threads),
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, start_new_session=True)
+        context['render_processes'][name] = process
+        cpuplan.pin(process.pid, cpus)
+        if context['cancelled'] or context['checkpointed']:
+            _kill_process_group(process)
+        stderr = process.stderr.read()
         process.stderr.close()
-        if 'error' not in jobs[job_id]:
-            jobs[job_id]['error'] = error_output.strip()
+        _add_cpu_seconds(job_id, 'render', cpuplan.wait_with_usage(process))
+    finally:
+        cpu_planner.release(share_key)
+        context['render_processes'].pop(name, None)
+    if process.returncode != 0:
+        job['renditions'][name] = {'path': path, 'error': stderr.decode('utf-8', errors='replace').strip()[-2000:]}
+        return
+    job['renditions'][name] = {'path': path, 'height': formats.RENDITIONS[name], 'working_path': str(output_path)}
+
+def _finish_renditions(job_id):
+    """
+    Once every rendition of `job_id` is made: drops the source streams,
+    names the renditions after the title, writes the manifest and hands the
+    group on to upload. Any failed rendition fails the job.
+    """
+    job = jobs[job_id]
+    context = job_contexts[job_id]
+    if context['cancelled'] or context['checkpointed']:
+        return
+    _mark(job_id, 'rendered')
+    _update_durations(job, observe=('render_queue', 'render'))
+    for stream in _stream_files(job_id):
+        try:
+            os.remove(stream)
+        except OSError as e:
+            print(f"Error removing stream file {stream}: {e}")
+    failed = {name: rendition['error'] for name, rendition in job['renditions'].items() if 'error' in rendition}
+    if failed:
+        job['status'] = 'failed'
+        job['error'] = '; '.join(f"{name}: {error}" for name, error in failed.items())
+        job['error_category'] = 'render'
+        _remove_partial_files(job_id)
+        _finish_job(job_id)
+        return
+
+    prefix = f"{context['timestamp']}_{sanitize_filename(job['title'])}"
+    manifest = {
+        'jobId': job_id,
+        'url': context['url'],
+        'title': job['title'],
+        'duration': job['duration'],
+        'sourceHeight': context['source_height'],
+        'renditions': [],
+    }
+    try:
+        for name in context['renditions']:
+            rendition = job['renditions'][name]
+            working_path = Path(rendition.pop('working_path'))
+            rendition['filename'] = f"{prefix}_{name}{working_path.suffix}"
+            os.rename(working_path, os.path.join(context['downloads_dir'], rendition['filename']))
+            manifest['renditions'].append({
+                'name': name,
+                'filename': rendition['filename'],
+                'object': f"{GCS_DOWNLOADS_PREFIX}/{rendition['filename']}",
+                'height': rendition['height'],
+                'path': rendition['path'],
+                'bytes': os.path.getsize(os.path.join(context['downloads_dir'], rendition['filename'])),
+            })
+        job['filename'] = f"{prefix}_manifest.json"
+        with open(os.path.join(context['downloads_dir'], job['filename']), 'w') as f:
+            json.dump(manifest, f, indent=2)
+    except OSError as e:
+        job['status'] = 'failed'
+        job['error'] = f"Error writing renditions: {e}"
+        _finish_job(job_id)
+        return
+    job['status'] = 'completed'
+    _mark(job_id, 'renamed')
+    _update_durations(job, observe=('rename',))
+    _upload_or_finish(job_id)
 
-    update_progress_thread = threading.Thread(target=update_progress)
-    update_error_thread = threading.Thread(target=handle_error)
+def _enter_pipeline(job_id):
+    """
+    Hands a downloaded job to the merge stage, each of its renditions to the
+    render stage, or with nothing to merge (audio-only) on to upload.
+    """
+    if jobs[job_id]['status'] == 'merging':
+        merge_stage.submit(job_id)
+    elif jobs[job_id]['status'] == 'rendering':
+        context = job_contexts[job_id]
+        jobs[job_id]['renditions'] = {}
+        context['renders_pending'] = len(context['renditions'])
+        for name in context['renditions']:
+            render_stage.submit((job_id, name))
+    else:
+        _upload_or_finish(job_id)
 
-    update_progress_thread.start()
-    update_error_thread.start()
+def _upload_or_finish(job_id):
+    if _needs_upload(job_id):
+        jobs[job_id]['status'] = 'uploading'
+        upload_stage.submit(job_id)
+    else:
+        _finish_job(job_id)
 
-    process.wait()
+def _upload_job(job_id):
+    """Upload stage: the last step of a staged job."""
+    context = job_contexts[job_id]
+    if context['cancelled'] or context['checkpointed']:
+        return
+    with tracing.attached(context.get('trace_context')):
+        _mark(job_id, 'upload_started')
+        _update_durations(jobs[job_id], observe=('upload_queue',))
+        _upload_result(job_id)
+    _finish_job(job_id)
 
-    response_data = {'jobId': job_id}
+merge_stage = pipeline.Stage('merge', pipeline.MERGE_WORKERS, _merge_job)
+render_stage = pipeline.Stage('render', pipeline.RENDER_WORKERS, _render_job)
+upload_stage = pipeline.Stage('upload', pipeline.UPLOAD_WORKERS, _upload_job)
 
-    if process.returncode == 0:
-        jobs[job_id]['status'] = 'completed'
-        final_title = jobs[job_id]['title']
-        sanitized_title = sanitize_filename(final_title)
-        new_filename = f"{timestamp}_{sanitized_title}_{quality}.mp4"
-        new_path = Path(f"{downloads_dir}/{new_filename}")
+def upload_time_remaining(job_id):
+    """Estimated seconds left on `job_id`'s upload, or None if unknown."""
+    context = job_contexts[job_id]
+    rate = upload_stats['bytes_per_second']
+    if 'upload_started_at' not in context or not rate:
+        return None
+    elapsed = time.monotonic() - context['upload_started_at']
+    return max(0.0, context['upload_bytes'] / rate - elapsed)
 
-        if final_path.exists():
-            try:
-                os.rename(final_path, new_path)
-                jobs[job_id]['filename'] = new_filename
-                response_data['filename'] = new_filename
-            except OSError as e:
-                jobs[job_id]['error'] = f"Error renaming file: {e}"
-                jobs[job_id]['status'] = 'failed'
-        else:
-            jobs[job_id]['error'] = "Final downloaded file not found."
-            jobs[job_id]['status'] = 'failed'
+def _running_jobs():
+    for job_id, context in list(job_contexts.items()):
+        if context['process'] is not None and not context['cancelled']:
+            yield job_id, jobs[job_id], context
+
+def _stop_stalled_job(job_id, reason):
+    context = job_contexts[job_id]
+    process = context['process']
+    if process is None:
+        return
+    context['watchdog_reason'] = reason
+    _kill_process_group(process)
+
+stall_watchdog = watchdog.StallWatchdog(_running_jobs, _stop_stalled_job)
+
+def _working_path(job_id):
+    context = job_contexts[job_id]
+    return Path(f"{context['downloads_dir']}/{context['timestamp']}_{job_id}.mp4")
+
+def _kill_process_group(process):
+    """SIGTERMs the process group of `process`, escalating to SIGKILL after a grace period."""
+    if not _signal_process_group(process.pid, signal.SIGTERM):
+        return
+    if not isinstance(process, subprocess.Popen):
+        # An asyncio process: the event loop must not block, so escalate from a loop timer
+        scheduler.call_later_threadsafe(CANCEL_GRACE_SECONDS, _escalate_kill, process)
+        return
+    try:
+        process.wait(timeout=CANCEL_GRACE_SECONDS)
+    except subprocess.TimeoutExpired:
+        pass
+    # Children (ffmpeg) may outlive yt-dlp itself, so always sweep the group
+    _signal_process_group(process.pid, signal.SIGKILL)
+
+def _escalate_kill(process):
+    if process.returncode is None:
+        _signal_process_group(process.pid, signal.SIGKILL)
+
+def _signal_process_group(pid, signum):
+    try:
+        os.killpg(pid, signum)
+        return True
+    except ProcessLookupError:
+        return False
+
+def _remove_outputs(local_paths):
+    """Deletes a job's uploaded (or unuploadable) outputs, unless KEEP_LOCAL_FILES is set."""
+    if KEEP_LOCAL_FILES:
+        return
+    for local_path in local_paths:
+        try:
+            os.remove(local_path)
+        except OSError as e:
+            print(f"Error removing output file {local_path}: {e}")
+
+def _partial_files(job_id):
+    working_path = _working_path(job_id)
+    # Covers the merged output and yt-dlp's .part/.ytdl/.fNNN/-FragN intermediates
+    pattern = glob.escape(str(working_path.with_suffix(''))) + '.*'
+    return glob.glob(pattern)
+
+def _remove_partial_files(job_id):
+    removed = 0
+    for partial_file in _partial_files(job_id):
+        try:
+            os.remove(partial_file)
+            removed += 1
+        except OSError as e:
+            print(f"Error removing partial file {partial_file}: {e}")
+    return removed
 
-        jobs[job_id]['quality'] = quality
-        # Duration is already set in update_progress
+def _job_processes(context):
+    """The downloader, merge and render processes a job has running."""
+    processes = [context['process'], context.get('merge_process'), *list(context['render_processes'].values())]
+    return [process for process in processes if process is not None]
 
+def cancel_job(job_id):
+    if job_id not in jobs:
+        return jsonify({'error': 'Job not found'}), 404
+    job = jobs[job_id]
+    context = job_contexts[job_id]
+    if job['status'] in TERMINAL_STATUSES or context['cancelled']:
+        return jsonify({'error': f"Job is already {job['status']}", 'status': job['status']}), 409
+
+    context['cancelled'] = True
+    job['status'] = 'cancelled'
+    scheduler.cancel(job_id)
+
+    for process in _job_processes(context):
+        _kill_process_group(process)
+
+    job['partial_files_removed'] = _remove_partial_files(job_id)
+    _finish_job(job_id)
+    return jsonify({'jobId': job_id, 'status': 'cancelled'})
+
+def _output_file(job_id):
+    """The finished output of `job_id`: final_path, or whatever audio extraction named it."""
+    final_path = job_contexts[job_id]['final_path']
+    if not _audio_only(job_id):
+        return final_path
+    outputs = [path for path in glob.glob(glob.escape(str(final_path.with_suffix(''))) + '.*')
+               if not path.endswith(('.part', '.ytdl', '.temp'))]
+    return Path(outputs[0]) if len(outputs) == 1 else final_path
+
+def _finalize_download(job_id):
+    job = jobs[job_id]
+    context = job_contexts[job_id]
+    job['status'] = 'completed'
+    quality = context['quality']
+    final_path = _output_file(job_id)
+    sanitized_title = sanitize_filename(job['title'])
+    new_filename = f"{context['timestamp']}_{sanitized_title}_{quality}{final_path.suffix}"
+    new_path = Path(f"{context['downloads_dir']}/{new_filename}")
+
+    if final_path.exists():
+        try:
+            os.rename(final_path, new_path)
+            _mark(job_id, 'renamed')
+            _update_durations(job, observe=('rename',))
+            job['filename'] = new_filename
+        except OSError as e:
+            job['error'] = f"Error renaming file: {e}"
+            job['status'] = 'failed'
     else:
-        jobs[job_id]['status'] = 'failed'
-        jobs[job_id]['error'] = jobs[job_id].get('error', f"Process exited with code {process.returncode}")
+        job['error'] = "Final downloaded file not found."
+        job['status'] = 'failed'
 
-    return jsonify(response_data)
+    job['quality'] = quality
+    # Duration is already set in update_progress
+
+def checkpoint_job(job_id):
+    """
+    Stops `job_id` so it can be resumed elsewhere, leaving yt-dlp's partial
+    files in place.
+
+    Returns:
+        tuple: (checkpoint dict, list of partial file paths)
+    """
+    job = jobs[job_id]
+    context = job_contexts[job_id]
+    context['checkpointed'] = True
+    scheduler.cancel(job_id)
+    for process in _job_processes(context):
+        _kill_process_group(process)
+    job['status'] = 'checkpointed'
+    checkpoint = {
+        'job_id': job_id,
+        'url': context['url'],
+        'extractor': context['extractor'],
+        'timestamp': context['timestamp'],
+        'job_class': context['job_class'],
+        'attempts': job['attempts'],
+        'downloaded_bytes': job.get('downloaded_bytes', 0),
+        'bytes_by_file': {os.path.basename(name or ''): size for name, size in context.get('bytes_by_file', {}).items()},
+        'history': job['history'],
+        'keep_log': context['keep_log'],
+        'lane': context['lane'],
+        'client': context['client'],
+        'client_label': job['client_label'],
+        'preset': context['preset'],
+        'section': context['section'],
+        'accurate_cuts': context['accurate_cuts'],
+        'renditions': context['renditions'],
+    }
+    _finish_job(job_id)
+    return checkpoint, _partial_files(job_id)
+
+def restore_job(checkpoint):
+    """Re-queues a job from a checkpoint written by another instance."""
+    job_id = checkpoint['job_id']
+    history = checkpoint.get('history', []) + [{'event': 'resumed', 'from_instance': checkpoint.get('instance')}]
+    _register_job(job_id, checkpoint['url'], checkpoint['extractor'], timestamp=checkpoint['timestamp'],
+                  job_class=checkpoint.get('job_class', 'default'), attempts=checkpoint.get('attempts', 0),
+                  history=history, keep_log=checkpoint.get('keep_log', False),
+                  lane=checkpoint.get('lane', jobqueue.DEFAULT_LANE), client=checkpoint.get('client', 'unknown'),
+                  client_label=checkpoint.get('client_label'), preset=checkpoint.get('preset'),
+                  section=checkpoint.get('section'),
+                  accurate_cuts=checkpoint.get('accurate_cuts', False), renditions=checkpoint.get('renditions'))
+    _start_workers()
+    scheduler.submit(job_id)
+
+def get_job_log(job_id):
+    """Serves the gzip'd yt-dlp output of a job started with "log": true."""
+    if job_id not in jobs:
+        return jsonify({'error': 'Job not found'}), 404
+    log_path = joblog.job_log_path(job_id)
+    if not os.path.isfile(log_path):
+        return jsonify({'error': 'No log was kept for this job; start it with "log": true'}), 404
+    return send_file(log_path, mimetype='application/gzip', as_attachment=True,
+                     download_name=f"{job_id}.log.gz")
 
 def get_job_status(job_id):
     if job_id not in jobs:
         return jsonify({'error': 'Job not found'}), 404
-    return jsonify(jobs[job_id])
+    response = jsonify(jobs[job_id])
+    response.headers['Server-Timing'] = server_timing(jobs[job_id])
+    return response
 
 def _format_bytes(bytes_amount):
     if bytes_amount is None:
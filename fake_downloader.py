@@ -0,0 +1,373 @@
+# fake_downloader.py
+
+"""
+Stand-in for the yt-dlp executable, selected with DOWNLOAD_BACKEND=fake.
+
+It accepts the same command line the service builds for yt-dlp and behaves
+like it on the wire: the info JSON on stdout once "extraction" is done, one
+JSON progress object per line while "downloading", ERROR: lines on stderr
+and a non-zero exit code on failure. Nothing is fetched; the output is a
+sparse file of the simulated size, so thousands of jobs cost no bandwidth
+and almost no disk.
+
+Behaviour comes from FAKE_* environment variables, overridable per URL
+through the query string, e.g. fake://site-a/clip1?size=5000000&fail=throttled&fail_attempts=2
+
+    size          bytes, or a 'min-max' range           (FAKE_SIZE_BYTES)
+    bandwidth     bytes/s, 0 = as fast as possible      (FAKE_BANDWIDTH_BYTES_PER_SECOND)
+    extract       seconds of extraction latency         (FAKE_EXTRACT_SECONDS)
+    merge         seconds spent "merging" after download (FAKE_MERGE_SECONDS)
+    failure_rate  probability an attempt fails          (FAKE_FAILURE_RATE)
+    fail          failure category, see FAILURE_MESSAGES (FAKE_FAILURE_CATEGORIES, comma separated);
+                  given in the URL, the attempt always fails
+    fail_attempts only attempts up to this number fail  (FAKE_FAIL_ATTEMPTS, 0 = every attempt)
+    fail_at       fraction of the download done when it fails (random if unset)
+    protocol      protocol the format reports, e.g. m3u8_native (FAKE_PROTOCOL)
+    connections   fragments a fragmented origin serves at full bandwidth each; more
+                  add nothing, and over twice as many draw 429s (FAKE_ORIGIN_CONNECTIONS)
+    media         URL of a real file to report as the format's url (FAKE_MEDIA_URL), for
+                  segmented.py to fetch; the fake itself still only simulates
+
+Randomness is seeded from FAKE_SEED, the URL and the attempt number, so a
+run is reproducible job for job.
+
+Unsplit, the video stands for one with separate 720p streams and a 360p
+progressive file: a format sort (-S) that starts with 'hasaud' picks the
+progressive one, which is half the size and needs no merge; anything else
+picks the separate streams and merges them.
+
+A format list such as -f 'bv/b,ba/b' with an %(format_id)s output template
+(STAGED_PIPELINE=1) fetches a video and an audio stream into separate files
+and skips the merge. --download-sections fetches only the share of the
+file a time range covers, or the matching ones of FAKE_CHAPTERS equal
+chapters titled 'Chapter 1', 'Chapter 2', ... With -x or -f 'ba...' it
+fetches an Opus audio stream a tenth of the size; -x "extracts" it to
+.opus. Run as `fake_downloader.py --ffmpeg ...` it stands in for the
+ffmpeg that merges them: it keeps one core busy for FAKE_MERGE_SECONDS,
+then writes a sparse output the size of its inputs.
+"""
+
+import os
+import sys
+import json
+import random
+import re
+import time
+from urllib.parse import urlparse, parse_qs
+
+FAKE_SEED = os.environ.get('FAKE_SEED', '0')
+DEFAULTS = {
+    'size': os.environ.get('FAKE_SIZE_BYTES', '50000000'),
+    'bandwidth': os.environ.get('FAKE_BANDWIDTH_BYTES_PER_SECOND', '20000000'),
+    'extract': os.environ.get('FAKE_EXTRACT_SECONDS', '0.5'),
+    'merge': os.environ.get('FAKE_MERGE_SECONDS', '0'),
+    'failure_rate': os.environ.get('FAKE_FAILURE_RATE', '0'),
+    'fail': os.environ.get('FAKE_FAILURE_CATEGORIES', 'throttled,network,unavailable'),
+    'fail_attempts': os.environ.get('FAKE_FAIL_ATTEMPTS', '0'),
+    'fail_at': None,
+    'protocol': os.environ.get('FAKE_PROTOCOL', 'https'),
+    'connections': os.environ.get('FAKE_ORIGIN_CONNECTIONS', '4'),
+    'media': os.environ.get('FAKE_MEDIA_URL'),
+}
+# Height of the video stream (and of the merged file) the fake "downloads"
+FAKE_SOURCE_HEIGHT = int(os.environ.get('FAKE_SOURCE_HEIGHT', 720))
+FAKE_CHAPTERS = int(os.environ.get('FAKE_CHAPTERS', 4))
+PROGRESS_INTERVAL_SECONDS = float(os.environ.get('FAKE_PROGRESS_INTERVAL_SECONDS', 0.5))
+
+# What yt-dlp prints for each failure category that retry.classify_error() knows
+FAILURE_MESSAGES = {
+    'throttled': "ERROR: [generic] {id}: Unable to download webpage: HTTP Error 429: Too Many Requests",
+    'forbidden': "ERROR: unable to download video data: HTTP Error 403: Forbidden",
+    'unavailable': "ERROR: [generic] {id}: Video unavailable",
+    'network': "ERROR: unable to download video data: <urlopen error [Errno 111] Connection refused>",
+    'extractor': "ERROR: [generic] {id}: Unable to extract video data; please report this issue on GitHub",
+}
+# Categories that only ever happen before the download starts
+EXTRACTION_FAILURES = ('unavailable', 'extractor')
+# (format_id, ext, vcodec, share of the total size) of the streams fetched
+# when yt-dlp is asked for separate video and audio formats
+SPLIT_STREAMS = (('137', 'mp4', 'avc1', 0.9), ('140', 'm4a', 'none', 0.1))
+# (format_id, format_note, share of the total size) of the progressive format
+PROGRESSIVE_FORMAT = ('18', '360p', 0.5)
+# (format_id, ext, acodec, abr, share of the total size) of the audio-only format
+AUDIO_FORMAT = ('251', 'webm', 'opus', 130, 0.1)
+
+
+def _sample(rng, value, cast=float):
+    """Turns '5' or '1-10' into a number, drawing uniformly from a range."""
+    value = str(value)
+    if '-' in value.strip('-'):
+        low, high = (cast(part) for part in value.split('-', 1))
+        return cast(rng.uniform(low, high))
+    return cast(value)
+
+
+def _parse_args(argv):
+    """Picks the bits of a yt-dlp command line the fake needs; everything else is ignored."""
+    options = {
+        'output': None,
+        'format': None,
+        'format_sort': '',
+        'section': None,
+        'extract_audio': False,
+        'concurrent_fragments': 1,
+        'url': argv[-1] if argv else '',
+        'print_json': False,
+        'skip_download': False,
+    }
+    for i, arg in enumerate(argv[:-1]):
+        if arg in ('-o', '--output'):
+            options['output'] = argv[i + 1]
+        elif arg in ('-f', '--format'):
+            options['format'] = argv[i + 1]
+        elif arg in ('-S', '--format-sort'):
+            options['format_sort'] = argv[i + 1]
+        elif arg in ('-N', '--concurrent-fragments'):
+            options['concurrent_fragments'] = int(argv[i + 1])
+        elif arg == '--download-sections':
+            options['section'] = argv[i + 1]
+        elif arg in ('-x', '--extract-audio'):
+            options['extract_audio'] = True
+        elif arg == '--load-info-json':
+            # No URL on the command line then; it comes from the info JSON
+            with open(argv[i + 1]) as f:
+                options['url'] = json.load(f)['webpage_url']
+        elif arg == '--print-json':
+            options['print_json'] = True
+        elif arg in ('-j', '--dump-json', '--skip-download', '-s', '--simulate'):
+            options['print_json'] = options['print_json'] or arg in ('-j', '--dump-json')
+            options['skip_download'] = True
+    return options
+
+
+def _output_path(template, format_id, ext):
+    """Fills in the only output template fields the service uses."""
+    if '%(' not in template:
+        return template
+    return template.replace('%(format_id)s', format_id).replace('%(ext)s', ext).replace('%%', '%')
+
+
+def _section_share(section, duration, chapters):
+    """Share of the video a --download-sections spec selects."""
+    if section.startswith('*'):
+        start, _, end = section[1:].partition('-')
+        end = duration if end == 'inf' else min(float(end), duration)
+        return max(0.0, end - float(start)) / duration
+    matched = [c for c in chapters if re.search(section, c['title'])]
+    return sum(c['end_time'] - c['start_time'] for c in matched) / duration
+
+
+def _settings(url):
+    settings = dict(DEFAULTS)
+    for key, values in parse_qs(urlparse(url).query).items():
+        if key in settings:
+            settings[key] = values[-1]
+    return settings
+
+
+def _emit(stream, line):
+    stream.write(line + '\n')
+    stream.flush()
+
+
+def _download(output, size, bandwidth, downloaded_before, fail_bytes, throttled=False):
+    """
+    "Downloads" one file, failing once the job as a whole reaches `fail_bytes`.
+    A `throttled` download has a fragment retried on a 429 every progress interval.
+
+    Returns:
+        bool: False if the download failed part way.
+    """
+    part_path = output + '.part'
+    if os.path.dirname(output):
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+    downloaded = 0
+    started_at = time.monotonic()
+    with open(part_path, 'ab') as f:
+        while downloaded < size:
+            if bandwidth > 0:
+                step = max(1, int(bandwidth * PROGRESS_INTERVAL_SECONDS))
+                time.sleep(min(PROGRESS_INTERVAL_SECONDS, (size - downloaded) / bandwidth))
+            else:
+                step = size
+            downloaded = min(size, downloaded + step)
+            failed = fail_bytes is not None and downloaded_before + downloaded >= fail_bytes
+            if failed:
+                downloaded = max(0, fail_bytes - downloaded_before)
+            # Growing the file by truncate() leaves a hole: size on paper, no blocks on disk
+            f.truncate(downloaded)
+            elapsed = time.monotonic() - started_at
+            speed = downloaded / elapsed if elapsed > 0 else None
+            _emit(sys.stdout, json.dumps({
+                'status': 'downloading' if downloaded < size else 'finished',
+                'downloaded_bytes': downloaded,
+                'total_bytes': size,
+                'filename': output,
+                'tmpfilename': part_path,
+                'elapsed': elapsed,
+                'speed': speed,
+                'eta': int((size - downloaded) / speed) if speed else None,
+            }))
+            if failed:
+                return False
+            if throttled and downloaded < size:
+                _emit(sys.stderr, f"[download] Got error: HTTP Error 429: Too Many Requests. "
+                                  f"Retrying fragment {downloaded * 100 // size + 1} (1/10)...")
+    os.replace(part_path, output)
+    return True
+
+
+def run_ffmpeg(argv):
+    """
+    Fake ffmpeg merge: `-i` inputs in, the last argument out. With -vn only
+    the last input's audio is copied, which costs next to nothing; with
+    -vf scale=-2:H the video is "downscaled" from FAKE_SOURCE_HEIGHT, which
+    costs FAKE_MERGE_SECONDS per 720 output lines on top of the merge.
+    """
+    inputs = [argv[i + 1] for i, arg in enumerate(argv[:-1]) if arg == '-i']
+    output = argv[-1] if argv else None
+    missing = [path for path in inputs if not os.path.exists(path)]
+    if not inputs or not output or missing:
+        _emit(sys.stderr, f"{missing[0] if missing else 'input'}: No such file or directory")
+        return 1
+    size = sum(os.path.getsize(path) for path in inputs)
+    cpu_seconds = _sample(random.Random(), DEFAULTS['merge'])
+    if '-vn' in argv:
+        size, cpu_seconds = os.path.getsize(inputs[-1]), 0
+    elif '-vf' in argv:
+        height = int(argv[argv.index('-vf') + 1].rsplit(':', 1)[1])
+        size = int(size * (height / FAKE_SOURCE_HEIGHT) ** 2)
+        cpu_seconds *= 1 + height / 720
+    # Merges are CPU work: spin rather than sleep so concurrent merges contend like the real thing
+    deadline = time.monotonic() + cpu_seconds
+    while time.monotonic() < deadline:
+        pass
+    with open(output, 'wb') as f:
+        f.truncate(size)
+    return 0
+
+
+def run(argv, attempt):
+    options = _parse_args(argv)
+    url = options['url']
+    settings = _settings(url)
+    rng = random.Random(f"{FAKE_SEED}:{url}:{attempt}")
+    parsed = urlparse(url)
+    video_id = os.path.basename(parsed.path.rstrip('/')) or parsed.netloc or 'video'
+    video_id = os.path.splitext(video_id)[0]
+
+    # Size and duration are properties of the video, so they don't vary between attempts
+    video_rng = random.Random(f"{FAKE_SEED}:{url}")
+    total_bytes = _sample(video_rng, settings['size'], int)
+    bandwidth = _sample(rng, settings['bandwidth'])
+    throttled = False
+    if settings['protocol'] in ('m3u8_native', 'http_dash_segments'):
+        # Fragments fetched at once each get the bandwidth, up to what the origin serves
+        connections = int(settings['connections'])
+        bandwidth *= min(options['concurrent_fragments'], connections)
+        throttled = options['concurrent_fragments'] > 2 * connections
+    failure = None
+    fail_attempts = int(settings['fail_attempts'])
+    if rng.random() < float(settings['failure_rate']) or 'fail' in parse_qs(parsed.query):
+        if fail_attempts == 0 or attempt <= fail_attempts:
+            failure = rng.choice([c.strip() for c in settings['fail'].split(',') if c.strip()])
+    fail_at = 0.0 if failure in EXTRACTION_FAILURES else (
+        float(settings['fail_at']) if settings['fail_at'] is not None else rng.random())
+
+    time.sleep(_sample(rng, settings['extract']))
+    _emit(sys.stderr, f"[generic] {video_id}: Extracting information")
+    if failure is not None and fail_at == 0.0:
+        _emit(sys.stderr, FAILURE_MESSAGES.get(failure, f"ERROR: {failure}").format(id=video_id))
+        return 1
+
+    info = {
+        'id': video_id,
+        'title': parse_qs(parsed.query).get('title', [video_id])[0],
+        'extractor': 'fake',
+        'webpage_url': url,
+        'duration': max(1, total_bytes // 500000),
+        'format_note': f"{FAKE_SOURCE_HEIGHT}p",
+        'height': FAKE_SOURCE_HEIGHT,
+        'ext': 'mp4',
+        'protocol': settings['protocol'],
+        'filesize_approx': total_bytes,
+    }
+    chapter_seconds = info['duration'] / FAKE_CHAPTERS
+    info['chapters'] = [{'title': f"Chapter {n + 1}", 'start_time': n * chapter_seconds,
+                         'end_time': (n + 1) * chapter_seconds} for n in range(FAKE_CHAPTERS)]
+    # Like yt-dlp, the info JSON reports whole formats even when only a section is fetched
+    section_share = 1.0
+    if options['section']:
+        section_share = _section_share(options['section'], info['duration'], info['chapters'])
+        if section_share <= 0:
+            _emit(sys.stderr, f"ERROR: [generic] {video_id}: No sections to download")
+            return 1
+    output = options['output'] or f"{video_id}.mp4"
+    split = ',' in (options['format'] or '') and '%(format_id)s' in output
+    if split:
+        streams = []
+        for format_id, ext, vcodec, share in SPLIT_STREAMS:
+            stream_info = dict(info, format_id=format_id, ext=ext, vcodec=vcodec,
+                               filesize_approx=int(total_bytes * share))
+            if vcodec == 'none':
+                stream_info.update(format_note='medium', height=None)
+            path = _output_path(output, format_id, ext)
+            streams.append((stream_info, path))
+    elif options['extract_audio'] or (options['format'] or '').startswith('ba'):
+        format_id, ext, acodec, abr, share = AUDIO_FORMAT
+        info.update(format_id=format_id, ext=ext, vcodec='none', acodec=acodec, abr=abr, format_note='medium', height=None,
+                    filesize_approx=int(total_bytes * share))
+        streams = [(info, _output_path(output, format_id, ext))]
+    elif settings['media']:
+        # Like the generic extractor on a direct link: one progressive format, the file itself
+        info.update(format_id='media', url=settings['media'], protocol=urlparse(settings['media']).scheme,
+                    http_headers={'User-Agent': 'fake_downloader'})
+        streams = [(info, _output_path(output, 'media', 'mp4'))]
+    elif options['format_sort'].split(',')[0] == 'hasaud':
+        format_id, note, share = PROGRESSIVE_FORMAT
+        total_bytes = int(total_bytes * share)
+        info.update(format_id=format_id, format_note=note, height=int(note[:-1]), filesize_approx=total_bytes)
+        streams = [(info, _output_path(output, format_id, 'mp4'))]
+    else:
+        info['format_id'] = '+'.join(format_id for format_id, _, _, _ in SPLIT_STREAMS)
+        info['requested_formats'] = [{'format_id': format_id, 'ext': ext, 'vcodec': vcodec}
+                                     for format_id, ext, vcodec, _ in SPLIT_STREAMS]
+        streams = [(info, _output_path(output, info['format_id'], 'mp4'))]
+
+    downloaded_before = 0
+    fail_bytes = int(total_bytes * section_share * fail_at) if failure is not None else None
+    for stream_info, path in streams:
+        if options['print_json']:
+            _emit(sys.stdout, json.dumps(stream_info))
+        if options['skip_download']:
+            continue
+        size = max(1, int(stream_info['filesize_approx'] * section_share))
+        if split and os.path.exists(path):
+            # Finished by an earlier attempt; yt-dlp doesn't fetch it again either
+            _emit(sys.stderr, f"[download] {path} has already been downloaded")
+            downloaded_before += size
+            continue
+        if not _download(path, size, bandwidth, downloaded_before, fail_bytes, throttled):
+            _emit(sys.stderr, FAILURE_MESSAGES.get(failure, f"ERROR: {failure}").format(id=video_id))
+            return 1
+        downloaded_before += size
+    if options['skip_download'] or split:
+        return 0
+    if options['extract_audio']:
+        path = streams[0][1]
+        audio_path = os.path.splitext(path)[0] + '.' + info['acodec']
+        _emit(sys.stderr, f"[ExtractAudio] Destination: {audio_path}")
+        os.replace(path, audio_path)
+        return 0
+
+    merge_seconds = _sample(rng, settings['merge'])
+    if merge_seconds > 0 and 'requested_formats' in info:
+        _emit(sys.stderr, f'[Merger] Merging formats into "{output}"')
+        time.sleep(merge_seconds)
+    return 0
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--ffmpeg']:
+        sys.exit(run_ffmpeg(sys.argv[2:]))
+    sys.exit(run(sys.argv[1:], int(os.environ.get('FAKE_DOWNLOADER_ATTEMPT', 1))))
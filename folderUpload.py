@@ -1,8 +1,10 @@
 # folderUpload.py
 
 import os
+import time
 from google.cloud import storage
 import logging
+import metrics
 
 # Use Python's logging module
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -36,6 +38,7 @@ def upload_folder_to_gcs(bucket_name, source_folder, destination_prefix):
         logger.error(f"Source folder '{source_folder}' not found or is not a directory.")
         raise FileNotFoundError(f"Source folder '{source_folder}' not found or is not a directory.")
 
+    started_at = time.monotonic()
     # Initialize client within the function call (or pass it if reused frequently)
     try:
         storage_client = storage.Client()
@@ -76,13 +79,17 @@ def upload_folder_to_gcs(bucket_name, source_folder, destination_prefix):
                     logger.info(f"Uploading {local_file_path} to gs://{bucket_name}/{blob_name}...")
                     blob.upload_from_filename(local_file_path)
                     uploaded_files_count += 1
+                    metrics.FOLDER_UPLOAD_FILES.labels('uploaded').inc()
+                    metrics.UPLOADED_BYTES.labels('folder').inc(os.path.getsize(local_file_path))
                     # logger.info(f"Successfully uploaded gs://{bucket_name}/{blob_name}") # Can be verbose
                 except PermissionError as pe:
                     logger.error(f"Permission error uploading file {local_file_path}: {pe}")
                     permission_errors.append(pe)
+                    metrics.FOLDER_UPLOAD_FILES.labels('permission_error').inc()
                 except Exception as e:
                     logger.error(f"Error uploading file {local_file_path}: {e}")
                     upload_errors.append({"file": local_file_path, "error": str(e)})
+                    metrics.FOLDER_UPLOAD_FILES.labels('error').inc()
 
         status = "completed"
         if permission_errors or upload_errors:
@@ -109,6 +116,39 @@ def upload_folder_to_gcs(bucket_name, source_folder, destination_prefix):
     except Exception as e:
         logger.error(f"An unexpected error occurred during the GCS operation: {e}", exc_info=True)
         raise e # Re-raise unexpected errors
+    finally:
+        # Failed and partial uploads count too
+        metrics.FOLDER_UPLOAD_DURATION.observe(time.monotonic() - started_at)
+
+
+def upload_file_to_gcs(bucket_name, local_path, blob_name):
+    """
+    Uploads a single local file to GCS.
+
+    Args:
+        bucket_name (str): The name of the target GCS bucket.
+        local_path (str): Path of the file inside the container.
+        blob_name (str): Object name within the bucket.
+
+    Returns:
+        str: The gs:// URI of the uploaded object.
+
+    Raises:
+        ValueError: If bucket_name is not provided.
+        FileNotFoundError: If local_path does not exist.
+        Exception: For GCS errors during the upload.
+    """
+    if not bucket_name:
+        logger.error("GCS bucket name is required but was not provided.")
+        raise ValueError("GCS bucket name is required.")
+    if not os.path.isfile(local_path):
+        raise FileNotFoundError(f"File '{local_path}' not found.")
+
+    storage_client = storage.Client()
+    blob = storage_client.bucket(bucket_name).blob(blob_name)
+    logger.info(f"Uploading {local_path} to gs://{bucket_name}/{blob_name}...")
+    blob.upload_from_filename(local_path)
+    return f"gs://{bucket_name}/{blob_name}"
 
 
 # Remove the example usage block as it will be called from app.py
@@ -0,0 +1,148 @@
+# formats.py
+
+import os
+
+# --- Format presets ---
+# Each preset caps resolution and total bitrate and gives yt-dlp a format
+# sort (-S). 'bv*+ba/b' takes the best format that has video and only adds
+# an audio stream when that format has none, so a progressive file that wins
+# the sort is downloaded as is, with no merge. Sorting on mp4-friendly codecs
+# keeps a merge that does happen a stream copy rather than a re-encode.
+#   fast      progressive first even at a lower resolution, up to 720p; kept
+#             as one download under STAGED_PIPELINE too (see format_args())
+#   balanced  up to 1080p, progressive when it matches the best resolution
+#   max       the original behaviour: best video + best audio, merged
+#   audio     the best audio-only format and no video at all; yt-dlp's
+#             ExtractAudio (--audio-format best) copies the stream into the
+#             container of its codec (.m4a, .opus, ...) and only transcodes
+#             codecs it has no container for
+FORMAT_PRESETS = {
+    'fast': {
+        'single_file': True,
+        'audio_only': False,
+        'max_height': 720,
+        'max_tbr': 2500,
+        'sort': 'hasaud,res:720,ext:mp4:m4a,vcodec:h264,acodec:aac,tbr:2500',
+    },
+    'balanced': {
+        'single_file': False,
+        'audio_only': False,
+        'max_height': 1080,
+        'max_tbr': 6000,
+        'sort': 'res:1080,hasaud,ext:mp4:m4a,vcodec:h264,acodec:aac,tbr:6000',
+    },
+    'max': {
+        'single_file': False,
+        'audio_only': False,
+        'max_height': None,
+        'max_tbr': None,
+        'sort': None,
+    },
+    'audio': {
+        'single_file': True,
+        'audio_only': True,
+        'max_height': None,
+        'max_tbr': None,
+        'sort': None,
+    },
+}
+DEFAULT_FORMAT_PRESET = os.environ.get('DEFAULT_FORMAT_PRESET', 'max')
+
+
+def _caps(preset):
+    # '<=?' lets formats with an unknown height or bitrate through
+    caps = ''
+    if preset['max_height']:
+        caps += f"[height<=?{preset['max_height']}]"
+    if preset['max_tbr']:
+        caps += f"[tbr<=?{preset['max_tbr']}]"
+    return caps
+
+
+def format_args(preset_name, separate_streams=False):
+    """
+    yt-dlp arguments selecting the formats of a preset.
+
+    Args:
+        preset_name (str): A key of FORMAT_PRESETS.
+        separate_streams (bool): Download video and audio to separate files
+            with no merge (STAGED_PIPELINE=1); 'bv/b' and 'ba/b' may pick the
+            same progressive format, which is then only fetched once. Ignored
+            by single-file presets: a format list can't say "progressive, or
+            else both streams", so they select like an unstaged job and yt-dlp
+            merges itself in the rare case there is no progressive format.
+
+    Returns:
+        list: '-f' and, for capped presets, '-S' arguments; audio-only
+        presets add the audio extraction.
+    """
+    preset = FORMAT_PRESETS[preset_name]
+    if preset['audio_only']:
+        # 'b' only when a site has no audio-only format; extraction then drops the video
+        return ['-f', 'ba/b', '-x', '--audio-format', 'best']
+    caps = _caps(preset)
+    if separate_streams and not preset['single_file']:
+        selector = f"bv{caps}/b{caps}/bv/b,ba/b" if caps else 'bv/b,ba/b'
+    elif preset['sort'] is None:
+        selector = 'bestvideo+bestaudio/best'
+    else:
+        # Fall back to the uncapped best rather than failing when nothing fits the caps
+        selector = f"bv*{caps}+ba/b{caps}/bv*+ba/b"
+    args = ['-f', selector]
+    if preset['sort']:
+        args += ['-S', preset['sort']]
+    return args
+
+
+# --- Renditions ---
+# Outputs a multi-rendition job can ask for: the height of a video rendition,
+# None for the audio alone
+RENDITIONS = {
+    '2160p': 2160,
+    '1440p': 1440,
+    '1080p': 1080,
+    '720p': 720,
+    '480p': 480,
+    '360p': 360,
+    '240p': 240,
+    'audio': None,
+}
+
+
+def rendition_source_args(names):
+    """
+    yt-dlp arguments fetching the source streams of a multi-rendition job
+    once, as separate files: the best video up to the tallest rendition
+    asked for and the best audio, or only the audio if that's all it needs.
+    """
+    heights = [RENDITIONS[name] for name in names if RENDITIONS[name]]
+    if not heights:
+        return ['-f', 'ba/b']
+    top = max(heights)
+    return ['-f', f"bv[height<=?{top}]/b[height<=?{top}]/bv/b,ba/b"]
+
+
+def render_path(name, source_height):
+    """
+    How a rendition is made from the source: 'audio' (audio stream copy),
+    'remux' (stream copy, when the source is no taller than the rendition)
+    or 'transcode' (downscale).
+    """
+    height = RENDITIONS[name]
+    if height is None:
+        return 'audio'
+    if not source_height or height >= source_height:
+        return 'remux'
+    return 'transcode'
+
+
+def download_path(format_ids):
+    """
+    How the job's output was produced, from the format ids yt-dlp picked:
+    'single_file' when one format was downloaded as is, 'remux' when
+    separate streams were merged by stream copy.
+    """
+    ids = set()
+    for format_id in format_ids:
+        ids.update(str(format_id).split('+'))
+    return 'remux' if len(ids) > 1 else 'single_file'
@@ -0,0 +1,161 @@
+# fragments.py
+
+import os
+import threading
+
+# --- Concurrent fragment downloads (HLS/DASH) ---
+# 'auto' lets FragmentTuner pick yt-dlp's -N per attempt from what earlier
+# attempts at the same origin achieved; a number pins every job to it
+# (1 is yt-dlp's own default: one fragment at a time)
+FRAGMENT_CONCURRENCY = os.environ.get('FRAGMENT_CONCURRENCY', 'auto')
+# Where an origin starts, and the most one job is given
+FRAGMENT_CONCURRENCY_START = int(os.environ.get('FRAGMENT_CONCURRENCY_START', 2))
+FRAGMENT_CONCURRENCY_MAX = int(os.environ.get('FRAGMENT_CONCURRENCY_MAX', 16))
+# Fragment fetches all running jobs on the instance may have in flight together
+FRAGMENT_CONCURRENCY_TOTAL = int(os.environ.get('FRAGMENT_CONCURRENCY_TOTAL', 64))
+# Throughput has to improve by this share for a doubling to be kept
+FRAGMENT_MIN_GAIN = float(os.environ.get('FRAGMENT_MIN_GAIN', 0.1))
+# Successful attempts at a settled level before trying the next one up again
+FRAGMENT_REPROBE_ATTEMPTS = int(os.environ.get('FRAGMENT_REPROBE_ATTEMPTS', 20))
+# Weight of the newest sample in the per-level throughput average
+THROUGHPUT_ALPHA = 0.3
+# Protocols yt-dlp downloads fragment by fragment, so -N applies; merged
+# formats report theirs joined with '+'
+FRAGMENTED_PROTOCOLS = ('m3u8_native', 'm3u8', 'http_dash_segments', 'http_dash_segments_generator', 'ism', 'f4m')
+
+
+def is_fragmented(protocol):
+    return any(part in FRAGMENTED_PROTOCOLS for part in str(protocol or '').split('+'))
+
+
+def _top_level():
+    # A level above the instance total could only ever be squeezed, and squeezed attempts don't steer
+    return max(1, min(FRAGMENT_CONCURRENCY_MAX, FRAGMENT_CONCURRENCY_TOTAL))
+
+
+class FragmentTuner:
+    """
+    Picks the number of fragments each attempt fetches at once (yt-dlp -N),
+    per origin, by hill climbing on the throughput attempts achieve.
+
+    An origin starts at FRAGMENT_CONCURRENCY_START and doubles after each
+    attempt that ran at the current level and beat the level below it by
+    FRAGMENT_MIN_GAIN; when it doesn't, the origin drops back to the level
+    below and stays there for FRAGMENT_REPROBE_ATTEMPTS attempts. Fragment
+    retries on 429s halve the level, other fragment errors take one off.
+
+    yt-dlp fixes -N when it starts, so levels change between attempts, not
+    within one. An attempt is given its origin's level, less whatever other
+    running attempts already hold of FRAGMENT_CONCURRENCY_TOTAL, but never
+    less than one.
+
+    Only fragmented downloads hold a share of the total. Which format an
+    attempt gets is only known once yt-dlp prints its info JSON, so an
+    attempt holds its share from the start unless its origin's last format
+    was progressive, and gives it back as soon as observe() says its own
+    format isn't fragmented.
+    """
+
+    def __init__(self):
+        # origin -> {'level', 'ceiling', 'settled', 'throughput': {level: bytes/s}, 'fragmented'}
+        self._origins = {}
+        self._held = {}  # job_id -> concurrency
+        self._lock = threading.Lock()
+
+    def _origin(self, origin):
+        if origin not in self._origins:
+            self._origins[origin] = {'level': max(1, min(FRAGMENT_CONCURRENCY_START, _top_level())),
+                                     'ceiling': None, 'settled': 0, 'throughput': {}, 'fragmented': None}
+        return self._origins[origin]
+
+    def acquire(self, job_id, origin):
+        """
+        Returns:
+            int: The -N to start `job_id`'s downloader with.
+        """
+        with self._lock:
+            state = self._origin(origin)
+            if FRAGMENT_CONCURRENCY != 'auto':
+                concurrency = max(1, int(FRAGMENT_CONCURRENCY))
+            elif state['fragmented'] is False:
+                # Most likely progressive again: no share, and a lone fragmented format gets one thread
+                concurrency = 1
+            else:
+                others = sum(held for held_by, held in self._held.items() if held_by != job_id)
+                concurrency = max(1, min(state['level'], FRAGMENT_CONCURRENCY_TOTAL - others))
+            if state['fragmented'] is not False:
+                self._held[job_id] = concurrency
+            return concurrency
+
+    def observe(self, job_id, origin, fragmented, concurrency):
+        """
+        Records whether the formats `job_id`'s attempt has reported so far
+        (started with -N `concurrency`) include a fragmented one, holding or
+        giving back its share of the total to match.
+        """
+        with self._lock:
+            self._origin(origin)['fragmented'] = fragmented
+            if fragmented:
+                self._held[job_id] = concurrency
+            else:
+                self._held.pop(job_id, None)
+
+    def release(self, job_id, origin, outcome=None):
+        """
+        Frees `job_id`'s share and learns from how its attempt went.
+
+        Args:
+            outcome (dict): None when the attempt says nothing about fragment
+                concurrency (not fragmented, cancelled, stopped by the
+                watchdog); otherwise 'throttled' and 'errors' (fragment
+                retries seen, or the failure the attempt ended with) and,
+                for a download that got through, 'bytes_per_second'.
+        """
+        with self._lock:
+            concurrency = self._held.pop(job_id, None)
+            if outcome is None or concurrency is None or FRAGMENT_CONCURRENCY != 'auto':
+                return
+            state = self._origin(origin)
+            if outcome['throttled']:
+                state['ceiling'] = state['level']
+                state['level'] = max(1, min(state['level'], concurrency) // 2)
+                state['settled'] = 0
+            elif outcome['errors']:
+                state['level'] = max(1, min(state['level'], concurrency) - 1)
+                state['settled'] = 0
+            elif outcome.get('bytes_per_second'):
+                self._climb(state, concurrency, outcome['bytes_per_second'])
+
+    def _climb(self, state, concurrency, bytes_per_second):
+        throughput = state['throughput']
+        previous = throughput.get(concurrency)
+        throughput[concurrency] = bytes_per_second if previous is None else (
+            THROUGHPUT_ALPHA * bytes_per_second + (1 - THROUGHPUT_ALPHA) * previous)
+        # Attempts squeezed by the global cap, or started before the last change, don't steer
+        if concurrency != state['level']:
+            return
+        below = [level for level in throughput if level < concurrency]
+        if below and throughput[concurrency] < throughput[max(below)] * (1 + FRAGMENT_MIN_GAIN):
+            state['ceiling'] = concurrency
+            state['level'] = max(below)
+            state['settled'] = 0
+            return
+        if state['ceiling'] is not None and concurrency * 2 >= state['ceiling']:
+            state['settled'] += 1
+            if state['settled'] < FRAGMENT_REPROBE_ATTEMPTS:
+                return
+            state['ceiling'] = None
+            state['settled'] = 0
+        state['level'] = min(_top_level(), concurrency * 2)
+
+    def levels(self):
+        """Current level per origin, for the metrics."""
+        with self._lock:
+            return {origin: state['level'] for origin, state in self._origins.items()}
+
+    def in_flight(self):
+        with self._lock:
+            return sum(self._held.values())
+
+
+fragment_tuner = FragmentTuner()
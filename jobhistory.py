@@ -0,0 +1,61 @@
+# jobhistory.py
+
+import os
+import threading
+from collections import deque
+
+# Completed jobs remembered per (extractor, job class)
+JOB_HISTORY_SIZE = int(os.environ.get('JOB_HISTORY_SIZE', 50))
+# Expected duration of a job nothing similar has been seen for yet
+DEFAULT_EXPECTED_SECONDS = float(os.environ.get('DEFAULT_EXPECTED_SECONDS', 120))
+
+_history = {}  # (extractor, job_class) -> deque of (seconds, bytes)
+_lock = threading.Lock()
+
+
+def record(extractor, job_class, seconds, size_bytes):
+    """Adds a completed job's worker time and downloaded bytes to the history."""
+    if seconds <= 0:
+        return
+    with _lock:
+        samples = _history.get((extractor, job_class))
+        if samples is None:
+            samples = _history[(extractor, job_class)] = deque(maxlen=JOB_HISTORY_SIZE)
+        samples.append((seconds, size_bytes or 0))
+
+
+def _samples(extractor, job_class):
+    """The closest history available: same extractor and class, else the class, else everything."""
+    samples = _history.get((extractor, job_class))
+    if samples:
+        return list(samples)
+    for candidates in ([s for (_, c), s in _history.items() if c == job_class], list(_history.values())):
+        pooled = [sample for samples in candidates for sample in samples]
+        if pooled:
+            return pooled
+    return []
+
+
+def expected_seconds(extractor, job_class, size_bytes=None):
+    """
+    Expected worker time of a job.
+
+    Args:
+        extractor (str): The job's extractor key.
+        job_class (str): The job's class (see watchdog.JOB_TIMEOUTS).
+        size_bytes (int, optional): Bytes left to download, when extraction
+            has already reported a size (e.g. on a retry).
+
+    Returns:
+        float: Seconds; the mean of similar past jobs, or the known size over
+        their throughput.
+    """
+    with _lock:
+        samples = _samples(extractor, job_class)
+    if not samples:
+        return DEFAULT_EXPECTED_SECONDS
+    total_seconds = sum(seconds for seconds, _ in samples)
+    total_bytes = sum(size for _, size in samples)
+    if size_bytes and total_bytes:
+        return size_bytes * total_seconds / total_bytes
+    return total_seconds / len(samples)
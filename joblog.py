@@ -0,0 +1,112 @@
+# joblog.py
+
+import os
+import gzip
+import queue
+import threading
+from collections import deque
+
+# The tail of yt-dlp's stderr kept in memory per attempt; enough for the
+# ERROR: lines and the context just before them
+STDERR_RING_LINES = int(os.environ.get('STDERR_RING_LINES', 200))
+STDERR_RING_BYTES = int(os.environ.get('STDERR_RING_BYTES', 64 * 1024))
+# Full verbose output is kept only for jobs that ask for it ("log": true in
+# the /download payload), or for every job with KEEP_JOB_LOGS=1
+KEEP_JOB_LOGS = os.environ.get('KEEP_JOB_LOGS', '0') == '1'
+JOB_LOG_DIR = os.environ.get('JOB_LOG_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logs'))
+
+
+class StderrRing:
+    """
+    Keeps the last `max_lines` lines of a stream, and no more than `max_bytes`
+    of them, so a --verbose HLS download with thousands of fragment lines
+    costs a bounded amount of memory and no repeated string copying.
+
+    ERROR: lines pushed out by later output (a --verbose traceback easily
+    runs to dozens of lines) are pinned, up to `max_errors` of them, so
+    error classification still sees them.
+    """
+
+    def __init__(self, max_lines=STDERR_RING_LINES, max_bytes=STDERR_RING_BYTES, max_errors=10):
+        self.max_lines = max_lines
+        self.max_bytes = max_bytes
+        self._lines = deque()
+        self._pinned_errors = deque(maxlen=max_errors)
+        self._bytes = 0
+        self.total_lines = 0
+        self.dropped_lines = 0
+
+    def append(self, line):
+        self._lines.append(line)
+        self._bytes += len(line)
+        self.total_lines += 1
+        while self._lines and (len(self._lines) > self.max_lines or self._bytes > self.max_bytes):
+            evicted = self._lines.popleft()
+            self._bytes -= len(evicted)
+            self.dropped_lines += 1
+            if evicted.startswith('ERROR:'):
+                self._pinned_errors.append(evicted)
+
+    def text(self):
+        return '\n'.join(list(self._pinned_errors) + list(self._lines))
+
+    def __len__(self):
+        return len(self._lines)
+
+
+def job_log_path(job_id):
+    return os.path.join(JOB_LOG_DIR, f"{job_id}.log.gz")
+
+
+class _LogWriter:
+    """
+    One background thread doing the compression and disk writes of every
+    open job log, so the threads that produce log lines (the pipe
+    multiplexer, the event loop) only append to a queue.
+    """
+
+    def __init__(self):
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def put(self, log_file, text):
+        """Queues `text` for `log_file`; None closes it."""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name='job-log-writer', daemon=True)
+                self._thread.start()
+        self._queue.put((log_file, text))
+
+    def _loop(self):
+        while True:
+            log_file, text = self._queue.get()
+            try:
+                if text is None:
+                    log_file.close()
+                else:
+                    log_file.write(text)
+            except (OSError, ValueError) as e:
+                print(f"Error writing job log: {e}")
+
+
+_log_writer = _LogWriter()
+
+
+class JobLog:
+    """A job's gzip log; write() and close() only queue work for the log writer thread."""
+
+    def __init__(self, path):
+        self._file = gzip.open(path, 'at', encoding='utf-8')
+
+    def write(self, text):
+        _log_writer.put(self._file, text)
+
+    def close(self):
+        _log_writer.put(self._file, None)
+
+
+def open_job_log(job_id):
+    """Opens the job's gzip log for appending; every attempt adds a gzip member."""
+    os.makedirs(JOB_LOG_DIR, exist_ok=True)
+    return JobLog(job_log_path(job_id))
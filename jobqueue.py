@@ -0,0 +1,249 @@
+# jobqueue.py
+
+import os
+import heapq
+import itertools
+import time
+import logging
+import metrics
+from ratelimit import OriginLimiter
+
+logger = logging.getLogger(__name__)
+
+# --- Queue policy configuration ---
+# Priority lanes, highest first: interactive jobs always start before bulk ones
+LANES = ('interactive', 'bulk')
+DEFAULT_LANE = 'interactive'
+# Workers bulk jobs may never occupy, so an interactive download always has a
+# free slot within one job's time even while a large batch is running
+INTERACTIVE_RESERVED_WORKERS = int(os.environ.get('INTERACTIVE_RESERVED_WORKERS', 1))
+# Order within a lane: 'fair' is weighted fair queuing between clients,
+# 'sjf' starts the job expected to finish soonest (see jobhistory.py) first
+QUEUE_ORDER = os.environ.get('QUEUE_ORDER', 'fair')
+# Under 'sjf', each second a job waits counts as this many seconds off its
+# expected duration, so long jobs still start under a steady stream of short ones
+SJF_AGING_RATE = float(os.environ.get('SJF_AGING_RATE', 1.0))
+
+
+def _parse_client_weights(value):
+    """Parses 'acme=4,free-tier=0.5' into {'acme': 4.0, 'free-tier': 0.5}."""
+    weights = {}
+    for item in value.split(','):
+        if '=' not in item:
+            continue
+        client, weight = item.rsplit('=', 1)
+        try:
+            weight = float(weight)
+        except ValueError:
+            weight = 0
+        if weight <= 0:
+            logger.warning(f"Ignoring invalid CLIENT_WEIGHTS entry: {item!r}")
+            continue
+        weights[client.strip()] = weight
+    return weights
+
+
+# Relative share of the workers per client id when several clients have jobs
+# queued in the same lane; clients not listed weigh 1
+CLIENT_WEIGHTS = _parse_client_weights(os.environ.get('CLIENT_WEIGHTS', ''))
+
+
+def client_weight(client):
+    return CLIENT_WEIGHTS.get(client, 1.0)
+
+
+def _default_describe(job_id):
+    return {}
+
+
+class _Lane:
+    """
+    Jobs start in tag order. With QUEUE_ORDER=fair this is a weighted fair
+    queue over clients: each job is tagged max(lane clock, the client's
+    previous tag) + 1 / weight, so a client submitting 500 jobs at once is
+    interleaved with everyone else instead of occupying the head of the queue.
+
+    With QUEUE_ORDER=sjf the tag is the job's expected duration minus the
+    aging credit it will have earned, expected + SJF_AGING_RATE * enqueue
+    time: ordering by that now is the same as ordering by expected duration
+    minus time waited at any later moment, so tags never need updating.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._entries = {}  # job_id -> heap entry; removal just clears the entry's job id
+        self._sequence = itertools.count()
+        self._clock = 0.0
+        self._last_tag = {}
+
+    @property
+    def size(self):
+        return len(self._entries)
+
+    def push(self, job_id, client, weight, expected_seconds=None):
+        if QUEUE_ORDER == 'sjf' and expected_seconds is not None:
+            tag = expected_seconds + SJF_AGING_RATE * time.monotonic()
+        else:
+            tag = max(self._clock, self._last_tag.get(client, 0.0)) + 1.0 / weight
+            self._last_tag[client] = tag
+        entry = [tag, next(self._sequence), job_id]
+        self._entries[job_id] = entry
+        heapq.heappush(self._heap, entry)
+
+    def pop(self, eligible):
+        """Takes the first job in tag order for which eligible(job_id) is true, or None."""
+        skipped = []
+        job_id = None
+        while self._heap:
+            entry = heapq.heappop(self._heap)
+            if entry[2] is None:
+                continue
+            if not eligible(entry[2]):
+                skipped.append(entry)
+                continue
+            job_id = entry[2]
+            del self._entries[job_id]
+            self._clock = entry[0]
+            break
+        for entry in skipped:
+            heapq.heappush(self._heap, entry)
+        if not self._entries:
+            # Idle lane: forget past clients instead of keeping a tag per caller forever
+            self._last_tag.clear()
+        return job_id
+
+    def remove(self, job_id):
+        self._entries.pop(job_id)[2] = None
+
+    def drain(self):
+        waiting = [job_id for _, _, job_id in sorted(self._heap) if job_id is not None]
+        self._heap.clear()
+        self._entries.clear()
+        self._last_tag.clear()
+        return waiting
+
+
+class JobQueue:
+    """
+    Pending jobs of a runner (scheduler.JobScheduler or aiorunner.AsyncJobRunner),
+    split into priority lanes with weighted fair queuing between clients in
+    each lane. Jobs whose origin is at its concurrency cap or out of start
+    tokens (ratelimit.OriginLimiter) are passed over, so other origins' jobs
+    go ahead of them.
+
+    `describe(job_id)` is asked for the job's {'lane', 'client', 'origin',
+    'origin_label'}, plus 'expected_seconds' under QUEUE_ORDER=sjf, when it
+    is pushed, so retries and deferred jobs go back to the lane and client
+    they came from without the runner tracking either.
+
+    Not thread-safe: the owning runner serialises access (JobScheduler under its
+    condition, AsyncJobRunner on its loop thread).
+    """
+
+    def __init__(self, worker_count, describe=None):
+        self.worker_count = worker_count
+        self.describe = describe or _default_describe
+        self.limiter = OriginLimiter()
+        self._lanes = {lane: _Lane() for lane in LANES}
+        self._queued = {}   # job_id -> {'lane', 'origin', 'label', 'held_since'}
+        self._running = {}  # job_id -> the same dict
+        # Seconds until a rate-limited origin can start a job again, as of the
+        # last pop() that came back empty; None when only a finishing job can help
+        self.retry_in = None
+
+    def push(self, job_id):
+        info = self.describe(job_id) or {}
+        lane = info.get('lane') if info.get('lane') in LANES else DEFAULT_LANE
+        client = info.get('client') or 'unknown'
+        if job_id in self._queued:
+            self.remove(job_id)
+        self._lanes[lane].push(job_id, client, client_weight(client), info.get('expected_seconds'))
+        self._queued[job_id] = {'lane': lane, 'origin': info.get('origin') or 'unknown',
+                                'label': info.get('origin_label') or 'unknown', 'held_since': None}
+
+    def pop(self):
+        """
+        Takes the next job allowed to start now, or None if none is.
+
+        The job counts as running in its lane and origin until task_done() is called.
+        """
+        now = time.monotonic()
+        holds = {}  # origin -> limiter holding it back, evaluated once per pop
+
+        def eligible(job_id):
+            job = self._queued[job_id]
+            if job['origin'] not in holds:
+                holds[job['origin']] = self.limiter.blocked(job['origin'], now)
+            if holds[job['origin']] is None:
+                return True
+            if job['held_since'] is None:
+                job['held_since'] = now
+            return False
+
+        for lane in LANES:
+            if not self._lanes[lane].size or not self._lane_has_capacity(lane):
+                continue
+            job_id = self._lanes[lane].pop(eligible)
+            if job_id is None:
+                continue
+            job = self._running[job_id] = self._queued.pop(job_id)
+            self.limiter.acquire(job['origin'], now)
+            held = now - job['held_since'] if job['held_since'] is not None else 0.0
+            metrics.LIMITER_WAIT.labels(job['label']).observe(held)
+            self.retry_in = None
+            return job_id
+
+        waits = [self.limiter.retry_in(origin, now) for origin, limit in holds.items() if limit == 'rate']
+        self.retry_in = min(waits) if waits else None
+        return None
+
+    def task_done(self, job_id):
+        job = self._running.pop(job_id, None)
+        if job is not None:
+            self.limiter.release(job['origin'])
+
+    def remove(self, job_id):
+        """
+        Returns:
+            bool: True if `job_id` was queued and has been removed.
+        """
+        job = self._queued.pop(job_id, None)
+        if job is None:
+            return False
+        self._lanes[job['lane']].remove(job_id)
+        return True
+
+    def drain(self):
+        """Empties the queue and returns the job ids it held, highest priority first."""
+        waiting = []
+        for lane in LANES:
+            waiting.extend(self._lanes[lane].drain())
+        self._queued.clear()
+        return waiting
+
+    def depth_by_lane(self):
+        return {lane: self._lanes[lane].size for lane in LANES}
+
+    def running_by_lane(self):
+        counts = dict.fromkeys(LANES, 0)
+        for job in self._running.values():
+            counts[job['lane']] += 1
+        return counts
+
+    def lane_counts(self):
+        """Returns {(lane, 'queued' or 'running'): count} for every lane."""
+        counts = {}
+        for state, by_lane in (('queued', self.depth_by_lane()), ('running', self.running_by_lane())):
+            for lane, count in by_lane.items():
+                counts[(lane, state)] = count
+        return counts
+
+    def __len__(self):
+        return len(self._queued)
+
+    def _lane_has_capacity(self, lane):
+        if lane == 'interactive':
+            return True
+        # Reserving every worker would disable the bulk lane altogether
+        bulk_limit = max(1, self.worker_count - INTERACTIVE_RESERVED_WORKERS)
+        return self.running_by_lane()['bulk'] < bulk_limit
@@ -0,0 +1,227 @@
+# metrics.py
+
+import bisect
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Seconds; spans quick extractions through multi-hour downloads
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+
+# --- Per-thread cells ---
+#
+# Hot paths (progress lines, byte counters) must not contend on a lock. Each
+# metric value keeps one small list per writing thread, and only that thread
+# ever mutates it, so updates are plain in-place additions. A scrape sums
+# the cells; it may miss an update that is in flight, never corrupt one.
+
+class _CounterValue:
+    __slots__ = ('_cells',)
+
+    def __init__(self):
+        self._cells = {}
+
+    def inc(self, amount=1):
+        cell = self._cells.get(threading.get_ident())
+        if cell is None:
+            cell = self._cells[threading.get_ident()] = [0]
+        cell[0] += amount
+
+    def get(self):
+        return sum(cell[0] for cell in list(self._cells.values()))
+
+
+class _HistogramValue:
+    __slots__ = ('_bounds', '_cells')
+
+    def __init__(self, bounds):
+        self._bounds = bounds
+        self._cells = {}
+
+    def observe(self, value):
+        cell = self._cells.get(threading.get_ident())
+        if cell is None:
+            # One slot per bucket plus +Inf, then sum and count
+            cell = self._cells[threading.get_ident()] = [0] * (len(self._bounds) + 3)
+        cell[bisect.bisect_left(self._bounds, value)] += 1
+        cell[-2] += value
+        cell[-1] += 1
+
+    def get(self):
+        totals = [0] * (len(self._bounds) + 3)
+        for cell in list(self._cells.values()):
+            for i, v in enumerate(cell):
+                totals[i] += v
+        return totals
+
+
+# --- Metric families ---
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        REGISTRY.register(self)
+
+    def labels(self, *values):
+        values = tuple(str(v) for v in values)
+        child = self._children.get(values)
+        if child is None:
+            child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def samples(self):
+        """Yields (suffix, label pairs, value) tuples for the exposition."""
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        if not self.labelnames:
+            self.labels()  # Expose 0 before the first increment
+
+    def _new_child(self):
+        return _CounterValue()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def samples(self):
+        for values, child in list(self._children.items()):
+            yield '', list(zip(self.labelnames, values)), child.get()
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+        if not self.labelnames:
+            self.labels()
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def samples(self):
+        for values, child in list(self._children.items()):
+            labels = list(zip(self.labelnames, values))
+            totals = child.get()
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), totals):
+                cumulative += count
+                yield '_bucket', labels + [('le', _format_value(bound))], cumulative
+            yield '_sum', labels, totals[-2]
+            yield '_count', labels, totals[-1]
+
+
+class CallbackMetric(_Metric):
+    """
+    Gauge (or counter) whose value is computed at scrape time. `callback`
+    returns a number, or a dict mapping label value tuples to numbers.
+    """
+
+    def __init__(self, name, documentation, callback, labelnames=(), kind='gauge'):
+        self.kind = kind
+        self._callback = callback
+        super().__init__(name, documentation, labelnames)
+
+    def samples(self):
+        result = self._callback()
+        if not isinstance(result, dict):
+            result = {(): result}
+        for values, value in result.items():
+            if not isinstance(values, tuple):
+                values = (values,)
+            yield '', list(zip(self.labelnames, values)), value
+
+
+# --- Registry and exposition ---
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+
+    def render(self):
+        """Returns every metric in the Prometheus text exposition format (0.0.4)."""
+        lines = []
+        with self._lock:
+            registered = list(self._metrics)
+        for metric in registered:
+            try:
+                samples = list(metric.samples())
+            except Exception as e:
+                logger.error(f"Error collecting metric {metric.name}: {e}")
+                continue
+            # Counter families carry the _total suffix in the exposition
+            name = metric.name + '_total' if metric.kind == 'counter' else metric.name
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            for suffix, labels, value in samples:
+                label_text = ','.join(f'{k}="{_escape(v)}"' for k, v in labels)
+                label_text = f"{{{label_text}}}" if label_text else ''
+                lines.append(f"{name}{suffix}{label_text} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value)) if abs(value) < 1e15 else repr(value)
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+REGISTRY = Registry()
+
+
+def render():
+    return REGISTRY.render()
+
+
+# --- Service metrics ---
+
+JOBS_FINISHED = Counter(
+    'flaskdownloader_jobs', 'Download jobs that reached a terminal state.', ['status'])
+ATTEMPT_FAILURES = Counter(
+    'flaskdownloader_attempt_failures', 'Failed yt-dlp attempts by error category.', ['category'])
+STAGE_DURATION = Histogram(
+    'flaskdownloader_stage_duration_seconds', 'Time spent in each job stage.', ['stage'])
+DOWNLOADED_BYTES = Counter(
+    'flaskdownloader_downloaded_bytes', 'Bytes downloaded by yt-dlp.')
+UPLOADED_BYTES = Counter(
+    'flaskdownloader_uploaded_bytes', 'Bytes uploaded to GCS.', ['source'])
+CPU_SECONDS = Counter(
+    'flaskdownloader_cpu_seconds', 'CPU time of downloader and ffmpeg processes, by pipeline stage.', ['stage'])
+LIMITER_WAIT = Histogram(
+    'flaskdownloader_limiter_wait_seconds', 'Time queued jobs were held back by a per-origin limit.', ['origin'])
+ADMISSION_REJECTIONS = Counter(
+    'flaskdownloader_admission_rejections', 'Download requests turned away by admission control.', ['reason'])
+FOLDER_UPLOAD_FILES = Counter(
+    'flaskdownloader_folder_upload_files', 'Files processed by upload_folder_to_gcs.', ['result'])
+FOLDER_UPLOAD_DURATION = Histogram(
+    'flaskdownloader_folder_upload_duration_seconds', 'Duration of upload_folder_to_gcs calls.')
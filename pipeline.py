@@ -0,0 +1,71 @@
+# pipeline.py
+
+import os
+import threading
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# --- Staged pipeline configuration ---
+# With STAGED_PIPELINE=1 a job's worker slot only covers the network-bound
+# download: yt-dlp saves the video and audio streams separately and exits,
+# then the ffmpeg merge and the GCS upload queue for pools of their own
+STAGED_PIPELINE = os.environ.get('STAGED_PIPELINE', '0') == '1'
+# Merges are CPU-bound: by default one per core
+MERGE_WORKERS = int(os.environ.get('MERGE_WORKERS', os.cpu_count() or 1))
+UPLOAD_WORKERS = int(os.environ.get('UPLOAD_WORKERS', 4))
+# Multi-rendition jobs make each rendition on this pool, whatever STAGED_PIPELINE says
+RENDER_WORKERS = int(os.environ.get('RENDER_WORKERS', os.cpu_count() or 1))
+
+
+class Stage:
+    """
+    One step of the staged pipeline: a FIFO queue of job ids worked off by
+    `worker_count` threads calling `handler(job_id)`. Threads start with the
+    first submission. Items needn't be bare job ids: the render stage
+    queues (job id, rendition) pairs.
+
+    The handler owns the job from there, including handing it to the next
+    stage; a job cancelled while queued is still passed to it, and the
+    handler is expected to notice and return.
+    """
+
+    def __init__(self, name, worker_count, handler):
+        self.name = name
+        self.worker_count = worker_count
+        self.handler = handler
+        self.running = 0
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._workers = []
+
+    def submit(self, job_id):
+        with self._cond:
+            if not self._workers:
+                for i in range(self.worker_count):
+                    worker = threading.Thread(target=self._worker_loop, name=f"{self.name}-worker-{i}", daemon=True)
+                    worker.start()
+                    self._workers.append(worker)
+                logger.info(f"Pipeline stage '{self.name}' started with {self.worker_count} workers")
+            self._queue.append(job_id)
+            self._cond.notify()
+
+    def queue_depth(self):
+        with self._cond:
+            return len(self._queue)
+
+    def _worker_loop(self):
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                job_id = self._queue.popleft()
+                self.running += 1
+            try:
+                self.handler(job_id)
+            except Exception as e:
+                logger.error(f"Unhandled error in pipeline stage '{self.name}' for job {job_id}: {e}", exc_info=True)
+            finally:
+                with self._cond:
+                    self.running -= 1
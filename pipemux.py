@@ -0,0 +1,133 @@
+# pipemux.py
+
+import os
+import selectors
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+READ_CHUNK_BYTES = 64 * 1024
+
+
+class _Stream:
+    __slots__ = ('file', 'on_line', 'parts', 'watch')
+
+    def __init__(self, file, on_line, watch):
+        self.file = file
+        self.on_line = on_line
+        # Chunks of the unterminated line so far; joined once, when its newline arrives
+        self.parts = []
+        self.watch = watch
+
+
+class _Watch:
+    """Tracks the pipes of one process; `closed` is set once all of them hit EOF."""
+
+    def __init__(self, open_streams):
+        self.open_streams = open_streams
+        self.closed = threading.Event()
+
+
+class PipeMultiplexer:
+    """
+    Reads the stdout/stderr pipes of every running downloader on a single
+    thread and hands complete lines to per-stream callbacks.
+
+    Callbacks run on the multiplexer thread, so they must be quick and must
+    not block; an exception in one is logged and the stream keeps going.
+    """
+
+    def __init__(self):
+        self._selector = selectors.DefaultSelector()
+        self._pending = []
+        self._lock = threading.Lock()
+        self._thread = None
+        # Self-pipe: lets register() wake the loop out of select()
+        self._wakeup_read, self._wakeup_write = os.pipe()
+        os.set_blocking(self._wakeup_read, False)
+        self._selector.register(self._wakeup_read, selectors.EVENT_READ, None)
+
+    def register(self, streams):
+        """
+        Starts reading `streams`, a list of (binary pipe file, on_line) pairs.
+        `on_line` receives each decoded line without its line ending.
+
+        Returns:
+            threading.Event: Set once every stream has reached EOF and its
+            last line has been dispatched.
+        """
+        watch = _Watch(len(streams))
+        if not streams:
+            watch.closed.set()
+            return watch.closed
+        with self._lock:
+            self._pending.extend(_Stream(file, on_line, watch) for file, on_line in streams)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name='pipe-mux', daemon=True)
+                self._thread.start()
+        os.write(self._wakeup_write, b'\0')
+        return watch.closed
+
+    def stream_count(self):
+        return len(self._selector.get_map()) - 1
+
+    def _loop(self):
+        while True:
+            for key, _ in self._selector.select():
+                if key.data is None:
+                    self._accept_pending()
+                else:
+                    self._read(key.data)
+
+    def _accept_pending(self):
+        try:
+            while os.read(self._wakeup_read, 4096):
+                pass
+        except BlockingIOError:
+            pass
+        with self._lock:
+            pending, self._pending = self._pending, []
+        for stream in pending:
+            os.set_blocking(stream.file.fileno(), False)
+            self._selector.register(stream.file.fileno(), selectors.EVENT_READ, stream)
+
+    def _read(self, stream):
+        try:
+            chunk = os.read(stream.file.fileno(), READ_CHUNK_BYTES)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            logger.error(f"Error reading downloader pipe: {e}")
+            chunk = b''
+
+        if chunk:
+            # Only the new chunk is searched: yt-dlp's info JSON is one line of megabytes
+            end = chunk.rfind(b'\n')
+            if end < 0:
+                stream.parts.append(chunk)
+                return
+            lines = b''.join(stream.parts + [chunk[:end]]) if stream.parts else chunk[:end]
+            stream.parts = [chunk[end + 1:]] if end + 1 < len(chunk) else []
+            for line in lines.split(b'\n'):
+                self._dispatch(stream, line)
+            return
+
+        # EOF: flush a final unterminated line, then retire the stream
+        if stream.parts:
+            self._dispatch(stream, b''.join(stream.parts))
+            stream.parts = []
+        self._selector.unregister(stream.file.fileno())
+        stream.file.close()
+        stream.watch.open_streams -= 1
+        if stream.watch.open_streams == 0:
+            stream.watch.closed.set()
+
+    def _dispatch(self, stream, line):
+        try:
+            stream.on_line(line.decode('utf-8', errors='replace').rstrip('\r'))
+        except Exception as e:
+            logger.error(f"Error handling downloader output: {e}")
+
+
+pipe_mux = PipeMultiplexer()
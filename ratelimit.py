@@ -0,0 +1,125 @@
+# ratelimit.py
+
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def _parse_origin_limits(value, parse):
+    """Parses 'youtube=4,default=8' style settings, converting each value with `parse`."""
+    limits = {}
+    for item in value.split(','):
+        if '=' not in item:
+            continue
+        origin, limit = item.rsplit('=', 1)
+        try:
+            limits[origin.strip().lower()] = parse(limit.strip())
+        except ValueError:
+            logger.warning(f"Ignoring invalid origin limit entry: {item!r}")
+    return limits
+
+
+def _parse_rate(value):
+    """'0.5:4' -> (0.5 starts per second, burst of 4); the burst defaults to 1."""
+    rate, _, burst = value.partition(':')
+    rate, burst = float(rate), float(burst or 1)
+    if rate <= 0 or burst < 1:
+        raise ValueError(value)
+    return rate, burst
+
+
+# --- Per-origin limits ---
+# Origins are site families (retry.origin_key): 'youtube' for every YouTube
+# URL shape, a registrable domain such as 'example.com' for sites only the
+# generic extractor handles. Matched case-insensitively; 'default' applies to
+# any origin not listed. Unset means unlimited.
+# Concurrent jobs per origin, e.g. 'youtube=4,default=8'
+ORIGIN_MAX_CONCURRENCY = _parse_origin_limits(os.environ.get('ORIGIN_MAX_CONCURRENCY', ''), int)
+# Job starts per second per origin with an optional burst, e.g. 'youtube=0.5:4'
+ORIGIN_RATE_LIMITS = _parse_origin_limits(os.environ.get('ORIGIN_RATE_LIMITS', ''), _parse_rate)
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = None
+
+    def _refill(self, now):
+        if self.updated is not None:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def available(self, now):
+        self._refill(now)
+        return self.tokens >= 1
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def wait_time(self, now):
+        """Seconds until a token is available."""
+        self._refill(now)
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+
+class OriginLimiter:
+    """
+    Concurrency caps and start-rate token buckets per origin, so one site
+    can't take every worker (and get the instance throttled) while jobs for
+    other sites are waiting.
+
+    Not thread-safe; used by jobqueue.JobQueue under its runner's lock.
+    """
+
+    def __init__(self, max_concurrency=None, rate_limits=None):
+        self.max_concurrency = ORIGIN_MAX_CONCURRENCY if max_concurrency is None else max_concurrency
+        self.rate_limits = ORIGIN_RATE_LIMITS if rate_limits is None else rate_limits
+        self.running = {}
+        self._buckets = {}
+
+    def _limit(self, limits, origin):
+        return limits.get(origin.lower(), limits.get('default'))
+
+    def _bucket(self, origin):
+        bucket = self._buckets.get(origin)
+        if bucket is None:
+            rate = self._limit(self.rate_limits, origin)
+            if rate is None:
+                return None
+            bucket = self._buckets[origin] = TokenBucket(*rate)
+        return bucket
+
+    def blocked(self, origin, now):
+        """
+        Returns:
+            str or None: 'concurrency' or 'rate' if a job for `origin` can't start now.
+        """
+        cap = self._limit(self.max_concurrency, origin)
+        if cap is not None and self.running.get(origin, 0) >= cap:
+            return 'concurrency'
+        bucket = self._bucket(origin)
+        if bucket is not None and not bucket.available(now):
+            return 'rate'
+        return None
+
+    def acquire(self, origin, now):
+        self.running[origin] = self.running.get(origin, 0) + 1
+        bucket = self._bucket(origin)
+        if bucket is not None:
+            bucket.take(now)
+
+    def release(self, origin):
+        count = self.running.get(origin, 0) - 1
+        if count > 0:
+            self.running[origin] = count
+        else:
+            self.running.pop(origin, None)
+
+    def retry_in(self, origin, now):
+        """Seconds until a rate-limited `origin` may start a job again."""
+        bucket = self._bucket(origin)
+        return bucket.wait_time(now) if bucket is not None else None
@@ -0,0 +1,285 @@
+# retry.py
+
+import os
+import re
+import functools
+import random
+import threading
+import time
+import logging
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+# --- Retry policy configuration ---
+MAX_ATTEMPTS = int(os.environ.get('RETRY_MAX_ATTEMPTS', 4))
+BACKOFF_BASE_SECONDS = float(os.environ.get('RETRY_BACKOFF_BASE_SECONDS', 2))
+BACKOFF_CAP_SECONDS = float(os.environ.get('RETRY_BACKOFF_CAP_SECONDS', 120))
+# Throttling responses get a longer starting delay than plain network blips
+THROTTLE_BACKOFF_BASE_SECONDS = float(os.environ.get('RETRY_THROTTLE_BACKOFF_BASE_SECONDS', 15))
+
+# --- Circuit breaker configuration ---
+CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get('CIRCUIT_FAILURE_THRESHOLD', 5))
+CIRCUIT_COOLDOWN_SECONDS = float(os.environ.get('CIRCUIT_COOLDOWN_SECONDS', 60))
+# 'fail' rejects new jobs while a breaker is open, 'defer' queues them until it half-opens
+CIRCUIT_OPEN_POLICY = os.environ.get('CIRCUIT_OPEN_POLICY', 'fail')
+# URLs whose extractor lookup is remembered
+EXTRACTOR_CACHE_SIZE = int(os.environ.get('EXTRACTOR_CACHE_SIZE', 4096))
+
+# --- Error classification ---
+
+# Ordered: the first category whose pattern matches the stderr text wins.
+ERROR_PATTERNS = [
+    ('throttled', re.compile(r"HTTP Error 429|Too Many Requests|rate.?limit|Sign in to confirm you.re not a bot", re.I)),
+    ('forbidden', re.compile(r"HTTP Error 403|Forbidden", re.I)),
+    ('unavailable', re.compile(
+        r"Video unavailable|Private video|This video is not available|has been removed|"
+        r"HTTP Error 404|Unsupported URL|is not a valid URL|members-only|age.restricted", re.I)),
+    ('network', re.compile(
+        r"HTTP Error 5\d\d|timed out|Connection (?:reset|refused|aborted)|Remote end closed|"
+        r"Temporary failure in name resolution|Name or service not known|IncompleteRead|"
+        r"urlopen error|SSL: |\[Errno (?:101|104|110|111|113)\]|Network is unreachable", re.I)),
+    ('extractor', re.compile(
+        r"Unable to extract|ExtractorError|Please report this issue|nsig extraction failed|"
+        r"Signature extraction failed|Failed to parse JSON", re.I)),
+]
+
+# Categories worth another attempt; 'extractor' breakage and 'unavailable'
+# content won't fix themselves within a backoff window.
+RETRYABLE_CATEGORIES = {'throttled', 'forbidden', 'network'}
+# Categories that say something about the origin's health and feed the breaker.
+# 'unavailable' is a property of the requested video, not of the site.
+BREAKER_CATEGORIES = {'throttled', 'forbidden', 'network', 'extractor'}
+
+
+def classify_error(error_text):
+    """
+    Maps yt-dlp stderr output to a coarse error category.
+
+    Only 'ERROR:' lines are considered when present, since a --verbose run
+    prints plenty of debug lines that mention words like 'Forbidden'.
+
+    Returns:
+        str: One of the ERROR_PATTERNS categories, or 'unknown'.
+    """
+    if not error_text:
+        return 'unknown'
+    error_lines = [line for line in error_text.splitlines() if line.startswith('ERROR:')]
+    text = '\n'.join(error_lines) if error_lines else error_text
+    for category, pattern in ERROR_PATTERNS:
+        if pattern.search(text):
+            return category
+    return 'unknown'
+
+
+def is_retryable(category):
+    return category in RETRYABLE_CATEGORIES
+
+
+def backoff_delay(attempt, category=None):
+    """
+    Returns the delay (seconds) before retry number `attempt` (1-based),
+    using exponential backoff with full jitter so that jobs failing together
+    don't come back together.
+    """
+    base = THROTTLE_BACKOFF_BASE_SECONDS if category == 'throttled' else BACKOFF_BASE_SECONDS
+    ceiling = min(BACKOFF_CAP_SECONDS, base * (2 ** (attempt - 1)))
+    return random.uniform(base / 2, max(base / 2, ceiling))
+
+
+_extractor_classes = None
+_extractor_lock = threading.Lock()
+
+
+def _extractors():
+    """yt-dlp's extractor classes in match order, without Generic; imported once."""
+    global _extractor_classes
+    with _extractor_lock:
+        if _extractor_classes is None:
+            from yt_dlp.extractor import gen_extractor_classes
+            _extractor_classes = [ie for ie in gen_extractor_classes() if ie.ie_key() != 'Generic']
+        return _extractor_classes
+
+
+def warm_extractors():
+    """
+    Imports yt-dlp's extractors and compiles their URL patterns (about a
+    second), so the first /download after startup doesn't wait for it.
+    """
+    try:
+        for ie in _extractors():
+            ie.suitable('')
+    except Exception as e:
+        logger.debug(f"Extractor warm-up failed: {e}")
+
+
+@functools.lru_cache(maxsize=EXTRACTOR_CACHE_SIZE)
+def _match_extractor(url):
+    # Memoized per URL rather than per host and path shape: patterns such as
+    # YoutubeTruncatedID tell extractors apart by the length of an id
+    try:
+        for ie in _extractors():
+            if ie.suitable(url):
+                return ie
+    except Exception as e:
+        logger.debug(f"Extractor lookup failed for {url}: {e}")
+    return None
+
+
+def extractor_key(url):
+    """
+    Returns the yt-dlp extractor key that will handle `url` (e.g. 'Youtube'),
+    falling back to the URL's host when yt-dlp isn't importable or only the
+    generic extractor matches.
+    """
+    ie = _match_extractor(url)
+    if ie is not None:
+        return ie.ie_key()
+    host = (urlparse(url).hostname or 'unknown').lower()
+    return host[4:] if host.startswith('www.') else host
+
+
+# Second-level labels country-code domains register names under (example.co.uk)
+_SECOND_LEVEL_LABELS = ('ac', 'co', 'com', 'edu', 'gov', 'go', 'ne', 'net', 'or', 'org')
+
+
+def _registrable_domain(host):
+    labels = host.split('.')
+    if len(labels) < 3 or host.replace('.', '').isdigit():
+        return host
+    keep = 3 if len(labels[-1]) == 2 and labels[-2] in _SECOND_LEVEL_LABELS else 2
+    return '.'.join(labels[-keep:])
+
+
+def _extractor_family(ie):
+    # One site's extractors share a module (yt_dlp.extractor.youtube, or a
+    # package in newer releases) even where their IE_NAMEs don't share a prefix
+    # ('youtube:tab', 'YoutubeYtBe')
+    parts = (getattr(ie, '_module', None) or ie.__module__).split('.')
+    if len(parts) > 2 and parts[1] == 'extractor':
+        return parts[2].lower()
+    return ie.IE_NAME.split(':')[0].lower()
+
+
+def origin_key(url):
+    """
+    Returns the site `url` belongs to, which per-origin limits are keyed by:
+    the family of the extractor that will handle it ('youtube' for Youtube,
+    YoutubeTab and YoutubeTruncatedID alike), or the registrable domain of
+    its host when only the generic extractor matches ('cdn.example.co.uk' ->
+    'example.co.uk').
+    """
+    ie = _match_extractor(url)
+    if ie is not None:
+        return _extractor_family(ie)
+    return _registrable_domain(extractor_key(url))
+
+
+def origin_label(url):
+    """
+    Returns `url`'s origin as a metric label: 'generic' for every site only
+    the generic extractor handles, so clients can't create new label values.
+    """
+    return origin_key(url) if _match_extractor(url) is not None else 'generic'
+
+
+# --- Circuit breakers ---
+
+class CircuitBreaker:
+    """
+    Per-extractor breaker. Closed: jobs run normally. Open: jobs are rejected
+    (or deferred) until the cooldown passes. Half-open: a single probe job is
+    let through; its outcome closes or re-opens the breaker.
+    """
+
+    def __init__(self, key, failure_threshold=CIRCUIT_FAILURE_THRESHOLD, cooldown=CIRCUIT_COOLDOWN_SECONDS):
+        self.key = key
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = 'closed'
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow_request(self):
+        """Returns True if a job for this extractor may start now."""
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.cooldown:
+                self.state = 'half_open'
+                self._probe_in_flight = False
+                logger.info(f"Circuit for '{self.key}' half-open, allowing a probe job")
+            if self.state == 'half_open' and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def is_open(self):
+        """
+        Non-consuming check used at admission time: True while the breaker
+        would reject a job (open and cooling down, or a probe already running).
+        """
+        with self._lock:
+            if self.state == 'open':
+                return time.monotonic() - self.opened_at < self.cooldown
+            return self.state == 'half_open' and self._probe_in_flight
+
+    def retry_after(self):
+        """Seconds until the breaker will let a probe through (0 if closed)."""
+        with self._lock:
+            if self.state == 'closed':
+                return 0
+            if self.state == 'half_open':
+                return self.cooldown
+            return max(0.0, self.cooldown - (time.monotonic() - self.opened_at))
+
+    def record_success(self):
+        with self._lock:
+            if self.state != 'closed':
+                logger.info(f"Circuit for '{self.key}' closed after successful job")
+            self.state = 'closed'
+            self.consecutive_failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self, category):
+        with self._lock:
+            if category not in BREAKER_CATEGORIES:
+                # Says nothing about the origin's health; just free the probe slot
+                self._probe_in_flight = False
+                return
+            self.consecutive_failures += 1
+            if self.state == 'half_open' or self.consecutive_failures >= self.failure_threshold:
+                if self.state != 'open':
+                    logger.warning(f"Circuit for '{self.key}' opened after {self.consecutive_failures} "
+                                   f"consecutive failures (last: {category})")
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+                self._probe_in_flight = False
+
+    def snapshot(self):
+        return {
+            'key': self.key,
+            'state': self.state,
+            'consecutive_failures': self.consecutive_failures,
+            'retry_after': round(self.retry_after(), 1),
+        }
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(key):
+    with _breakers_lock:
+        breaker = _breakers.get(key)
+        if breaker is None:
+            breaker = _breakers[key] = CircuitBreaker(key)
+        return breaker
+
+
+def breaker_states():
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return [b.snapshot() for b in breakers]
@@ -0,0 +1,137 @@
+# scheduler.py
+
+import os
+import threading
+import logging
+from jobqueue import JobQueue
+
+logger = logging.getLogger(__name__)
+
+# Number of yt-dlp jobs allowed to run at once on this instance
+MAX_WORKERS = int(os.environ.get('MAX_WORKERS', 4))
+# 'threads' runs each job on a worker thread; 'asyncio' runs them all as
+# coroutines on one event loop thread (see aiorunner.py)
+JOB_RUNNER = os.environ.get('JOB_RUNNER', 'threads')
+
+
+class JobScheduler:
+    """
+    Job queue drained by a fixed pool of worker threads, in the priority and
+    per-client order of jobqueue.JobQueue.
+
+    Jobs are identified by their job id only; the runner callable passed to
+    start() does the actual work, and the optional `describe` callable tells
+    the queue which lane and client a job belongs to. Delayed submissions (retries, deferred jobs)
+    wait on a timer rather than on a worker, so backing off never holds a slot.
+    """
+
+    def __init__(self, worker_count=MAX_WORKERS):
+        self.worker_count = worker_count
+        self._queue = JobQueue(worker_count)
+        self._cond = threading.Condition()
+        self._timers = {}
+        self._workers = []
+        self._runner = None
+        self.running = 0
+        self.paused = False
+
+    def start(self, runner, describe=None):
+        with self._cond:
+            if self._workers:
+                return
+            self._runner = runner
+            if describe is not None:
+                self._queue.describe = describe
+            for i in range(self.worker_count):
+                worker = threading.Thread(target=self._worker_loop, name=f"job-worker-{i}", daemon=True)
+                worker.start()
+                self._workers.append(worker)
+        logger.info(f"Job scheduler started with {self.worker_count} workers")
+
+    def submit(self, job_id):
+        with self._cond:
+            self._timers.pop(job_id, None)
+            self._queue.push(job_id)
+            self._cond.notify()
+
+    def submit_later(self, job_id, delay):
+        """Re-queues `job_id` after `delay` seconds without occupying a worker."""
+        timer = threading.Timer(delay, self.submit, args=(job_id,))
+        timer.daemon = True
+        with self._cond:
+            self._timers[job_id] = timer
+        timer.start()
+
+    def cancel(self, job_id):
+        """
+        Drops `job_id` from the queue or its pending retry timer.
+
+        Returns:
+            bool: True if the job was waiting and has been removed.
+        """
+        with self._cond:
+            timer = self._timers.pop(job_id, None)
+            if timer is not None:
+                timer.cancel()
+                return True
+            return self._queue.remove(job_id)
+
+    def pause(self):
+        """Stops workers from picking up new jobs; running jobs are unaffected."""
+        with self._cond:
+            self.paused = True
+
+    def drain_queue(self):
+        """
+        Removes every queued job and pending retry.
+
+        Returns:
+            list: The job ids that were waiting, in queue order.
+        """
+        with self._cond:
+            waiting = self._queue.drain()
+            for job_id, timer in self._timers.items():
+                timer.cancel()
+                waiting.append(job_id)
+            self._timers.clear()
+            return waiting
+
+    def queue_depth(self):
+        with self._cond:
+            return len(self._queue)
+
+    def pending_retries(self):
+        with self._cond:
+            return len(self._timers)
+
+    def lane_counts(self):
+        with self._cond:
+            return self._queue.lane_counts()
+
+    def _worker_loop(self):
+        while True:
+            with self._cond:
+                job_id = None
+                while job_id is None:
+                    # pop() can hold back queued jobs: bulk work beyond its share of the workers, limited origins
+                    job_id = None if self.paused else self._queue.pop()
+                    if job_id is None:
+                        # A job held back by an origin's rate limit becomes eligible without any notify
+                        self._cond.wait(None if self.paused else self._queue.retry_in)
+                self.running += 1
+            try:
+                self._runner(job_id)
+            except Exception as e:
+                logger.error(f"Unhandled error while running job {job_id}: {e}", exc_info=True)
+            finally:
+                with self._cond:
+                    self.running -= 1
+                    self._queue.task_done(job_id)
+                    self._cond.notify()
+
+
+if JOB_RUNNER == 'asyncio':
+    from aiorunner import AsyncJobRunner
+    scheduler = AsyncJobRunner(MAX_WORKERS)
+else:
+    scheduler = JobScheduler()
@@ -0,0 +1,298 @@
+# segmented.py
+
+"""
+Multi-connection downloads of progressive formats (SEGMENTED_DOWNLOAD=1).
+
+Run in front of the downloader as `python segmented.py <downloader command>`.
+Extraction runs first (the same command with --skip-download). If it picks a
+single progressive http(s) format and the origin honours Range requests, the
+file is fetched over up to SEGMENT_CONNECTIONS connections into a
+preallocated .part file, each connection writing its byte range in place
+with os.pwrite() and retrying on its own. Anything else (merged formats,
+HLS/DASH, origins without Range support) is handed to the downloader with
+--load-info-json, so nothing is extracted twice.
+
+Either way stdout and stderr look like yt-dlp's to the service: the info
+JSON, then one JSON progress object per line, and ERROR: lines on failure.
+A .part.segments file next to the .part records how far each range got, so
+a retried or resumed attempt only fetches what's missing.
+"""
+
+import os
+import sys
+import ssl
+import json
+import math
+import time
+import threading
+import subprocess
+import http.client
+import http.cookiejar
+import urllib.request
+import urllib.error
+
+# --- Segmented download configuration ---
+SEGMENTED_DOWNLOAD = os.environ.get('SEGMENTED_DOWNLOAD', '0') == '1'
+# Parallel connections per file; origins often cap the speed of each one
+SEGMENT_CONNECTIONS = int(os.environ.get('SEGMENT_CONNECTIONS', 4))
+# Files are never split into ranges smaller than this
+SEGMENT_MIN_BYTES = int(os.environ.get('SEGMENT_MIN_BYTES', 4 * 1024 * 1024))
+# Failed requests in a row a range survives; a request that made progress resets the count
+SEGMENT_RETRIES = int(os.environ.get('SEGMENT_RETRIES', 5))
+SEGMENT_TIMEOUT_SECONDS = float(os.environ.get('SEGMENT_TIMEOUT_SECONDS', 30))
+PROGRESS_INTERVAL_SECONDS = 0.5
+CHUNK_BYTES = 256 * 1024
+# Errors another request won't fix
+FATAL_HTTP_STATUSES = (401, 403, 404, 410, 416)
+
+
+class SegmentError(Exception):
+    pass
+
+
+def _emit(stream, line):
+    stream.write(line + '\n')
+    stream.flush()
+
+
+def _option(argv, *names):
+    for i, arg in enumerate(argv[:-1]):
+        if arg in names:
+            return argv[i + 1]
+    return None
+
+
+def _opener(argv):
+    """urllib opener honouring the downloader's --cookies and --no-check-certificate."""
+    handlers = []
+    cookies = _option(argv, '--cookies')
+    if cookies and os.path.isfile(cookies):
+        jar = http.cookiejar.MozillaCookieJar(cookies)
+        try:
+            jar.load(ignore_discard=True, ignore_expires=True)
+            handlers.append(urllib.request.HTTPCookieProcessor(jar))
+        except (OSError, http.cookiejar.LoadError) as e:
+            _emit(sys.stderr, f"WARNING: [segmented] Could not load cookies from {cookies}: {e}")
+    if '--no-check-certificate' in argv:
+        handlers.append(urllib.request.HTTPSHandler(context=ssl._create_unverified_context()))
+    return urllib.request.build_opener(*handlers)
+
+
+def probe(opener, url, headers):
+    """
+    Asks for the first byte to learn the size and whether ranges are honoured.
+
+    Returns:
+        int or None: Total size, or None if the origin doesn't serve ranges.
+    """
+    request = urllib.request.Request(url, headers=dict(headers, Range='bytes=0-0'))
+    try:
+        with opener.open(request, timeout=SEGMENT_TIMEOUT_SECONDS) as response:
+            content_range = response.headers.get('Content-Range', '')
+            if response.status != 206 or '/' not in content_range:
+                return None
+            total = content_range.rsplit('/', 1)[1]
+            return int(total) if total.isdigit() else None
+    except (urllib.error.URLError, http.client.HTTPException, OSError, ValueError):
+        return None
+
+
+def _split(total, connections):
+    count = max(1, min(connections, math.ceil(total / SEGMENT_MIN_BYTES)))
+    size = math.ceil(total / count)
+    return [[start, min(total, start + size) - 1, start] for start in range(0, total, size)]
+
+
+def _load_state(state_path, total):
+    """Ranges ([start, end, next byte]) saved by an earlier attempt on the same file, if any."""
+    try:
+        with open(state_path) as f:
+            state = json.load(f)
+        if state['total'] == total:
+            return state['segments']
+    except (OSError, ValueError, KeyError):
+        pass
+    return None
+
+
+def _save_state(state_path, total, segments):
+    temp_path = state_path + '.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump({'total': total, 'segments': segments}, f)
+    os.replace(temp_path, state_path)
+
+
+def _pwrite(fd, data, offset, lock):
+    if hasattr(os, 'pwrite'):
+        os.pwrite(fd, data, offset)
+        return
+    # No pwrite() (Windows): share the descriptor's position under a lock
+    with lock:
+        os.lseek(fd, offset, os.SEEK_SET)
+        os.write(fd, data)
+
+
+class SegmentedDownload:
+    """One file fetched as parallel byte ranges."""
+
+    def __init__(self, opener, url, headers, output, total, connections):
+        self.opener = opener
+        self.url = url
+        self.headers = headers
+        self.output = output
+        self.part_path = output + '.part'
+        self.state_path = self.part_path + '.segments'
+        self.total = total
+        self.connections = connections
+        self.error = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def downloaded(self):
+        return sum(next_byte - start for start, _, next_byte in self.segments)
+
+    def run(self):
+        """
+        Returns:
+            bool: True once the whole file is in place; False with self.error set.
+        """
+        segments = _load_state(self.state_path, self.total) if os.path.exists(self.part_path) else None
+        self.segments = segments or _split(self.total, self.connections)
+        fd = os.open(self.part_path, os.O_RDWR | os.O_CREAT | getattr(os, 'O_BINARY', 0), 0o666)
+        try:
+            # Preallocate, so every range can be written where it belongs
+            if os.fstat(fd).st_size != self.total:
+                os.ftruncate(fd, self.total)
+            threads = [threading.Thread(target=self._fetch, args=(fd, segment), daemon=True)
+                       for segment in self.segments if segment[2] <= segment[1]]
+            for thread in threads:
+                thread.start()
+            started_at = time.monotonic()
+            downloaded_before = self.downloaded()
+            alive = threads
+            while alive:
+                alive[0].join(PROGRESS_INTERVAL_SECONDS)
+                self._progress(started_at, downloaded_before, len(threads))
+                _save_state(self.state_path, self.total, self.segments)
+                alive = [thread for thread in threads if thread.is_alive()]
+            self._progress(started_at, downloaded_before, len(threads))
+        finally:
+            os.close(fd)
+        if self.error is not None:
+            _save_state(self.state_path, self.total, self.segments)
+            return False
+        os.replace(self.part_path, self.output)
+        try:
+            os.remove(self.state_path)
+        except OSError:
+            pass
+        return True
+
+    def _progress(self, started_at, downloaded_before, connections):
+        downloaded = self.downloaded()
+        elapsed = time.monotonic() - started_at
+        speed = (downloaded - downloaded_before) / elapsed if elapsed > 0 else None
+        _emit(sys.stdout, json.dumps({
+            'status': 'finished' if downloaded >= self.total else 'downloading',
+            'downloaded_bytes': downloaded,
+            'total_bytes': self.total,
+            'filename': self.output,
+            'tmpfilename': self.part_path,
+            'elapsed': elapsed,
+            'speed': speed,
+            'eta': int((self.total - downloaded) / speed) if speed else None,
+            'segments': connections,
+        }))
+
+    def _fetch(self, fd, segment):
+        """Fetches one range, resuming from where it got to after each failed request."""
+        failures = 0
+        while segment[2] <= segment[1] and not self._stop.is_set():
+            before = segment[2]
+            try:
+                self._request(fd, segment)
+                continue
+            except SegmentError as e:
+                return self._fail(e)
+            except urllib.error.HTTPError as e:
+                if e.code in FATAL_HTTP_STATUSES:
+                    return self._fail(e)
+                error = e
+            except (urllib.error.URLError, http.client.HTTPException, OSError) as e:
+                error = e
+            failures = 1 if segment[2] > before else failures + 1
+            if failures > SEGMENT_RETRIES:
+                return self._fail(error)
+            _emit(sys.stderr, f"[segmented] Range {segment[0]}-{segment[1]}: {error}; retrying ({failures}/{SEGMENT_RETRIES})")
+            self._stop.wait(min(30.0, 0.5 * 2 ** (failures - 1)))
+
+    def _request(self, fd, segment):
+        """One ranged GET for what's left of `segment`, written in place as it arrives."""
+        request = urllib.request.Request(self.url, headers=dict(self.headers, Range=f"bytes={segment[2]}-{segment[1]}"))
+        with self.opener.open(request, timeout=SEGMENT_TIMEOUT_SECONDS) as response:
+            if response.status != 206:
+                raise SegmentError(f"HTTP Error {response.status}: the origin ignored the Range header")
+            while segment[2] <= segment[1] and not self._stop.is_set():
+                chunk = response.read(min(CHUNK_BYTES, segment[1] - segment[2] + 1))
+                if not chunk:
+                    break
+                _pwrite(fd, chunk, segment[2], self._lock)
+                segment[2] += len(chunk)
+        if segment[2] <= segment[1] and not self._stop.is_set():
+            raise http.client.IncompleteRead(b'', segment[1] - segment[2] + 1)
+
+    def _fail(self, error):
+        with self._lock:
+            if self.error is None:
+                self.error = error
+        self._stop.set()
+
+
+def _segmentable(info):
+    return (info.get('protocol') in ('http', 'https') and info.get('url')
+            and not info.get('requested_formats') and not info.get('fragments'))
+
+
+def run(argv):
+    """
+    Args:
+        argv (list): The downloader command line, URL last.
+
+    Returns:
+        int: Exit code.
+    """
+    output = _option(argv, '-o', '--output')
+    if not output or '%(' in output:
+        # Output templates (separate streams, extracted audio) stay with the downloader
+        return subprocess.call(argv)
+
+    extraction = subprocess.run([*argv[:-1], '--skip-download', argv[-1]], stdout=subprocess.PIPE)
+    lines = [line for line in extraction.stdout.decode('utf-8', errors='replace').splitlines() if line.strip()]
+    if extraction.returncode != 0 or not lines:
+        return extraction.returncode or 1
+    info_line = lines[-1]
+    info = json.loads(info_line)
+
+    opener = _opener(argv)
+    headers = info.get('http_headers') or {}
+    total = probe(opener, info['url'], headers) if _segmentable(info) else None
+    if total is None:
+        info_path = os.path.splitext(output)[0] + '.info.json'
+        with open(info_path, 'w') as f:
+            f.write(info_line)
+        try:
+            return subprocess.call([*argv[:-1], '--load-info-json', info_path])
+        finally:
+            os.remove(info_path)
+
+    _emit(sys.stdout, info_line)
+    _emit(sys.stderr, f"[segmented] Downloading {total} bytes over up to {SEGMENT_CONNECTIONS} connections")
+    download = SegmentedDownload(opener, info['url'], headers, output, total, SEGMENT_CONNECTIONS)
+    if not download.run():
+        _emit(sys.stderr, f"ERROR: unable to download video data: {download.error}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(run(sys.argv[1:]))
@@ -0,0 +1,157 @@
+# shutdown.py
+
+import os
+import signal
+import threading
+import time
+import logging
+from contextlib import contextmanager
+
+import checkpoint
+import download
+from scheduler import scheduler
+
+logger = logging.getLogger(__name__)
+
+# Cloud Run sends SIGTERM and kills the container 10 seconds later; keep some slack
+SHUTDOWN_GRACE_SECONDS = float(os.environ.get('SHUTDOWN_GRACE_SECONDS', 8))
+# Time a checkpoint or snapshot JSON takes to write; no job is stopped with less than this left
+CHECKPOINT_WRITE_SECONDS = float(os.environ.get('CHECKPOINT_WRITE_SECONDS', 1))
+
+_draining = threading.Event()
+_in_flight_lock = threading.Lock()
+_in_flight_requests = 0
+
+
+def is_draining():
+    return _draining.is_set()
+
+
+@contextmanager
+def in_flight():
+    """Marks a synchronous request (e.g. /upload-folder) that the drain should wait for."""
+    global _in_flight_requests
+    with _in_flight_lock:
+        _in_flight_requests += 1
+    try:
+        yield
+    finally:
+        with _in_flight_lock:
+            _in_flight_requests -= 1
+
+
+def drain(grace_seconds=SHUTDOWN_GRACE_SECONDS):
+    """
+    Stops accepting work and saves what can be saved before the instance dies.
+
+    Order of business within the grace budget:
+      1. stop admitting requests and stop workers from picking up queued jobs;
+      2. let GCS uploads that are expected to finish in time run to completion;
+      3. write a snapshot of every job record to the bucket, so it exists
+         however the rest goes;
+      4. stop the remaining downloads and checkpoint them (partial files
+         included when they can be uploaded in time) so another instance
+         can resume them; jobs there's no time left for are left running
+         rather than killed unsaved;
+      5. rewrite the snapshot with the jobs' final statuses, if time allows.
+
+    Returns:
+        dict: Counts of what happened to the jobs, for logging.
+    """
+    deadline = time.monotonic() + grace_seconds
+    _draining.set()
+    scheduler.pause()
+    bucket_name = os.environ.get('GCS_BUCKET_NAME')
+    summary = {'finished_uploads': 0, 'checkpointed': 0, 'lost': 0}
+    logger.warning(f"Draining: {grace_seconds:.0f}s grace period")
+
+    # Give the uploads a share of the budget; checkpointing needs the rest
+    upload_deadline = deadline - grace_seconds / 2
+    for job_id in _jobs_with_status('uploading'):
+        remaining = download.upload_time_remaining(job_id)
+        if remaining is not None and time.monotonic() + remaining > upload_deadline:
+            continue
+        done = download.job_contexts[job_id]['done']
+        if done.wait(max(0.0, upload_deadline - time.monotonic())):
+            summary['finished_uploads'] += 1
+
+    waiting = scheduler.drain_queue()
+    _save_job_state(bucket_name)
+    active = [job_id for job_id, job in list(download.jobs.items())
+              if job['status'] not in download.TERMINAL_STATUSES and job_id not in waiting]
+    for job_id in waiting + active:
+        # Decide before stopping the job: one killed without a checkpoint is lost for sure
+        if not bucket_name or time.monotonic() >= deadline - CHECKPOINT_WRITE_SECONDS:
+            summary['lost'] += 1
+            continue
+        job_checkpoint, partial_files = download.checkpoint_job(job_id)
+        try:
+            checkpoint.save_checkpoint(bucket_name, job_checkpoint, partial_files, deadline,
+                                       download.upload_stats['bytes_per_second'])
+            summary['checkpointed'] += 1
+        except Exception as e:
+            logger.error(f"Error checkpointing job {job_id}: {e}")
+            summary['lost'] += 1
+
+    while _in_flight_requests and time.monotonic() < deadline - 1:
+        time.sleep(0.1)
+
+    if time.monotonic() < deadline - CHECKPOINT_WRITE_SECONDS:
+        _save_job_state(bucket_name)
+
+    logger.warning(f"Drain finished: {summary}")
+    return summary
+
+
+def _save_job_state(bucket_name):
+    if not bucket_name:
+        return
+    try:
+        checkpoint.save_job_state(bucket_name, dict(download.jobs))
+    except Exception as e:
+        logger.error(f"Error saving job state: {e}")
+
+
+def _jobs_with_status(status):
+    return [job_id for job_id, job in list(download.jobs.items()) if job['status'] == status]
+
+
+def resume_checkpointed_jobs():
+    """Claims checkpoints left behind by drained instances and re-queues them."""
+    bucket_name = os.environ.get('GCS_BUCKET_NAME')
+    if not bucket_name:
+        return 0
+    downloads_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), 'downloads'))
+    try:
+        claimed = checkpoint.claim_checkpoints(bucket_name, downloads_dir)
+    except Exception as e:
+        logger.error(f"Error loading checkpoints: {e}")
+        return 0
+    for job_checkpoint in claimed:
+        download.restore_job(job_checkpoint)
+    if claimed:
+        logger.info(f"Resumed {len(claimed)} checkpointed jobs")
+    return len(claimed)
+
+
+def install(grace_seconds=SHUTDOWN_GRACE_SECONDS):
+    """
+    Installs the SIGTERM handler. Any handler already installed (gunicorn's
+    worker installs one) runs after the drain, so the server still exits
+    the way it normally would.
+    """
+    previous = signal.getsignal(signal.SIGTERM)
+
+    def handle_sigterm(signum, frame):
+        if not is_draining():
+            drain(grace_seconds)
+        if callable(previous):
+            previous(signum, frame)
+        elif previous == signal.SIG_DFL:
+            raise SystemExit(0)
+
+    try:
+        signal.signal(signal.SIGTERM, handle_sigterm)
+    except ValueError:
+        # Not the main thread (e.g. imported by a test runner); nothing to install
+        logger.warning("SIGTERM drain handler not installed: not running in the main thread")
@@ -0,0 +1,153 @@
+# tests/test_admission.py
+
+from collections import namedtuple
+from types import SimpleNamespace
+
+import pytest
+
+import admission
+import download
+
+DiskUsage = namedtuple('DiskUsage', 'total used free')
+
+
+@pytest.fixture(autouse=True)
+def settings(monkeypatch):
+    monkeypatch.setattr(admission, 'ADMISSION_CONTROL', True)
+    monkeypatch.setattr(admission, 'ADMISSION_MAX_WAIT_SECONDS', 300)
+    monkeypatch.setattr(admission, 'ADMISSION_MIN_FREE_DISK_BYTES', 1000)
+    monkeypatch.setattr(admission, 'ADMISSION_MIN_FREE_MEMORY_BYTES', 1000)
+    monkeypatch.setattr(admission, 'ADMISSION_DEFAULT_JOB_SECONDS', 120)
+    monkeypatch.setattr(admission, '_service_times', admission.deque(maxlen=3))
+
+
+@pytest.fixture
+def resources(monkeypatch):
+    """Free disk and memory as seen by admission.check(); plenty of both to start with."""
+    free = {'disk': 10 ** 9, 'memory': 10 ** 9}
+    monkeypatch.setattr(admission.shutil, 'disk_usage', lambda path: DiskUsage(0, 0, free['disk']))
+    monkeypatch.setattr(admission, 'free_memory_bytes', lambda: free['memory'])
+    return free
+
+
+def test_mean_service_time_uses_recent_jobs():
+    assert admission.mean_service_time() == 120
+    for seconds in (10, 20, 30, 40):
+        admission.record_service_time(seconds)
+    assert admission.mean_service_time() == 30
+
+
+@pytest.mark.parametrize('queued, running, workers, wait', [
+    (0, 0, 4, 0.0),
+    (0, 3, 4, 0.0),
+    (0, 4, 4, 30.0),
+    (4, 4, 4, 150.0),
+    (1, 1, 1, 240.0),
+])
+def test_estimated_wait(queued, running, workers, wait):
+    assert admission.estimated_wait(queued, running, workers) == wait
+
+
+def test_admits_when_idle(resources):
+    assert admission.check(0, 0, 4, '/') == {
+        'admit': True, 'reason': None, 'estimated_wait': 0.0, 'retry_after': None}
+
+
+def test_rejects_when_the_queue_wait_exceeds_the_slo(resources):
+    # 11 queued + 4 running + this job leaves 12 ahead of 4 workers: 360s, 60s over the SLO
+    decision = admission.check(11, 4, 4, '/')
+    assert decision == {'admit': False, 'reason': 'queue', 'estimated_wait': 360.0, 'retry_after': 60}
+    assert admission.check(9, 4, 4, '/')['admit']
+
+
+def test_rejects_when_disk_is_low(resources):
+    resources['disk'] = 999
+    decision = admission.check(0, 2, 4, '/')
+    assert (decision['admit'], decision['reason']) == (False, 'disk')
+    # The first of two running jobs is due to finish in about half a service time
+    assert decision['retry_after'] == 60
+
+
+def test_disk_rejection_has_no_retry_after_when_nothing_will_free_space(resources):
+    resources['disk'] = 999
+    assert admission.check(0, 0, 4, '/')['retry_after'] is None
+    assert admission.check(0, 2, 4, '/', frees_disk=False)['retry_after'] is None
+
+
+def test_rejects_when_memory_is_low(resources):
+    resources['memory'] = 999
+    decision = admission.check(0, 1, 4, '/')
+    assert (decision['admit'], decision['reason'], decision['retry_after']) == (False, 'memory', 60)
+    # Unreadable memory figures don't block anything
+    resources['memory'] = None
+    assert admission.check(0, 1, 4, '/')['admit']
+
+
+def test_retry_after_is_at_least_one_second(resources):
+    admission.record_service_time(0.1)
+    resources['disk'] = 999
+    assert admission.check(0, 4, 4, '/')['retry_after'] == 1
+
+
+def test_disabled_admission_control_admits_everything(monkeypatch, resources):
+    monkeypatch.setattr(admission, 'ADMISSION_CONTROL', False)
+    resources['disk'] = 0
+    decision = admission.check(99, 4, 4, '/')
+    assert decision['admit']
+    assert decision['estimated_wait'] == 3000.0
+
+
+def test_admission_decision_counts_pending_retries_as_queued(monkeypatch, resources):
+    monkeypatch.setattr(download, 'scheduler', SimpleNamespace(
+        queue_depth=lambda: 7, pending_retries=lambda: 4, running=4, worker_count=4))
+    decision = download.admission_decision()
+    assert (decision['reason'], decision['estimated_wait']) == ('queue', 360.0)
+
+
+def test_admission_decision_follows_keep_local_files(monkeypatch, resources):
+    monkeypatch.setattr(download, 'scheduler', SimpleNamespace(
+        queue_depth=lambda: 0, pending_retries=lambda: 0, running=2, worker_count=4))
+    resources['disk'] = 999
+    monkeypatch.setattr(download, 'KEEP_LOCAL_FILES', False)
+    assert download.admission_decision()['retry_after'] == 60
+    monkeypatch.setattr(download, 'KEEP_LOCAL_FILES', True)
+    assert download.admission_decision()['retry_after'] is None
+
+
+@pytest.fixture
+def cgroup(monkeypatch, tmp_path):
+    """Writes a cgroup v2 memory controller under tmp_path: cgroup(limit, current, inactive_file)."""
+    monkeypatch.setattr(admission, 'CGROUP_DIR', str(tmp_path))
+
+    def write(limit, current, inactive_file=None):
+        (tmp_path / 'memory.max').write_text(f"{limit}\n")
+        (tmp_path / 'memory.current').write_text(f"{current}\n")
+        if inactive_file is not None:
+            (tmp_path / 'memory.stat').write_text(
+                f"anon 1000\nfile 9000\nactive_file 2000\ninactive_file {inactive_file}\nslab 100\n")
+    return write
+
+
+def test_free_memory_leaves_out_reclaimable_page_cache(cgroup):
+    # 1900 of 2000 bytes used, but 1500 of that is inactive file cache from downloads
+    cgroup(limit=2000, current=1900, inactive_file=1500)
+    assert admission.free_memory_bytes() == 1600
+    assert admission.check(0, 1, 4, '/')['admit']
+
+
+def test_free_memory_without_page_cache_to_reclaim(cgroup):
+    cgroup(limit=2000, current=1900, inactive_file=0)
+    assert admission.free_memory_bytes() == 100
+    decision = admission.check(0, 1, 4, '/')
+    assert (decision['admit'], decision['reason']) == (False, 'memory')
+
+
+def test_free_memory_without_memory_stat(cgroup):
+    cgroup(limit=2000, current=1900)
+    assert admission.free_memory_bytes() == 100
+
+
+def test_free_memory_without_a_cgroup_limit_reads_meminfo(cgroup):
+    cgroup(limit='max', current=1900, inactive_file=1500)
+    free = admission.free_memory_bytes()
+    assert free is None or free > 0
@@ -0,0 +1,69 @@
+# tests/test_clips.py
+
+import pytest
+
+import clips
+
+
+@pytest.mark.parametrize('value, seconds', [
+    (90, 90.0),
+    (12.5, 12.5),
+    ('90', 90.0),
+    (' 1:30 ', 90.0),
+    ('01:02:03.5', 3723.5),
+    ('0:0', 0.0),
+])
+def test_parse_timestamp(value, seconds):
+    assert clips.parse_timestamp(value) == seconds
+
+
+@pytest.mark.parametrize('value', [
+    -1, '-1', '1:-5', '-0:10', '0:-0', '1:2:3:4', '', 'abc', '1::2', 'nan', 'inf', float('inf'), True, None,
+])
+def test_parse_timestamp_rejects(value):
+    with pytest.raises(ValueError):
+        clips.parse_timestamp(value)
+
+
+@pytest.mark.parametrize('kwargs, spec', [
+    ({}, None),
+    ({'start': 90, 'end': 120}, '*90-120'),
+    ({'start': '1:30'}, '*90-inf'),
+    ({'end': '0:10.25'}, '*0-10.25'),
+    ({'chapter': ' Intro (part 1) '}, r'(?i)^Intro\ \(part\ 1\)$'),
+])
+def test_parse_section(kwargs, spec):
+    assert clips.parse_section(**kwargs) == spec
+
+
+@pytest.mark.parametrize('kwargs, message', [
+    ({'start': 10, 'chapter': 'Intro'}, 'either start/end or chapter'),
+    ({'chapter': '  '}, 'chapter must be'),
+    ({'chapter': 5}, 'chapter must be'),
+    ({'start': '1:-5'}, 'start and end must be'),
+    ({'start': 30, 'end': 30}, 'end must be after start'),
+    ({'start': 60, 'end': '0:30'}, 'end must be after start'),
+])
+def test_parse_section_rejects(kwargs, message):
+    with pytest.raises(ValueError, match=message):
+        clips.parse_section(**kwargs)
+
+
+def test_section_args():
+    assert clips.section_args(None) == []
+    assert clips.section_args('*90-120') == ['--download-sections', '*90-120']
+    assert clips.section_args('*90-120', accurate_cuts=True) == [
+        '--download-sections', '*90-120', '--force-keyframes-at-cuts']
+
+
+@pytest.mark.parametrize('section, duration, fraction', [
+    ('*30-60', 120, 0.25),
+    ('*90-inf', 120, 0.25),
+    ('*90-300', 120, 0.25),
+    ('*200-300', 120, 0.0),
+    (None, 120, None),
+    ('(?i)^Intro$', 120, None),
+    ('*30-60', None, None),
+])
+def test_clip_fraction(section, duration, fraction):
+    assert clips.clip_fraction(section, duration) == fraction
@@ -0,0 +1,85 @@
+# tests/test_download.py
+
+import os
+
+import pytest
+
+import download
+
+
+@pytest.fixture
+def job(monkeypatch, tmp_path):
+    """A job in download.job_contexts whose stream files go to tmp_path."""
+    monkeypatch.setitem(download.job_contexts, 'job1', {
+        'downloads_dir': str(tmp_path), 'timestamp': '20260101000000', 'stream_has_video': {}})
+    # Hand back files in reverse name order, so audio f251 comes before video f248
+    real_glob = download.glob.glob
+    monkeypatch.setattr(download.glob, 'glob', lambda pattern: sorted(real_glob(pattern), reverse=True))
+    return download.job_contexts['job1']
+
+
+def add_streams(job, tmp_path, *streams):
+    """Creates stream files for (format_id, ext, has_video) triples as yt-dlp would name them."""
+    paths = {}
+    for format_id, ext, has_video in streams:
+        job['stream_has_video'][format_id] = has_video
+        path = tmp_path / f"20260101000000_job1.f{format_id}.{ext}"
+        path.write_bytes(b'')
+        paths[format_id] = str(path)
+    return paths
+
+
+def inputs(command):
+    return [command[i + 1] for i, arg in enumerate(command) if arg == '-i']
+
+
+def test_stream_files_put_video_first_when_both_are_webm(job, tmp_path):
+    paths = add_streams(job, tmp_path, ('248', 'webm', True), ('251', 'webm', False))
+    (tmp_path / '20260101000000_job1.f248.webm.part').write_bytes(b'')
+    streams = download._stream_files('job1')
+    assert streams == [paths['248'], paths['251']]
+    command = download._merge_command(streams, tmp_path / 'out.mp4')
+    assert inputs(command) == [paths['248'], paths['251']]
+    assert command[command.index('-map') + 1] == '0:v:0?'
+
+
+@pytest.mark.parametrize('video, audio', [
+    (('137', 'mp4'), ('251', 'webm')),
+    (('401', 'webm'), ('140', 'm4a')),
+    (('248', 'webm'), ('140', 'mp4')),
+])
+def test_stream_files_do_not_go_by_extension(job, tmp_path, video, audio):
+    paths = add_streams(job, tmp_path, (*video, True), (*audio, False))
+    assert download._stream_files('job1') == [paths[video[0]], paths[audio[0]]]
+
+
+def test_stream_files_single_progressive_file(job, tmp_path):
+    paths = add_streams(job, tmp_path, ('18', 'mp4', True))
+    assert download._stream_files('job1') == [paths['18']]
+
+
+def test_renditions_map_video_from_the_video_stream(job, tmp_path):
+    paths = add_streams(job, tmp_path, ('248', 'webm', True), ('251', 'webm', False))
+    streams = download._stream_files('job1')
+    for name in ('1080p', '720p'):
+        command = download._render_command(streams, name, tmp_path / 'out.mp4', 1080)
+        assert inputs(command) == [paths['248'], paths['251']]
+        maps = command.index('-map')
+        assert command[maps:maps + 4] == ['-map', '0:v:0', '-map', '1:a:0?']
+
+
+@pytest.mark.parametrize('video, audio, ext', [
+    (('248', 'webm'), ('251', 'webm'), '.webm'),
+    (('137', 'mp4'), ('140', 'm4a'), '.m4a'),
+    (('248', 'webm'), ('140', 'mp4'), '.m4a'),
+    (('137', 'mp4'), ('251', 'webm'), '.webm'),
+])
+def test_audio_rendition_takes_the_audio_stream(job, tmp_path, video, audio, ext):
+    paths = add_streams(job, tmp_path, (*video, True), (*audio, False))
+    streams = download._stream_files('job1')
+    path = download._rendition_path('job1', 'audio', streams)
+    assert path.suffix == ext
+    command = download._render_command(streams, 'audio', path, None)
+    assert inputs(command)[-1] == paths[audio[0]]
+    assert command[command.index('-map') + 1] == '1:a:0?'
+    assert '-vn' in command
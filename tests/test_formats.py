@@ -0,0 +1,71 @@
+# tests/test_formats.py
+
+import pytest
+
+import formats
+
+
+def test_max_keeps_the_original_selection():
+    assert formats.format_args('max') == ['-f', 'bestvideo+bestaudio/best']
+    assert formats.format_args('max', separate_streams=True) == ['-f', 'bv/b,ba/b']
+
+
+def test_capped_presets_fall_back_to_the_uncapped_best():
+    assert formats.format_args('balanced') == [
+        '-f', 'bv*[height<=?1080][tbr<=?6000]+ba/b[height<=?1080][tbr<=?6000]/bv*+ba/b',
+        '-S', 'res:1080,hasaud,ext:mp4:m4a,vcodec:h264,acodec:aac,tbr:6000']
+    assert formats.format_args('fast') == [
+        '-f', 'bv*[height<=?720][tbr<=?2500]+ba/b[height<=?720][tbr<=?2500]/bv*+ba/b',
+        '-S', 'hasaud,res:720,ext:mp4:m4a,vcodec:h264,acodec:aac,tbr:2500']
+
+
+def test_separate_streams_select_video_and_audio_apart():
+    assert formats.format_args('balanced', separate_streams=True) == [
+        '-f', 'bv[height<=?1080][tbr<=?6000]/b[height<=?1080][tbr<=?6000]/bv/b,ba/b',
+        '-S', 'res:1080,hasaud,ext:mp4:m4a,vcodec:h264,acodec:aac,tbr:6000']
+
+
+def test_single_file_presets_ignore_separate_streams():
+    assert formats.format_args('fast', separate_streams=True) == formats.format_args('fast')
+
+
+def test_unknown_preset():
+    with pytest.raises(KeyError):
+        formats.format_args('ultra')
+
+
+def test_audio_preset_extracts_the_best_audio():
+    args = ['-f', 'ba/b', '-x', '--audio-format', 'best']
+    assert formats.format_args('audio') == args
+    assert formats.format_args('audio', separate_streams=True) == args
+
+
+@pytest.mark.parametrize('format_ids, path', [
+    (['18'], 'single_file'),
+    (['137+140'], 'remux'),
+    (['137', '140'], 'remux'),
+    (['18', '18'], 'single_file'),
+    ([], 'single_file'),
+])
+def test_download_path(format_ids, path):
+    assert formats.download_path(format_ids) == path
+
+
+@pytest.mark.parametrize('names, args', [
+    (['720p', '1080p', 'audio'], ['-f', 'bv[height<=?1080]/b[height<=?1080]/bv/b,ba/b']),
+    (['360p'], ['-f', 'bv[height<=?360]/b[height<=?360]/bv/b,ba/b']),
+    (['audio'], ['-f', 'ba/b']),
+])
+def test_rendition_source_args(names, args):
+    assert formats.rendition_source_args(names) == args
+
+
+@pytest.mark.parametrize('name, source_height, path', [
+    ('audio', 1080, 'audio'),
+    ('1080p', 1080, 'remux'),
+    ('1440p', 1080, 'remux'),
+    ('720p', 1080, 'transcode'),
+    ('720p', None, 'remux'),
+])
+def test_render_path(name, source_height, path):
+    assert formats.render_path(name, source_height) == path
@@ -0,0 +1,126 @@
+# tests/test_fragments.py
+
+import pytest
+
+import fragments
+from fragments import FragmentTuner
+
+
+@pytest.fixture(autouse=True)
+def settings(monkeypatch):
+    monkeypatch.setattr(fragments, 'FRAGMENT_CONCURRENCY', 'auto')
+    monkeypatch.setattr(fragments, 'FRAGMENT_CONCURRENCY_START', 2)
+    monkeypatch.setattr(fragments, 'FRAGMENT_CONCURRENCY_MAX', 16)
+    monkeypatch.setattr(fragments, 'FRAGMENT_CONCURRENCY_TOTAL', 64)
+    monkeypatch.setattr(fragments, 'FRAGMENT_MIN_GAIN', 0.1)
+    monkeypatch.setattr(fragments, 'FRAGMENT_REPROBE_ATTEMPTS', 3)
+
+
+def succeed(tuner, origin, bytes_per_second, job_id='job'):
+    concurrency = tuner.acquire(job_id, origin)
+    tuner.release(job_id, origin, {'throttled': False, 'errors': 0, 'bytes_per_second': bytes_per_second})
+    return concurrency
+
+
+@pytest.mark.parametrize('protocol, fragmented', [
+    ('m3u8_native', True),
+    ('http_dash_segments+https', True),
+    ('https', False),
+    ('https+https', False),
+    (None, False),
+])
+def test_is_fragmented(protocol, fragmented):
+    assert fragments.is_fragmented(protocol) is fragmented
+
+
+def test_level_doubles_while_throughput_keeps_improving():
+    tuner = FragmentTuner()
+    levels = [succeed(tuner, 'cdn', rate) for rate in (100, 200, 400, 800)]
+    assert levels == [2, 4, 8, 16]
+    # Capped at FRAGMENT_CONCURRENCY_MAX
+    assert succeed(tuner, 'cdn', 1600) == 16
+    assert tuner.levels() == {'cdn': 16}
+
+
+def test_level_falls_back_when_doubling_does_not_pay_and_reprobes_later():
+    tuner = FragmentTuner()
+    assert succeed(tuner, 'cdn', 100) == 2
+    assert succeed(tuner, 'cdn', 200) == 4
+    # 8 is no faster than 4: back to 4
+    assert succeed(tuner, 'cdn', 205) == 8
+    assert tuner.levels()['cdn'] == 4
+    # Settled at 4 for FRAGMENT_REPROBE_ATTEMPTS attempts, then 8 is tried again
+    assert [succeed(tuner, 'cdn', 200) for _ in range(3)] == [4, 4, 4]
+    assert tuner.levels()['cdn'] == 8
+
+
+def test_throttling_halves_and_errors_step_down():
+    tuner = FragmentTuner()
+    for rate in (100, 200, 400):
+        succeed(tuner, 'cdn', rate)
+    assert tuner.levels()['cdn'] == 16
+    concurrency = tuner.acquire('job', 'cdn')
+    tuner.release('job', 'cdn', {'throttled': True, 'errors': 3})
+    assert tuner.levels()['cdn'] == concurrency // 2
+    tuner.acquire('job', 'cdn')
+    tuner.release('job', 'cdn', {'throttled': False, 'errors': 1})
+    assert tuner.levels()['cdn'] == concurrency // 2 - 1
+
+
+def test_origins_are_tuned_independently():
+    tuner = FragmentTuner()
+    succeed(tuner, 'a', 100)
+    succeed(tuner, 'a', 200)
+    assert tuner.levels() == {'a': 8}
+    assert tuner.acquire('other', 'b') == 2
+
+
+def test_attempts_share_the_instance_total(monkeypatch):
+    monkeypatch.setattr(fragments, 'FRAGMENT_CONCURRENCY_TOTAL', 5)
+    tuner = FragmentTuner()
+    assert tuner.acquire('one', 'cdn') == 2
+    assert tuner.acquire('two', 'cdn') == 2
+    assert tuner.acquire('three', 'cdn') == 1
+    # Never less than one, even with the total used up
+    assert tuner.acquire('four', 'cdn') == 1
+    assert tuner.in_flight() == 6
+    tuner.release('one', 'cdn')
+    assert tuner.in_flight() == 4
+
+
+def test_squeezed_attempts_do_not_steer():
+    tuner = FragmentTuner()
+    tuner._origin('cdn')['level'] = 8
+    tuner.acquire('job', 'cdn')
+    tuner.observe('job', 'cdn', True, 4)
+    tuner.release('job', 'cdn', {'throttled': False, 'errors': 0, 'bytes_per_second': 100})
+    assert tuner.levels()['cdn'] == 8
+
+
+def test_progressive_downloads_hold_no_share():
+    tuner = FragmentTuner()
+    assert tuner.acquire('job', 'cdn') == 2
+    assert tuner.in_flight() == 2
+    tuner.observe('job', 'cdn', False, 2)
+    assert tuner.in_flight() == 0
+    # The origin was progressive last time: start with one thread and no share
+    assert tuner.acquire('next', 'cdn') == 1
+    assert tuner.in_flight() == 0
+    # ... until the format turns out to be fragmented after all
+    tuner.observe('next', 'cdn', True, 1)
+    assert tuner.in_flight() == 1
+
+
+def test_release_without_outcome_only_frees_the_share():
+    tuner = FragmentTuner()
+    tuner.acquire('job', 'cdn')
+    tuner.release('job', 'cdn')
+    assert tuner.in_flight() == 0
+    assert tuner.levels()['cdn'] == 2
+
+
+def test_pinned_concurrency(monkeypatch):
+    monkeypatch.setattr(fragments, 'FRAGMENT_CONCURRENCY', '4')
+    tuner = FragmentTuner()
+    assert succeed(tuner, 'cdn', 100) == 4
+    assert succeed(tuner, 'cdn', 1000) == 4
@@ -0,0 +1,47 @@
+# tests/test_joblog.py
+
+from joblog import StderrRing
+
+
+def test_keeps_the_last_lines():
+    ring = StderrRing(max_lines=3, max_bytes=1000)
+    for i in range(10):
+        ring.append(f'line {i}')
+    assert ring.text() == 'line 7\nline 8\nline 9'
+    assert len(ring) == 3
+    assert (ring.total_lines, ring.dropped_lines) == (10, 7)
+
+
+def test_bounded_by_bytes():
+    ring = StderrRing(max_lines=100, max_bytes=10)
+    for line in ('aaaa', 'bbbb', 'cccc'):
+        ring.append(line)
+    assert ring.text() == 'bbbb\ncccc'
+    # A single line longer than the limit doesn't survive either
+    ring.append('x' * 11)
+    assert len(ring) == 0
+    assert ring.dropped_lines == 4
+
+
+def test_short_output_is_kept_whole():
+    ring = StderrRing(max_lines=5, max_bytes=1000)
+    ring.append('[download] 10%')
+    ring.append('ERROR: boom')
+    assert ring.text() == '[download] 10%\nERROR: boom'
+    assert ring.dropped_lines == 0
+
+
+def test_evicted_error_lines_are_pinned():
+    ring = StderrRing(max_lines=2, max_bytes=1000, max_errors=2)
+    ring.append('ERROR: first')
+    for i in range(3):
+        ring.append(f'traceback {i}')
+    assert ring.text() == 'ERROR: first\ntraceback 1\ntraceback 2'
+
+
+def test_pinned_errors_are_bounded_too():
+    ring = StderrRing(max_lines=1, max_bytes=1000, max_errors=2)
+    for i in range(4):
+        ring.append(f'ERROR: {i}')
+    ring.append('done')
+    assert ring.text() == 'ERROR: 2\nERROR: 3\ndone'
@@ -0,0 +1,208 @@
+# tests/test_jobqueue.py
+
+import pytest
+
+import jobqueue
+from jobqueue import JobQueue
+
+
+@pytest.fixture(autouse=True)
+def settings(monkeypatch):
+    monkeypatch.setattr(jobqueue, 'QUEUE_ORDER', 'fair')
+    monkeypatch.setattr(jobqueue, 'INTERACTIVE_RESERVED_WORKERS', 1)
+    monkeypatch.setattr(jobqueue, 'CLIENT_WEIGHTS', {})
+
+
+def make_queue(jobs, worker_count=4):
+    """A JobQueue whose describe() reads from `jobs`: job_id -> {'lane', 'client', ...}."""
+    queue = JobQueue(worker_count, describe=lambda job_id: jobs.get(job_id, {}))
+    queue.limiter.max_concurrency = {}
+    queue.limiter.rate_limits = {}
+    return queue
+
+
+def pop_all(queue):
+    order = []
+    while True:
+        job_id = queue.pop()
+        if job_id is None:
+            return order
+        order.append(job_id)
+        queue.task_done(job_id)
+
+
+def test_parse_client_weights_skips_invalid_entries():
+    assert jobqueue._parse_client_weights('acme=4, free-tier=0.5,broken,zero=0,neg=-1,nan=x') == {
+        'acme': 4.0, 'free-tier': 0.5}
+    assert jobqueue._parse_client_weights('') == {}
+
+
+def test_one_client_burst_is_interleaved_with_others():
+    jobs = {f'a{i}': {'client': 'a'} for i in range(4)}
+    jobs.update({f'b{i}': {'client': 'b'} for i in range(2)})
+    queue = make_queue(jobs)
+    for job_id in ('a0', 'a1', 'a2', 'a3', 'b0', 'b1'):
+        queue.push(job_id)
+    assert pop_all(queue) == ['a0', 'b0', 'a1', 'b1', 'a2', 'a3']
+
+
+def test_client_weights_set_the_share(monkeypatch):
+    monkeypatch.setattr(jobqueue, 'CLIENT_WEIGHTS', {'heavy': 2.0})
+    jobs = {f'h{i}': {'client': 'heavy'} for i in range(4)}
+    jobs.update({f'l{i}': {'client': 'light'} for i in range(2)})
+    queue = make_queue(jobs)
+    for job_id in ('h0', 'h1', 'h2', 'h3', 'l0', 'l1'):
+        queue.push(job_id)
+    assert pop_all(queue) == ['h0', 'h1', 'l0', 'h2', 'h3', 'l1']
+
+
+def test_late_client_does_not_get_a_backlog_of_credit():
+    jobs = {f'a{i}': {'client': 'a'} for i in range(4)}
+    jobs['b0'] = {'client': 'b'}
+    jobs['b1'] = {'client': 'b'}
+    queue = make_queue(jobs)
+    for job_id in ('a0', 'a1', 'a2', 'a3'):
+        queue.push(job_id)
+    assert queue.pop() == 'a0'
+    assert queue.pop() == 'a1'
+    # b arrives now: it is tagged from the lane clock, not from zero
+    queue.push('b0')
+    queue.push('b1')
+    assert [queue.pop() for _ in range(4)] == ['a2', 'b0', 'a3', 'b1']
+
+
+def test_interactive_lane_goes_first():
+    jobs = {'bulk': {'lane': 'bulk'}, 'fast': {'lane': 'interactive'}, 'odd': {'lane': 'no-such-lane'}}
+    queue = make_queue(jobs)
+    for job_id in ('bulk', 'fast', 'odd'):
+        queue.push(job_id)
+    assert queue.depth_by_lane() == {'interactive': 2, 'bulk': 1}
+    assert pop_all(queue) == ['fast', 'odd', 'bulk']
+
+
+def test_bulk_lane_leaves_reserved_workers_free():
+    jobs = {f'bulk{i}': {'lane': 'bulk'} for i in range(4)}
+    jobs['fast'] = {'lane': 'interactive'}
+    queue = make_queue(jobs, worker_count=3)
+    for job_id in sorted(jobs):
+        if job_id.startswith('bulk'):
+            queue.push(job_id)
+    assert queue.pop() == 'bulk0'
+    assert queue.pop() == 'bulk1'
+    # 3 workers, 1 reserved: the third bulk job has to wait
+    assert queue.pop() is None
+    queue.push('fast')
+    assert queue.pop() == 'fast'
+    assert queue.lane_counts() == {('interactive', 'queued'): 0, ('bulk', 'queued'): 2,
+                                   ('interactive', 'running'): 1, ('bulk', 'running'): 2}
+    queue.task_done('bulk0')
+    assert queue.pop() == 'bulk2'
+
+
+def test_bulk_lane_keeps_one_worker_when_all_are_reserved(monkeypatch):
+    monkeypatch.setattr(jobqueue, 'INTERACTIVE_RESERVED_WORKERS', 5)
+    queue = make_queue({'bulk0': {'lane': 'bulk'}, 'bulk1': {'lane': 'bulk'}}, worker_count=2)
+    queue.push('bulk0')
+    queue.push('bulk1')
+    assert queue.pop() == 'bulk0'
+    assert queue.pop() is None
+
+
+def test_remove_and_requeue():
+    jobs = {'a': {'client': 'x'}, 'b': {'client': 'x'}, 'c': {'client': 'y'}}
+    queue = make_queue(jobs)
+    for job_id in ('a', 'b', 'c'):
+        queue.push(job_id)
+    assert queue.remove('a')
+    assert not queue.remove('a')
+    assert len(queue) == 2
+    # Pushing a queued job again moves it instead of queuing it twice
+    queue.push('b')
+    assert len(queue) == 2
+    assert pop_all(queue) == ['c', 'b']
+
+
+def test_drain_returns_jobs_highest_priority_first():
+    jobs = {'bulk': {'lane': 'bulk'}, 'a': {'client': 'a'}, 'b': {'client': 'b'}}
+    queue = make_queue(jobs)
+    for job_id in ('bulk', 'a', 'b'):
+        queue.push(job_id)
+    queue.remove('a')
+    assert queue.drain() == ['b', 'bulk']
+    assert len(queue) == 0
+    assert queue.pop() is None
+
+
+def test_jobs_for_a_capped_origin_are_passed_over():
+    jobs = {'y0': {'origin': 'youtube'}, 'y1': {'origin': 'youtube'}, 'v0': {'origin': 'vimeo'}}
+    queue = make_queue(jobs)
+    queue.limiter.max_concurrency = {'youtube': 1}
+    for job_id in ('y0', 'y1', 'v0'):
+        queue.push(job_id)
+    assert queue.pop() == 'y0'
+    assert queue.pop() == 'v0'
+    assert queue.pop() is None
+    # Only a finishing job can help
+    assert queue.retry_in is None
+    queue.task_done('y0')
+    assert queue.pop() == 'y1'
+
+
+def test_rate_limited_origin_reports_when_to_retry(monkeypatch, clock):
+    monkeypatch.setattr(jobqueue.time, 'monotonic', clock)
+    queue = make_queue({'y0': {'origin': 'youtube'}, 'y1': {'origin': 'youtube'}})
+    queue.limiter.rate_limits = {'youtube': (0.25, 1.0)}
+    queue.push('y0')
+    queue.push('y1')
+    assert queue.pop() == 'y0'
+    assert queue.pop() is None
+    assert queue.retry_in == pytest.approx(4)
+    clock.advance(4)
+    assert queue.pop() == 'y1'
+    assert queue.retry_in is None
+
+
+@pytest.fixture
+def sjf(monkeypatch, clock):
+    monkeypatch.setattr(jobqueue, 'QUEUE_ORDER', 'sjf')
+    monkeypatch.setattr(jobqueue, 'SJF_AGING_RATE', 1.0)
+    monkeypatch.setattr(jobqueue.time, 'monotonic', clock)
+    return clock
+
+
+def test_sjf_starts_the_shortest_job_first(sjf):
+    jobs = {'long': {'expected_seconds': 300}, 'short': {'expected_seconds': 10},
+            'medium': {'expected_seconds': 60}}
+    queue = make_queue(jobs)
+    for job_id in ('long', 'short', 'medium'):
+        queue.push(job_id)
+    assert pop_all(queue) == ['short', 'medium', 'long']
+
+
+def test_sjf_aging_lets_long_jobs_start_eventually(sjf):
+    jobs = {'long': {'expected_seconds': 100}}
+    jobs.update({f'short{i}': {'expected_seconds': 10} for i in range(20)})
+    queue = make_queue(jobs)
+    queue.push('long')
+    started = []
+    # A steady stream of short jobs, one arriving every 10 seconds
+    for i in range(20):
+        queue.push(f'short{i}')
+        job_id = queue.pop()
+        queue.task_done(job_id)
+        started.append(job_id)
+        sjf.advance(10)
+    # Waiting 90s earns 'long' enough credit to tie a fresh 10s job, and it was queued first
+    assert started.index('long') == 9
+
+
+def test_limiter_wait_is_labelled_by_origin_label():
+    jobs = {'a': {'origin': 'example.com', 'origin_label': 'generic'},
+            'b': {'origin': 'example.org', 'origin_label': 'generic'}}
+    queue = make_queue(jobs)
+    for job_id in ('a', 'b'):
+        queue.push(job_id)
+    pop_all(queue)
+    labels = set(jobqueue.metrics.LIMITER_WAIT._children)
+    assert ('generic',) in labels
+    assert ('example.com',) not in labels and ('example.org',) not in labels
@@ -0,0 +1,131 @@
+# tests/test_pipemux.py
+
+import os
+import time
+
+import pytest
+
+import pipemux
+from pipemux import PipeMultiplexer
+
+
+def wait_for(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError("timed out")
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def mux():
+    return PipeMultiplexer()
+
+
+@pytest.fixture
+def pipe():
+    """Makes os.pipe() pairs: pipe() -> (binary read file for the mux, write fd)."""
+    write_fds = []
+
+    def make():
+        read_fd, write_fd = os.pipe()
+        write_fds.append(write_fd)
+        return os.fdopen(read_fd, 'rb', buffering=0), write_fd
+    yield make
+    for write_fd in write_fds:
+        try:
+            os.close(write_fd)
+        except OSError:
+            pass
+
+
+def test_lines_split_across_writes_are_joined(mux, pipe):
+    read_file, write_fd = pipe()
+    lines = []
+    closed = mux.register([(read_file, lines.append)])
+    for part in (b'{"status": ', b'"downloading"}\nsec', b'ond', b'\r\nthird\n'):
+        os.write(write_fd, part)
+        time.sleep(0.02)
+    os.close(write_fd)
+    assert closed.wait(5)
+    assert lines == ['{"status": "downloading"}', 'second', 'third']
+
+
+def test_final_unterminated_line_is_dispatched_at_eof(mux, pipe):
+    read_file, write_fd = pipe()
+    lines = []
+    closed = mux.register([(read_file, lines.append)])
+    os.write(write_fd, b'first\nERROR: no newline')
+    os.close(write_fd)
+    assert closed.wait(5)
+    assert lines == ['first', 'ERROR: no newline']
+    assert read_file.closed
+
+
+def test_line_longer_than_many_reads(mux, pipe, monkeypatch):
+    monkeypatch.setattr(pipemux, 'READ_CHUNK_BYTES', 1024)
+    read_file, write_fd = pipe()
+    lines = []
+    closed = mux.register([(read_file, lines.append)])
+    info = b'{"title": "' + b'x' * 50_000 + b'"}'
+    for start in range(0, len(info), 4096):
+        os.write(write_fd, info[start:start + 4096])
+    os.write(write_fd, b'\n{"status": "finished"}\n')
+    os.close(write_fd)
+    assert closed.wait(5)
+    assert lines == [info.decode(), '{"status": "finished"}']
+
+
+def test_eof_on_one_pipe_while_the_other_stays_open(mux, pipe):
+    stdout, stdout_fd = pipe()
+    stderr, stderr_fd = pipe()
+    out, err = [], []
+    closed = mux.register([(stdout, out.append), (stderr, err.append)])
+    os.write(stderr_fd, b'[download] Destination: clip.mp4\nWARNING: last')
+    os.close(stderr_fd)
+    wait_for(lambda: stderr.closed)
+    assert err == ['[download] Destination: clip.mp4', 'WARNING: last']
+    assert not closed.is_set()
+    assert mux.stream_count() == 1
+    # stdout keeps being read after stderr is gone
+    os.write(stdout_fd, b'{"downloaded_bytes": 1}\n')
+    wait_for(lambda: out == ['{"downloaded_bytes": 1}'])
+    assert not closed.is_set()
+    os.close(stdout_fd)
+    assert closed.wait(5)
+    assert mux.stream_count() == 0
+
+
+def test_processes_are_tracked_separately(mux, pipe):
+    first, first_fd = pipe()
+    second, second_fd = pipe()
+    lines = []
+    first_closed = mux.register([(first, lambda line: lines.append(('first', line)))])
+    second_closed = mux.register([(second, lambda line: lines.append(('second', line)))])
+    os.write(second_fd, b'b\n')
+    os.close(second_fd)
+    assert second_closed.wait(5)
+    assert not first_closed.is_set()
+    os.write(first_fd, b'a\n')
+    os.close(first_fd)
+    assert first_closed.wait(5)
+    assert sorted(lines) == [('first', 'a'), ('second', 'b')]
+
+
+def test_a_failing_callback_does_not_stop_the_stream(mux, pipe):
+    read_file, write_fd = pipe()
+    lines = []
+
+    def on_line(line):
+        if line == 'bad':
+            raise ValueError(line)
+        lines.append(line)
+    closed = mux.register([(read_file, on_line)])
+    os.write(write_fd, b'good\nbad\n\xffafter\n')
+    os.close(write_fd)
+    assert closed.wait(5)
+    assert lines == ['good', '\ufffdafter']
+
+
+def test_register_nothing(mux):
+    assert mux.register([]).is_set()
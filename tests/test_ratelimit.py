@@ -0,0 +1,76 @@
+# tests/test_ratelimit.py
+
+import pytest
+
+import ratelimit
+from ratelimit import OriginLimiter, TokenBucket
+
+
+def test_parse_origin_limits():
+    assert ratelimit._parse_origin_limits('YouTube=4, default=8,bad=x,novalue', int) == {
+        'youtube': 4, 'default': 8}
+    assert ratelimit._parse_origin_limits('youtube=0.5:4,vimeo=2', ratelimit._parse_rate) == {
+        'youtube': (0.5, 4.0), 'vimeo': (2.0, 1.0)}
+
+
+@pytest.mark.parametrize('value', ['0', '-1', '1:0', 'fast'])
+def test_parse_rate_rejects_invalid(value):
+    with pytest.raises(ValueError):
+        ratelimit._parse_rate(value)
+
+
+def test_token_bucket_allows_a_burst_then_refills():
+    bucket = TokenBucket(rate=0.5, burst=2)
+    for _ in range(2):
+        assert bucket.available(0)
+        bucket.take(0)
+    assert not bucket.available(0)
+    assert bucket.wait_time(0) == pytest.approx(2)
+    assert bucket.wait_time(1) == pytest.approx(1)
+    assert bucket.available(2)
+    # Never refills past the burst
+    assert bucket.wait_time(100) == 0
+    assert bucket.tokens == 2
+
+
+def test_concurrency_cap_per_origin():
+    limiter = OriginLimiter(max_concurrency={'youtube': 2, 'default': 1}, rate_limits={})
+    limiter.acquire('youtube', 0)
+    assert limiter.blocked('YouTube', 0) is None
+    limiter.acquire('youtube', 0)
+    assert limiter.blocked('youtube', 0) == 'concurrency'
+    limiter.release('youtube')
+    assert limiter.blocked('youtube', 0) is None
+    # Origins not listed fall under 'default', each on its own count
+    limiter.acquire('vimeo', 0)
+    assert limiter.blocked('vimeo', 0) == 'concurrency'
+    assert limiter.blocked('twitch', 0) is None
+
+
+def test_release_forgets_idle_origins():
+    limiter = OriginLimiter(max_concurrency={}, rate_limits={})
+    limiter.acquire('youtube', 0)
+    limiter.release('youtube')
+    limiter.release('youtube')
+    assert limiter.running == {}
+
+
+def test_start_rate_per_origin():
+    limiter = OriginLimiter(max_concurrency={}, rate_limits={'youtube': (0.5, 1.0)})
+    assert limiter.blocked('youtube', 0) is None
+    limiter.acquire('youtube', 0)
+    assert limiter.blocked('youtube', 1) == 'rate'
+    assert limiter.retry_in('youtube', 1) == pytest.approx(1)
+    assert limiter.blocked('youtube', 2) is None
+    # Unlimited origins have no bucket to wait on
+    assert limiter.blocked('vimeo', 1) is None
+    assert limiter.retry_in('vimeo', 1) is None
+
+
+def test_no_limits_by_default(monkeypatch):
+    monkeypatch.setattr(ratelimit, 'ORIGIN_MAX_CONCURRENCY', {})
+    monkeypatch.setattr(ratelimit, 'ORIGIN_RATE_LIMITS', {})
+    limiter = OriginLimiter()
+    for _ in range(100):
+        assert limiter.blocked('youtube', 0) is None
+        limiter.acquire('youtube', 0)
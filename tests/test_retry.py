@@ -0,0 +1,201 @@
+# tests/test_retry.py
+
+import pytest
+
+import retry
+
+
+@pytest.mark.parametrize('stderr, category', [
+    ("ERROR: [youtube] abc: Unable to download webpage: HTTP Error 429: Too Many Requests", 'throttled'),
+    ("ERROR: [youtube] abc: Sign in to confirm you're not a bot", 'throttled'),
+    ("ERROR: unable to download video data: HTTP Error 403: Forbidden", 'forbidden'),
+    ("ERROR: [youtube] abc: Video unavailable", 'unavailable'),
+    ("ERROR: [generic] Unsupported URL: https://example.com/", 'unavailable'),
+    ("ERROR: unable to download video data: <urlopen error [Errno 111] Connection refused>", 'network'),
+    ("ERROR: unable to download video data: HTTP Error 503: Service Unavailable", 'network'),
+    ("ERROR: [youtube] abc: Unable to extract uploader id; please report this issue", 'extractor'),
+    ("ERROR: something nobody has seen before", 'unknown'),
+    ("", 'unknown'),
+    (None, 'unknown'),
+])
+def test_classify_error(stderr, category):
+    assert retry.classify_error(stderr) == category
+
+
+def test_classify_error_only_reads_error_lines_when_present():
+    stderr = "\n".join([
+        "[debug] Request headers: Forbidden-Header: 1",
+        "[download] Got error: HTTP Error 403: Forbidden. Retrying (1/10)...",
+        "ERROR: unable to download video data: <urlopen error timed out>",
+    ])
+    assert retry.classify_error(stderr) == 'network'
+
+
+def test_classify_error_falls_back_to_all_lines():
+    assert retry.classify_error("WARNING: HTTP Error 429: Too Many Requests") == 'throttled'
+
+
+def test_classify_error_first_matching_category_wins():
+    assert retry.classify_error("ERROR: HTTP Error 429 after HTTP Error 403") == 'throttled'
+
+
+@pytest.mark.parametrize('category, retryable', [
+    ('throttled', True), ('forbidden', True), ('network', True),
+    ('unavailable', False), ('extractor', False), ('unknown', False),
+])
+def test_is_retryable(category, retryable):
+    assert retry.is_retryable(category) is retryable
+
+
+def test_backoff_delay_grows_with_attempts_and_stays_within_bounds(monkeypatch):
+    monkeypatch.setattr(retry, 'BACKOFF_BASE_SECONDS', 2)
+    monkeypatch.setattr(retry, 'BACKOFF_CAP_SECONDS', 20)
+    # Full jitter draws uniformly from [base / 2, ceiling]; pin it to the ceiling
+    monkeypatch.setattr(retry.random, 'uniform', lambda low, high: high)
+    assert [retry.backoff_delay(attempt) for attempt in range(1, 6)] == [2, 4, 8, 16, 20]
+    monkeypatch.setattr(retry.random, 'uniform', lambda low, high: low)
+    assert retry.backoff_delay(5) == 1
+
+
+def test_backoff_delay_starts_higher_when_throttled(monkeypatch):
+    monkeypatch.setattr(retry, 'THROTTLE_BACKOFF_BASE_SECONDS', 15)
+    monkeypatch.setattr(retry, 'BACKOFF_CAP_SECONDS', 120)
+    monkeypatch.setattr(retry.random, 'uniform', lambda low, high: high)
+    assert retry.backoff_delay(1, 'throttled') == 15
+    assert retry.backoff_delay(2, 'throttled') == 30
+    assert retry.backoff_delay(5, 'throttled') == 120
+
+
+def test_backoff_delay_is_random_within_range():
+    for attempt in range(1, 8):
+        delay = retry.backoff_delay(attempt)
+        assert retry.BACKOFF_BASE_SECONDS / 2 <= delay <= retry.BACKOFF_CAP_SECONDS
+
+
+@pytest.fixture
+def breaker(monkeypatch, clock):
+    monkeypatch.setattr(retry.time, 'monotonic', clock)
+    return retry.CircuitBreaker('site', failure_threshold=3, cooldown=60)
+
+
+def test_breaker_opens_after_consecutive_failures(breaker):
+    for _ in range(2):
+        breaker.record_failure('network')
+        assert breaker.state == 'closed'
+        assert breaker.allow_request()
+    breaker.record_failure('throttled')
+    assert breaker.state == 'open'
+    assert breaker.is_open()
+    assert not breaker.allow_request()
+
+
+def test_breaker_success_resets_the_count(breaker):
+    breaker.record_failure('network')
+    breaker.record_failure('network')
+    breaker.record_success()
+    breaker.record_failure('network')
+    assert breaker.state == 'closed'
+    assert breaker.consecutive_failures == 1
+
+
+def test_breaker_ignores_failures_that_say_nothing_about_the_origin(breaker):
+    for _ in range(5):
+        breaker.record_failure('unavailable')
+        breaker.record_failure('cancelled')
+    assert breaker.state == 'closed'
+    assert breaker.consecutive_failures == 0
+
+
+def test_breaker_half_opens_after_cooldown_with_a_single_probe(breaker, clock):
+    for _ in range(3):
+        breaker.record_failure('network')
+    clock.advance(30)
+    assert not breaker.allow_request()
+    assert breaker.retry_after() == pytest.approx(30)
+    clock.advance(30)
+    assert not breaker.is_open()
+    assert breaker.allow_request()
+    assert breaker.state == 'half_open'
+    # The probe is running: nobody else gets through
+    assert breaker.is_open()
+    assert not breaker.allow_request()
+
+
+def test_breaker_probe_success_closes(breaker, clock):
+    for _ in range(3):
+        breaker.record_failure('network')
+    clock.advance(60)
+    assert breaker.allow_request()
+    breaker.record_success()
+    assert breaker.state == 'closed'
+    assert breaker.retry_after() == 0
+    assert breaker.allow_request()
+
+
+def test_breaker_probe_failure_reopens(breaker, clock):
+    for _ in range(3):
+        breaker.record_failure('network')
+    clock.advance(60)
+    assert breaker.allow_request()
+    breaker.record_failure('forbidden')
+    assert breaker.state == 'open'
+    assert breaker.retry_after() == pytest.approx(60)
+
+
+def test_breaker_probe_with_an_unrelated_failure_frees_the_slot(breaker, clock):
+    for _ in range(3):
+        breaker.record_failure('network')
+    clock.advance(60)
+    assert breaker.allow_request()
+    breaker.record_failure('unavailable')
+    assert breaker.state == 'half_open'
+    assert breaker.allow_request()
+
+
+def test_get_breaker_returns_one_breaker_per_key():
+    assert retry.get_breaker('test-key-a') is retry.get_breaker('test-key-a')
+    assert retry.get_breaker('test-key-a') is not retry.get_breaker('test-key-b')
+
+
+def test_extractor_key_falls_back_to_the_host():
+    assert retry.extractor_key('https://www.example.com/video.mp4') == 'example.com'
+
+
+def test_extractor_key_looks_each_url_up_once(monkeypatch):
+    calls = []
+
+    class FakeExtractor:
+        @classmethod
+        def suitable(cls, url):
+            calls.append(url)
+            return 'youtube.com/watch' in url
+
+        @classmethod
+        def ie_key(cls):
+            return 'Youtube'
+
+    monkeypatch.setattr(retry, '_extractor_classes', [FakeExtractor])
+    retry._match_extractor.cache_clear()
+    try:
+        for _ in range(3):
+            assert retry.extractor_key('https://www.youtube.com/watch?v=dQw4w9WgXcQ') == 'Youtube'
+            assert retry.extractor_key('https://www.example.com/video.mp4') == 'example.com'
+        assert len(calls) == 2
+    finally:
+        retry._match_extractor.cache_clear()
+
+
+@pytest.mark.parametrize('url, origin, label', [
+    ('https://www.youtube.com/watch?v=dQw4w9WgXcQ', 'youtube', 'youtube'),
+    ('https://www.youtube.com/playlist?list=PL59FEE129ADFF2B12', 'youtube', 'youtube'),
+    ('https://www.youtube.com/watch?v=dQw4w', 'youtube', 'youtube'),
+    ('https://youtu.be/dQw4w9WgXcQ', 'youtube', 'youtube'),
+    ('https://vimeo.com/76979871', 'vimeo', 'vimeo'),
+    ('https://cdn.example.co.uk/a.mp4', 'example.co.uk', 'generic'),
+    ('https://a.b.example.com/video.mp4', 'example.com', 'generic'),
+    ('http://127.0.0.1:8799/progressive.mp4', '127.0.0.1', 'generic'),
+])
+def test_origin_key_groups_a_site_under_one_family(url, origin, label):
+    pytest.importorskip('yt_dlp')
+    assert retry.origin_key(url) == origin
+    assert retry.origin_label(url) == label
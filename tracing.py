@@ -0,0 +1,121 @@
+# tracing.py
+
+import os
+import time
+import logging
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Tracing is opt-in and needs opentelemetry-sdk installed
+# (plus opentelemetry-exporter-otlp for TRACES_EXPORTER=otlp).
+ENABLE_TRACING = os.environ.get('ENABLE_TRACING', '0') == '1'
+# 'file' writes one JSON span per line to TRACES_FILE, 'console' prints to stdout,
+# 'otlp' ships to an OTLP/HTTP collector (OTEL_EXPORTER_OTLP_ENDPOINT)
+TRACES_EXPORTER = os.environ.get('TRACES_EXPORTER', 'file')
+TRACES_FILE = os.environ.get('TRACES_FILE', 'traces.ndjson')
+SERVICE_NAME = os.environ.get('OTEL_SERVICE_NAME', 'flask-downloader')
+
+try:
+    from opentelemetry import trace, context as otel_context, propagate
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor, SimpleSpanProcessor, ConsoleSpanExporter
+
+    HAS_OPENTELEMETRY = True
+except ImportError:
+    HAS_OPENTELEMETRY = False
+
+_tracer = None
+
+
+def setup_tracing():
+    """
+    Installs the tracer provider and exporter. Safe to call when tracing is
+    disabled or OpenTelemetry isn't installed; spans then become no-ops.
+    """
+    global _tracer
+    if not ENABLE_TRACING:
+        return False
+    if not HAS_OPENTELEMETRY:
+        logger.warning("ENABLE_TRACING is set but opentelemetry-sdk is not installed; tracing disabled.")
+        return False
+    if _tracer is not None:
+        return True
+
+    provider = TracerProvider(resource=Resource.create({'service.name': SERVICE_NAME}))
+    if TRACES_EXPORTER == 'otlp':
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+    elif TRACES_EXPORTER == 'console':
+        provider.add_span_processor(SimpleSpanProcessor(ConsoleSpanExporter()))
+    else:
+        traces_file = open(TRACES_FILE, 'a', buffering=1)
+        exporter = ConsoleSpanExporter(out=traces_file, formatter=lambda span: span.to_json(indent=None) + '\n')
+        provider.add_span_processor(SimpleSpanProcessor(exporter))
+    trace.set_tracer_provider(provider)
+    _tracer = trace.get_tracer(__name__)
+
+    # The storage client reads its own switch at import time; flip it so
+    # GCS request spans nest under our upload spans
+    try:
+        from google.cloud.storage import _opentelemetry_tracing
+        _opentelemetry_tracing.enable_otel_traces = True
+    except ImportError:
+        pass
+    logger.info(f"Tracing enabled ({TRACES_EXPORTER} exporter)")
+    return True
+
+
+def enabled():
+    return _tracer is not None
+
+
+@contextmanager
+def span(name, attributes=None, parent_headers=None):
+    """
+    Starts a span as the current span. `parent_headers` (e.g. Flask request
+    headers) are checked for an incoming W3C traceparent. Yields None when
+    tracing is off.
+    """
+    if _tracer is None:
+        yield None
+        return
+    parent = None
+    if parent_headers is not None:
+        # The default propagator getter is case-sensitive; W3C header names are lower-case
+        parent = propagate.extract({key.lower(): value for key, value in parent_headers.items()})
+    with _tracer.start_as_current_span(name, context=parent, attributes=attributes or {}) as current:
+        yield current
+
+
+def record_span(name, start_monotonic, end_monotonic, attributes=None):
+    """
+    Records an already finished span from two time.monotonic() marks, as a
+    child of the current span. Used for yt-dlp stages that are only known
+    after the fact from its output.
+    """
+    if _tracer is None or start_monotonic is None or end_monotonic is None:
+        return
+    offset_ns = time.time_ns() - time.monotonic_ns()
+    finished = _tracer.start_span(name, attributes=attributes or {},
+                                  start_time=int(start_monotonic * 1e9) + offset_ns)
+    finished.end(end_time=int(end_monotonic * 1e9) + offset_ns)
+
+
+def current_context():
+    """Captures the active trace context so a background thread can continue it."""
+    return otel_context.get_current() if _tracer is not None else None
+
+
+@contextmanager
+def attached(trace_context):
+    """Makes `trace_context` (from current_context()) active in this thread."""
+    if _tracer is None or trace_context is None:
+        yield
+        return
+    token = otel_context.attach(trace_context)
+    try:
+        yield
+    finally:
+        otel_context.detach(token)
@@ -0,0 +1,132 @@
+# watchdog.py
+
+import os
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# --- Watchdog configuration ---
+CHECK_INTERVAL_SECONDS = float(os.environ.get('WATCHDOG_CHECK_INTERVAL_SECONDS', 10))
+# A job is stalled when it downloads less than STALL_MIN_BYTES_PER_SECOND
+# on average over a full STALL_WINDOW_SECONDS window
+STALL_WINDOW_SECONDS = float(os.environ.get('STALL_WINDOW_SECONDS', 120))
+STALL_MIN_BYTES_PER_SECOND = float(os.environ.get('STALL_MIN_BYTES_PER_SECOND', 10 * 1024))
+# 'restart' kills the attempt and lets the retry policy run it again, 'kill' fails the job
+STALL_ACTION = os.environ.get('STALL_ACTION', 'restart')
+
+
+def _parse_job_timeouts(value):
+    """Parses 'default=7200,audio=900' into {'default': 7200.0, 'audio': 900.0}."""
+    timeouts = {}
+    for item in value.split(','):
+        if '=' not in item:
+            continue
+        job_class, seconds = item.split('=', 1)
+        try:
+            timeouts[job_class.strip()] = float(seconds)
+        except ValueError:
+            logger.warning(f"Ignoring invalid JOB_TIMEOUTS entry: {item!r}")
+    return timeouts
+
+
+# Hard wall-clock limit per attempt, by job class
+JOB_TIMEOUTS = _parse_job_timeouts(os.environ.get('JOB_TIMEOUTS', 'default=7200'))
+
+# Stall/timeout events seen since startup, by reason
+stall_events = {'stalled': 0, 'timeout': 0}
+
+
+def job_timeout(job_class):
+    return JOB_TIMEOUTS.get(job_class, JOB_TIMEOUTS.get('default'))
+
+
+class StallWatchdog:
+    """
+    Periodically inspects running jobs and stops the ones that stopped making
+    progress or ran past their class's wall-clock limit.
+
+    Args:
+        running_jobs (callable): Returns (job_id, job, context) for every job
+            whose process is currently running.
+        stop_job (callable): stop_job(job_id, reason) kills the job's process;
+            reason is 'stalled' or 'timeout'.
+    """
+
+    def __init__(self, running_jobs, stop_job, interval=CHECK_INTERVAL_SECONDS):
+        self._running_jobs = running_jobs
+        self._stop_job = stop_job
+        self.interval = interval
+        # job_id -> (window start time, downloaded bytes at window start)
+        self._windows = {}
+        self._started = False
+        self._lock = threading.Lock()
+
+    def start(self, call_every=None):
+        """
+        Starts the periodic checks on a thread of their own, or, given a
+        `call_every(interval, fn)` scheduler (the asyncio runner's), as a
+        timer on that runner's event loop.
+        """
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+            if call_every is not None:
+                call_every(self.interval, self._safe_check)
+            else:
+                threading.Thread(target=self._loop, name="stall-watchdog", daemon=True).start()
+        logger.info(f"Stall watchdog started (window={STALL_WINDOW_SECONDS}s, "
+                    f"min rate={STALL_MIN_BYTES_PER_SECOND}B/s, action={STALL_ACTION})")
+
+    def _loop(self):
+        while True:
+            time.sleep(self.interval)
+            self._safe_check()
+
+    def _safe_check(self):
+        try:
+            self.check()
+        except Exception as e:
+            logger.error(f"Stall watchdog check failed: {e}", exc_info=True)
+
+    def check(self, now=None):
+        now = time.monotonic() if now is None else now
+        seen = set()
+        for job_id, job, context in self._running_jobs():
+            attempt_key = (job_id, job['attempts'])
+            seen.add(attempt_key)
+            started_at = context['attempt_started_at']
+            downloaded = job.get('downloaded_bytes', 0)
+
+            limit = job_timeout(context.get('job_class', 'default'))
+            if limit and now - started_at > limit:
+                self._record(job_id, job, 'timeout', {'elapsed': round(now - started_at, 1), 'limit': limit})
+                continue
+
+            window_start, window_bytes = self._windows.setdefault(attempt_key, (started_at, 0))
+            if context.get('postprocessing'):
+                # ffmpeg merges download nothing; restart the window once they finish
+                self._windows[attempt_key] = (now, downloaded)
+                continue
+            elapsed = now - window_start
+            if elapsed < STALL_WINDOW_SECONDS:
+                continue
+            rate = (downloaded - window_bytes) / elapsed
+            if rate < STALL_MIN_BYTES_PER_SECOND:
+                self._record(job_id, job, 'stalled', {'bytes_per_second': round(rate, 1), 'window': round(elapsed, 1)})
+            else:
+                self._windows[attempt_key] = (now, downloaded)
+
+        for attempt_key in list(self._windows):
+            if attempt_key not in seen:
+                del self._windows[attempt_key]
+
+    def _record(self, job_id, job, reason, details):
+        stall_events[reason] += 1
+        event = {'event': reason, 'attempt': job['attempts']}
+        event.update(details)
+        job['history'].append(event)
+        logger.warning(f"Job {job_id} {reason}: {details}")
+        self._stop_job(job_id, reason)